@@ -0,0 +1,73 @@
+"""Configuration for the LLM Council."""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# OpenRouter API key
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+
+# Council members - list of OpenRouter model identifiers
+COUNCIL_MODELS = [
+    "openai/gpt-5.1",
+    "google/gemini-3-pro-preview",
+    "anthropic/claude-sonnet-4.5",
+    "x-ai/grok-4",
+]
+
+# Chairman model - synthesizes final response
+CHAIRMAN_MODEL = "google/gemini-3-pro-preview"
+
+# Fast model used to generate conversation titles
+TITLE_MODEL = "google/gemini-2.5-flash"
+
+# Upper bound in seconds for each model call in a stage, retries included
+STAGE_DEADLINES = {
+    "stage1": 120.0,
+    "stage2": 120.0,
+    "stage3": 180.0,
+}
+
+# Stage 1 quorum - stage 2 starts once this many council answers are in
+# (None = wait for every member) or once the latency budget has expired
+STAGE1_QUORUM = None
+STAGE1_BUDGET_SECONDS = None
+
+# What to do with stage 1 answers that miss the quorum: "drop" them, or fold
+# them into a "followup" review round after stage 2
+LATE_STAGE1_POLICY = "drop"
+
+# Default cost budget per council run in USD (None = unlimited). When set, or
+# when a request passes budget_usd, the run caps max_tokens, drops the most
+# expensive members or skips stage 2 to stay within it
+BUDGET_USD = None
+
+# Data directory for conversation storage
+DATA_DIR = "data/conversations"
+
+# Storage backend: "json" (files under DATA_DIR) or "sqlite" (a database at SQLITE_PATH)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+SQLITE_PATH = "data/council.db"
+
+# Size of the thread pool that runs blocking storage I/O off the event loop
+STORAGE_MAX_THREADS = 8
+
+# Response cache - identical (model, prompt, params) calls are answered from an
+# in-memory LRU tier, backed by an on-disk tier in CACHE_DIR (a sibling of
+# DATA_DIR, so conversation scans never see cache files)
+CACHE_ENABLED = True
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL_SECONDS = 3600
+CACHE_DIR = os.getenv("COUNCIL_CACHE_DIR", "data/cache")
+CACHE_DISK_MAX_BYTES = 256 * 1024 * 1024
+CACHE_DISK_TTL_SECONDS = 7 * 24 * 3600
+
+# Streamed turns run on after the client disconnects; a finished turn's events
+# stay available this long for a client that reconnects with Last-Event-ID
+STREAM_RETENTION_SECONDS = 300
+
+# Job mode: POST .../message/job queues a turn in a SQLite database at
+# JOB_DB_PATH and returns at once; JOB_WORKERS turns run at a time
+JOB_DB_PATH = "data/jobs.db"
+JOB_WORKERS = 2
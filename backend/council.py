@@ -0,0 +1,395 @@
+"""3-stage LLM Council orchestration for the local backend.
+
+The stages themselves live in `functions/council.py` so the FastAPI app and the
+Cloud Function share one async engine and one pooled OpenRouter client. This
+module binds them to the backend's configuration.
+"""
+
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple
+
+from functions import accounting
+from functions import cache
+from functions import context
+from functions import council as engine
+from functions import selection
+from functions import singleflight
+from functions.accounting import start_ledger as start_usage
+from functions.cache import start_stats as start_cache_stats
+from functions.compaction import start_stats as start_compaction_stats
+from functions.council import calculate_aggregate_rankings
+from functions.governor import set_flow as set_request_flow
+from .config import (
+    COUNCIL_MODELS, CHAIRMAN_MODEL, TITLE_MODEL, OPENROUTER_API_KEY,
+    STAGE1_QUORUM, STAGE1_BUDGET_SECONDS, LATE_STAGE1_POLICY, STAGE_DEADLINES, BUDGET_USD,
+    CACHE_ENABLED, CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, CACHE_DIR, CACHE_DISK_MAX_BYTES, CACHE_DISK_TTL_SECONDS,
+)
+
+cache.configure(
+    enabled=CACHE_ENABLED,
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl=CACHE_TTL_SECONDS,
+    disk_dir=CACHE_DIR,
+    disk_max_bytes=CACHE_DISK_MAX_BYTES,
+    disk_ttl=CACHE_DISK_TTL_SECONDS,
+)
+
+
+def select_council(user_query: str, budget_usd: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Choose which members of COUNCIL_MODELS answer a question, when adaptive selection is on.
+
+    Args:
+        user_query: The user's question
+        budget_usd: Budget for the run in USD (None falls back to BUDGET_USD in config)
+
+    Returns:
+        The selection (see functions/selection.py), whose "council_models" are
+        the members to query, or None when every member is queried
+    """
+    if not 0 < selection.SELECTION_SIZE < len(COUNCIL_MODELS):
+        return None
+    budget_usd = BUDGET_USD if budget_usd is None else budget_usd
+    return selection.select(COUNCIL_MODELS, selection.SELECTION_SIZE, CHAIRMAN_MODEL, user_query, budget_usd)
+
+
+def observe_council(
+    council_models: Optional[List[str]],
+    stage1_results: List[Dict[str, Any]],
+    aggregate_rankings: List[Dict[str, Any]]
+):
+    """
+    Record how the queried members did, for later selections.
+
+    Args:
+        council_models: The members that were queried (None for all of COUNCIL_MODELS)
+        stage1_results: Results from Stage 1
+        aggregate_rankings: Aggregate rankings from Stage 2
+    """
+    selection.observe(council_models or COUNCIL_MODELS, stage1_results, aggregate_rankings)
+
+
+def plan_budget(
+    user_query: str,
+    budget_usd: Optional[float] = None,
+    council_models: Optional[List[str]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Plan a council run that fits a cost budget.
+
+    Args:
+        user_query: The user's question
+        budget_usd: Budget for the run in USD (None falls back to BUDGET_USD in config)
+        council_models: Members to plan for (None for all of COUNCIL_MODELS)
+
+    Returns:
+        The budget plan (see functions/accounting.py), or None when no budget applies
+    """
+    budget_usd = BUDGET_USD if budget_usd is None else budget_usd
+    if budget_usd is None:
+        return None
+    return accounting.plan_budget(budget_usd, council_models or COUNCIL_MODELS, CHAIRMAN_MODEL, user_query)
+
+
+def replan_after_stage1(
+    user_query: str,
+    plan: Optional[Dict[str, Any]],
+    stage1_results: List[Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """
+    Decide, from the actual stage 1 answers and the cost so far, whether stage 2 still fits the budget.
+
+    Args:
+        user_query: The user's question
+        plan: Plan from plan_budget, or None
+        stage1_results: Results from Stage 1
+
+    Returns:
+        The updated plan; plan["skip_stage2"] tells whether to skip stage 2
+    """
+    ledger = accounting.current_ledger()
+    spent = ledger["total"]["cost"] if ledger else 0.0
+    return accounting.replan_after_stage1(plan, stage1_results, CHAIRMAN_MODEL, user_query, spent)
+
+
+def _council_models(plan: Optional[Dict[str, Any]], council_models: Optional[List[str]] = None) -> List[str]:
+    return plan["council_models"] if plan else council_models or COUNCIL_MODELS
+
+
+def _max_tokens(plan: Optional[Dict[str, Any]], stage: str) -> Optional[int]:
+    return plan["max_tokens"].get(stage) if plan else None
+
+
+async def stage1_collect_responses(
+    user_query: str,
+    on_delta=None,
+    plan: Optional[Dict[str, Any]] = None,
+    council_models: Optional[List[str]] = None
+) -> Tuple[List[Dict[str, Any]], Dict[asyncio.Task, str], Dict[str, Any]]:
+    """
+    Stage 1: Collect individual responses until the configured quorum is met.
+
+    Args:
+        user_query: The user's question
+        on_delta: Optional async callback(model, text) receiving streamed tokens
+        plan: Optional budget plan from plan_budget
+        council_models: Members to query, from select_council (None for all of COUNCIL_MODELS)
+
+    Returns:
+        Tuple of (responses, late tasks, quorum decision). Pass the late tasks
+        to review_late_responses once stage 2 is done.
+    """
+    return await engine.stage1_collect_quorum(
+        _council_models(plan, council_models), user_query, OPENROUTER_API_KEY, STAGE1_QUORUM, STAGE1_BUDGET_SECONDS,
+        on_delta, keep_late=LATE_STAGE1_POLICY == "followup", deadline=STAGE_DEADLINES["stage1"],
+        max_tokens=_max_tokens(plan, "stage1")
+    )
+
+
+async def stage2_collect_rankings(
+    user_query: str,
+    stage1_results: List[Dict[str, Any]],
+    plan: Optional[Dict[str, Any]] = None,
+    council_models: Optional[List[str]] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    """
+    Stage 2: Each model ranks the anonymized responses.
+
+    Args:
+        user_query: The original user query
+        stage1_results: Results from Stage 1
+        plan: Optional budget plan from plan_budget
+        council_models: Reviewers, from select_council (None for all of COUNCIL_MODELS)
+
+    Returns:
+        Tuple of (rankings list, label_to_model mapping)
+    """
+    rankings, label_to_model, _ = await engine.stage2_collect_rankings(
+        stage1_results, user_query, OPENROUTER_API_KEY, _council_models(plan, council_models), STAGE_DEADLINES["stage2"],
+        _max_tokens(plan, "stage2")
+    )
+    return rankings, label_to_model
+
+
+async def review_late_responses(
+    user_query: str,
+    late_tasks: Dict[asyncio.Task, str],
+    stage1_results: List[Dict[str, Any]],
+    stage2_results: List[Dict[str, Any]],
+    label_to_model: Dict[str, str],
+    plan: Optional[Dict[str, Any]] = None,
+    council_models: Optional[List[str]] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, str], Dict[str, Any]]:
+    """
+    Drop the stage 1 answers that missed the quorum, or fold them into a follow-up review.
+
+    Args:
+        user_query: The original user query
+        late_tasks: Late stage 1 queries returned by stage1_collect_responses
+        stage1_results: On-time responses from Stage 1
+        stage2_results: Rankings from Stage 2
+        label_to_model: Label mapping from Stage 2
+        plan: Optional budget plan; late answers are dropped if it skipped stage 2
+        council_models: Reviewers, from select_council (None for all of COUNCIL_MODELS)
+
+    Returns:
+        Tuple of (stage1_results, stage2_results, label_to_model, late decision)
+    """
+    late_policy = "drop" if plan and plan["skip_stage2"] else LATE_STAGE1_POLICY
+    return await engine.stage2_review_late_responses(
+        late_tasks, stage1_results, stage2_results, label_to_model,
+        user_query, OPENROUTER_API_KEY, _council_models(plan, council_models), late_policy, STAGE_DEADLINES["stage2"],
+        _max_tokens(plan, "stage2")
+    )
+
+
+async def stage3_synthesize_final(
+    user_query: str,
+    stage1_results: List[Dict[str, Any]],
+    stage2_results: List[Dict[str, Any]],
+    on_delta=None,
+    plan: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Stage 3: Chairman synthesizes final response.
+
+    Args:
+        user_query: The original user query
+        stage1_results: Individual model responses from Stage 1
+        stage2_results: Rankings from Stage 2
+        on_delta: Optional async callback(model, text) receiving streamed tokens
+        plan: Optional budget plan from plan_budget
+
+    Returns:
+        Dict with 'model' and 'content' keys
+    """
+    return await engine.stage3_synthesize_final(
+        stage1_results, stage2_results, user_query, OPENROUTER_API_KEY, CHAIRMAN_MODEL,
+        on_delta, STAGE_DEADLINES["stage3"], _max_tokens(plan, "stage3")
+    )
+
+
+async def run_full_council(user_query: str, budget_usd: Optional[float] = None) -> Tuple[List, List, Dict, Dict]:
+    """
+    Run the complete 3-stage council process.
+
+    Args:
+        user_query: The user's question
+        budget_usd: Optional cost budget in USD (None falls back to BUDGET_USD in config)
+
+    Returns:
+        Tuple of (stage1_results, stage2_results, stage3_result, metadata)
+    """
+    return await engine.run_full_council(
+        COUNCIL_MODELS, CHAIRMAN_MODEL, user_query, OPENROUTER_API_KEY,
+        quorum=STAGE1_QUORUM, stage1_budget=STAGE1_BUDGET_SECONDS, late_policy=LATE_STAGE1_POLICY,
+        stage_deadlines=STAGE_DEADLINES, budget_usd=BUDGET_USD if budget_usd is None else budget_usd
+    )
+
+
+async def run_conversation_turn(
+    user_query: str,
+    context_state: Optional[Dict[str, Any]],
+    budget_usd: Optional[float] = None
+) -> Tuple[List, List, Dict, Dict, Dict]:
+    """
+    Run the complete 3-stage council process on a question in the context of its conversation.
+
+    Args:
+        user_query: The user's question
+        context_state: The conversation's context, from conversation_context()
+        budget_usd: Optional cost budget in USD (None falls back to BUDGET_USD in config)
+
+    Returns:
+        Tuple of (stage1_results, stage2_results, stage3_result, metadata, context_state),
+        where the new context state includes this turn
+    """
+    return await engine.run_conversation_turn(
+        COUNCIL_MODELS, CHAIRMAN_MODEL, user_query, OPENROUTER_API_KEY, context_state,
+        quorum=STAGE1_QUORUM, stage1_budget=STAGE1_BUDGET_SECONDS, late_policy=LATE_STAGE1_POLICY,
+        stage_deadlines=STAGE_DEADLINES, budget_usd=BUDGET_USD if budget_usd is None else budget_usd
+    )
+
+
+def coalescing_key(prompt: str, budget_usd: Optional[float] = None, **params) -> str:
+    """
+    Get the key under which identical council runs in flight are shared (see functions/singleflight.py).
+
+    Args:
+        prompt: The question as sent to the council, from context_prompt()
+        budget_usd: Budget for the run in USD (None falls back to BUDGET_USD in config)
+        **params: Anything else that changes the run, e.g. stream=True
+
+    Returns:
+        The coalescing key
+    """
+    return singleflight.key_for(
+        prompt, COUNCIL_MODELS, CHAIRMAN_MODEL, budget_usd=BUDGET_USD if budget_usd is None else budget_usd,
+        quorum=STAGE1_QUORUM, stage1_budget=STAGE1_BUDGET_SECONDS, late_policy=LATE_STAGE1_POLICY,
+        stage_deadlines=STAGE_DEADLINES, **params
+    )
+
+
+def conversation_context(conversation: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Get the rolling context (summary plus recent turns) to send with the next question.
+
+    Conversations stored before context was kept get one built from their last
+    few turns.
+
+    Args:
+        conversation: Conversation dict from storage
+
+    Returns:
+        Context state (see functions/context.py), or None for a new conversation
+    """
+    if conversation.get("context") is not None:
+        return conversation["context"]
+    state = None
+    messages = conversation["messages"]
+    for user, assistant in zip(messages[::2], messages[1::2]):
+        if user["role"] == "user" and assistant["role"] == "assistant":
+            state = context.add_turn(state, user.get("content", ""), (assistant.get("stage3") or {}).get("content"))
+    if state is not None:
+        state["offset"] = max(0, len(state["turns"]) - context.CONTEXT_TURNS)
+        state["turns"] = state["turns"][state["offset"]:]
+    return state
+
+
+def context_prompt(user_query: str, context_state: Optional[Dict[str, Any]]) -> str:
+    """
+    Build the question as sent to the council, with the conversation so far.
+
+    Args:
+        user_query: The user's question
+        context_state: The conversation's context, from conversation_context()
+
+    Returns:
+        The question, preceded by the summary and recent turns if there are any
+    """
+    return context.prompt_for(user_query, context_state)
+
+
+async def refresh_context(context_state: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Fold older turns into the rolling summary if it is stale.
+
+    Args:
+        context_state: The conversation's context
+
+    Returns:
+        The refreshed state, the same state if no refresh was due, or the state
+        with its window trimmed and the turns to fold left pending if it failed
+    """
+    return await context.refresh_summary(context_state, OPENROUTER_API_KEY)
+
+
+def add_context_turn(
+    context_state: Optional[Dict[str, Any]],
+    user_query: str,
+    stage3_result: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Add a finished turn to a conversation's context.
+
+    Args:
+        context_state: The conversation's context (refreshed, if a refresh ran)
+        user_query: The user's question
+        stage3_result: The chairman's final answer
+
+    Returns:
+        The new context state, to be stored with the conversation
+    """
+    return context.add_turn(context_state, user_query, stage3_result.get("content"))
+
+
+def merge_context(
+    current: Optional[Dict[str, Any]],
+    base: Optional[Dict[str, Any]],
+    updated: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Apply a turn's context update to the context as stored now, which concurrent turns may have changed.
+
+    Args:
+        current: The conversation's stored context
+        base: The context the turn started from
+        updated: The context after the turn, from add_context_turn() or run_conversation_turn()
+
+    Returns:
+        The context state to store
+    """
+    return context.merge(current, base, updated)
+
+
+async def generate_conversation_title(user_query: str) -> str:
+    """
+    Generate a short title for a conversation based on the first user message.
+
+    Args:
+        user_query: The first user message
+
+    Returns:
+        A short title (3-5 words)
+    """
+    return await engine.generate_conversation_title(user_query, OPENROUTER_API_KEY, TITLE_MODEL)
@@ -0,0 +1,84 @@
+"""File helpers shared by the file-based storage: advisory locks and atomic writes.
+
+Locks are taken with flock() on a separate ``{path}.lock`` file, so they are
+shared by every uvicorn worker on the host and keep working while the data file
+itself is replaced by a rename. An flock() belongs to an open file, so threads
+of the same process exclude each other as well. On platforms without fcntl the
+lock only covers the threads of the current process.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path: str, shared: bool = False):
+    """
+    Hold an advisory lock on a file for the duration of the block.
+
+    Locks are not reentrant: do not take the same lock twice in one call chain.
+
+    Args:
+        path: Path of the file being protected
+        shared: Take a shared (reader) lock instead of an exclusive one
+    """
+    lock_path = f"{path}.lock"
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(lock_path, threading.Lock())
+        with lock:
+            yield
+        return
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def write_atomic(path: str, payload: bytes):
+    """
+    Replace a file's contents so readers see either the old or the new version, even across a crash.
+
+    The payload goes to a temporary file unique to this process and thread,
+    is flushed to disk, and is then renamed over the target.
+
+    Args:
+        path: File to write
+        payload: Complete new contents
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_directory(os.path.dirname(path) or ".")
+
+
+def _fsync_directory(directory: str):
+    """Persist a rename by flushing the directory entry (a no-op where directories cannot be opened)."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
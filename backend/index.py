@@ -0,0 +1,168 @@
+"""Persistent metadata index for listing conversations.
+
+The index is an append-only JSON-lines file of conversation metadata records,
+where the last record for an id wins. Each process keeps the index in memory,
+sorted by creation time, and picks up records appended by other workers by
+reading only the new tail of the file, so listing a page costs O(page size).
+Once the file holds many superseded records it is rewritten atomically with one
+record per conversation. If the file is missing it is rebuilt from the
+conversations' own metadata. Appends and rewrites hold an advisory lock on the
+file, so a rewrite by one worker cannot drop a record another worker appended.
+"""
+
+import base64
+import bisect
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .files import file_lock, write_atomic
+
+# Fields kept in the index; everything the sidebar needs
+INDEX_FIELDS = ("id", "created_at", "title", "message_count")
+
+
+def encode_cursor(record: Dict[str, Any]) -> str:
+    """Encode the position just after a record as an opaque cursor."""
+    raw = json.dumps([record["created_at"], record["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        created_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return created_at, conversation_id
+
+
+class ConversationIndex:
+    """In-memory view of the on-disk index, kept in sync by tailing the file."""
+
+    def __init__(self, path: str, rebuild_source: Callable[[], Iterable[Dict[str, Any]]]):
+        """
+        Args:
+            path: Location of the index file
+            rebuild_source: Callable yielding the metadata of every stored conversation,
+                used when the index has to be rebuilt
+        """
+        self.path = path
+        self.rebuild_source = rebuild_source
+        self._lock = threading.Lock()
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._order: List[Tuple[str, str]] = []
+        self._offset = 0
+        self._inode = None
+        self._lines = 0
+
+    def _reset(self):
+        self._records = {}
+        self._order = []
+        self._offset = 0
+        self._lines = 0
+
+    def _apply(self, record: Dict[str, Any]):
+        if record["id"] not in self._records:
+            bisect.insort(self._order, (record["created_at"], record["id"]))
+        self._records[record["id"]] = record
+
+    def _refresh(self):
+        """Bring the in-memory view up to date with the file, reading only what is new."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._rebuild()
+            return
+
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # The file was rewritten (by us or another worker), start over
+            self._reset()
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Incomplete tail (a write in progress); read it next time
+                    break
+                self._offset += len(line)
+                self._lines += 1
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    # A torn line from a crash mid-append
+                    continue
+
+    def _write_all(self, records: Iterable[Dict[str, Any]]):
+        """Atomically replace the file with exactly one line per record."""
+        write_atomic(self.path, b"".join((json.dumps(record) + "\n").encode("utf-8") for record in records))
+        self._reset()
+        self._inode = None
+
+    def _rebuild(self):
+        self._write_all({field: meta[field] for field in INDEX_FIELDS} for meta in self.rebuild_source())
+        self._refresh()
+
+    def rebuild(self):
+        """Rebuild the index from the conversations' own metadata."""
+        with self._lock, file_lock(self.path):
+            self._rebuild()
+
+    def upsert(self, meta: Dict[str, Any]):
+        """
+        Record the latest metadata for a conversation.
+
+        Args:
+            meta: Conversation metadata; fields outside INDEX_FIELDS are ignored
+        """
+        record = {field: meta[field] for field in INDEX_FIELDS}
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with self._lock, file_lock(self.path):
+            self._refresh()
+            with open(self.path, 'a+b') as f:
+                # If a previous append was torn by a crash, start this record on a new line
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+                f.write(line)
+            # Reading our own line back also picks up anything other workers appended
+            self._refresh()
+
+            if self._lines > 2 * len(self._records) + 64:
+                self._write_all(self._records[conversation_id] for _, conversation_id in self._order)
+                self._refresh()
+
+    def page(self, limit: Optional[int] = None, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Return one page of conversations, newest first.
+
+        Args:
+            limit: Maximum number of conversations to return (None for all)
+            cursor: Cursor returned with the previous page, or None for the first page
+
+        Returns:
+            Tuple of (metadata records, cursor for the next page or None if this was the last)
+        """
+        with self._lock:
+            if os.path.exists(self.path):
+                self._refresh()
+            else:
+                # The refresh rebuilds the file; hold the file lock so workers do not race on it
+                with file_lock(self.path):
+                    self._refresh()
+            end = len(self._order) if cursor is None else bisect.bisect_left(self._order, decode_cursor(cursor))
+            start = 0 if limit is None else max(0, end - limit)
+            records = [self._records[conversation_id] for _, conversation_id in reversed(self._order[start:end])]
+
+        next_cursor = encode_cursor(records[-1]) if records and start > 0 else None
+        return records, next_cursor
@@ -1,18 +1,63 @@
 """FastAPI backend for LLM Council."""
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
 import uuid
 import json
 import asyncio
 
+from functions import accounting
+from functions import jobs
+from functions import leaderboard
+from functions import openrouter
+from functions import singleflight
+from functions import telemetry
+from functions.context import describe as describe_context
 from . import storage
-from .council import run_full_council, generate_conversation_title, stage1_collect_responses, stage2_collect_rankings, stage3_synthesize_final, calculate_aggregate_rankings
+from .config import STREAM_RETENTION_SECONDS, JOB_DB_PATH, JOB_WORKERS
+from .council import run_conversation_turn, conversation_context, context_prompt, refresh_context, add_context_turn, merge_context, generate_conversation_title, stage1_collect_responses, stage2_collect_rankings, review_late_responses, stage3_synthesize_final, calculate_aggregate_rankings, start_cache_stats, start_compaction_stats, start_usage, set_request_flow, select_council, observe_council, plan_budget, replan_after_stage1, coalescing_key
 
-app = FastAPI(title="LLM Council API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Run the job workers while the server is up; on shutdown, requeue their jobs,
+    release the pooled OpenRouter connections and export pending spans.
+    """
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    await openrouter.close_client()
+    await asyncio.to_thread(telemetry.flush)
+
+
+class TracingMiddleware:
+    """Trace each HTTP request as a root span, so storage and council spans of one request share a trace."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # A plain ASGI middleware (unlike BaseHTTPMiddleware) keeps the span open until a stream ends
+        with telemetry.span("http.request", method=scope["method"], path=scope["path"]) as request_span:
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    request_span.set(status=message["status"])
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
+
+
+app = FastAPI(title="LLM Council API", lifespan=lifespan)
+app.add_middleware(TracingMiddleware)
 
 # Enable CORS for local development
 app.add_middleware(
@@ -21,6 +66,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
@@ -32,6 +78,14 @@ class CreateConversationRequest(BaseModel):
 class SendMessageRequest(BaseModel):
     """Request to send a message in a conversation."""
     content: str
+    # Cost budget for this council run in USD (None = the configured default)
+    budget_usd: Optional[float] = None
+
+
+class SendJobRequest(SendMessageRequest):
+    """Request to queue a message's council run as a background job."""
+    # Queued jobs with a higher priority run first
+    priority: int = 0
 
 
 class ConversationMetadata(BaseModel):
@@ -56,37 +110,91 @@ async def root():
     return {"status": "ok", "service": "LLM Council API"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: stage, model call, cache and storage latencies and counters."""
+    return PlainTextResponse(telemetry.render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/conversations", response_model=List[ConversationMetadata])
-async def list_conversations():
-    """List all conversations (metadata only)."""
-    return storage.list_conversations()
+async def list_conversations(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None
+):
+    """
+    List conversations (metadata only), newest first.
+
+    Without a limit every conversation is returned. With a limit, the cursor for
+    the next page is returned in the X-Next-Cursor header.
+    """
+    try:
+        conversations, next_cursor = await storage.list_conversations_page(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return conversations
 
 
 @app.post("/api/conversations", response_model=Conversation)
 async def create_conversation(request: CreateConversationRequest):
     """Create a new conversation."""
     conversation_id = str(uuid.uuid4())
-    conversation = storage.create_conversation(conversation_id)
+    conversation = await storage.create_conversation(conversation_id)
     return conversation
 
 
 @app.get("/api/conversations/{conversation_id}", response_model=Conversation)
 async def get_conversation(conversation_id: str):
     """Get a specific conversation with all its messages."""
-    conversation = storage.get_conversation(conversation_id)
+    conversation = await storage.get_conversation(conversation_id)
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
     return conversation
 
 
+@app.get("/api/conversations/{conversation_id}/usage")
+async def get_conversation_usage(conversation_id: str):
+    """Get the tokens and cost of a conversation, in total and per assistant message."""
+    conversation = await storage.get_conversation(conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    messages = [
+        message.get("usage", {}).get("total")
+        for message in conversation["messages"]
+        if message["role"] == "assistant"
+    ]
+    return {"total": accounting.sum_usage(messages), "messages": messages}
+
+
+@app.get("/api/usage")
+async def get_usage():
+    """Get the tokens and cost of every model call this process has made."""
+    return accounting.global_totals()
+
+
+@app.get("/api/leaderboard")
+async def get_leaderboard():
+    """Get the models ranked by their peer reviews across all conversations."""
+    return leaderboard.describe(await storage.get_leaderboard())
+
+
 @app.post("/api/conversations/{conversation_id}/message")
 async def send_message(conversation_id: str, request: SendMessageRequest):
     """
     Send a message and run the 3-stage council process.
-    Returns the complete response with all stages.
+    Returns the complete response with all stages; metadata["coalesced"] tells
+    whether it came from an identical run that was already in flight.
     """
+    trace = telemetry.start_trace()
+    # Started before the title call, so its tokens are counted with the run
+    usage = start_usage()
+    # Model calls are queued per conversation, so one busy conversation cannot starve the others
+    set_request_flow(conversation_id)
+
     # Check if conversation exists
-    conversation = storage.get_conversation(conversation_id)
+    conversation = await storage.get_conversation(conversation_id)
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -94,25 +202,42 @@ async def send_message(conversation_id: str, request: SendMessageRequest):
     is_first_message = len(conversation["messages"]) == 0
 
     # Add user message
-    storage.add_user_message(conversation_id, request.content)
+    await storage.add_user_message(conversation_id, request.content)
 
     # If this is the first message, generate a title
     if is_first_message:
         title = await generate_conversation_title(request.content)
-        storage.update_conversation_title(conversation_id, title)
-
-    # Run the 3-stage council process
-    stage1_results, stage2_results, stage3_result, metadata = await run_full_council(
-        request.content
+        await storage.update_conversation_title(conversation_id, title)
+
+    # Run the 3-stage council process, with the conversation so far as context.
+    # An identical run already in flight (e.g. a double submit) is joined instead of repeated.
+    context_state = conversation_context(conversation)
+    (stage1_results, stage2_results, stage3_result, metadata, new_context), leader = await singleflight.do(
+        coalescing_key(context_prompt(request.content, context_state), request.budget_usd),
+        lambda flight: run_conversation_turn(request.content, context_state, request.budget_usd)
     )
+    if not leader:
+        # The run's calls were counted with the request that started it
+        metadata["usage"] = usage
+    metadata["coalesced"] = not leader
 
     # Add assistant message with all stages
-    storage.add_assistant_message(
+    await storage.add_assistant_message(
         conversation_id,
         stage1_results,
         stage2_results,
-        stage3_result
+        stage3_result,
+        usage=metadata["usage"]
+    )
+    # Applied to the context as stored now, which a concurrent turn may have changed
+    await storage.update_conversation_context(
+        conversation_id, lambda current: merge_context(current, context_state, new_context)
     )
+    if leader:
+        # Once per run, however many conversations it answered
+        await storage.update_leaderboard(leaderboard.turn_delta(stage2_results, metadata["label_to_model"]))
+    # Re-summarize so the timings include the final write
+    metadata["timings"] = telemetry.summarize(trace)
 
     # Return the complete response with metadata
     return {
@@ -123,66 +248,251 @@ async def send_message(conversation_id: str, request: SendMessageRequest):
     }
 
 
-@app.post("/api/conversations/{conversation_id}/message/stream")
-async def send_message_stream(conversation_id: str, request: SendMessageRequest):
+def _sse(seq: int, turn_id: str, event: Dict[str, Any]) -> str:
+    """Format an event for an SSE stream, with an id a reconnecting client sends back as Last-Event-ID."""
+    return f"id: {turn_id}:{seq}\ndata: {json.dumps(event)}\n\n"
+
+
+async def _stream_stage_deltas(flight: singleflight.Flight, stage: str, run_stage):
     """
-    Send a message and stream the 3-stage council process.
-    Returns Server-Sent Events as each stage completes.
+    Run a streaming stage, publishing its token deltas to a flight.
+
+    Args:
+        flight: The flight whose subscribers receive the deltas
+        stage: Stage name used to tag each delta event (e.g. "stage1")
+        run_stage: Callable taking an on_delta callback and returning the stage coroutine
+
+    Returns:
+        The stage result
     """
-    # Check if conversation exists
-    conversation = storage.get_conversation(conversation_id)
-    if conversation is None:
-        raise HTTPException(status_code=404, detail="Conversation not found")
+    async def on_delta(model: str, text: str):
+        # Deltas may be dropped from the replay buffer: the stage's complete event carries the full text
+        flight.publish({"type": "delta", "stage": stage, "model": model, "delta": text}, droppable=True)
 
-    # Check if this is the first message
-    is_first_message = len(conversation["messages"]) == 0
+    return await run_stage(on_delta)
 
-    async def event_generator():
-        try:
-            # Add user message
-            storage.add_user_message(conversation_id, request.content)
-
-            # Start title generation in parallel (don't await yet)
-            title_task = None
-            if is_first_message:
-                title_task = asyncio.create_task(generate_conversation_title(request.content))
-
-            # Stage 1: Collect responses
-            yield f"data: {json.dumps({'type': 'stage1_start'})}\n\n"
-            stage1_results = await stage1_collect_responses(request.content)
-            yield f"data: {json.dumps({'type': 'stage1_complete', 'data': stage1_results})}\n\n"
-
-            # Stage 2: Collect rankings
-            yield f"data: {json.dumps({'type': 'stage2_start'})}\n\n"
-            stage2_results, label_to_model = await stage2_collect_rankings(request.content, stage1_results)
-            aggregate_rankings = calculate_aggregate_rankings(stage2_results, label_to_model)
-            yield f"data: {json.dumps({'type': 'stage2_complete', 'data': stage2_results, 'metadata': {'label_to_model': label_to_model, 'aggregate_rankings': aggregate_rankings}})}\n\n"
-
-            # Stage 3: Synthesize final answer
-            yield f"data: {json.dumps({'type': 'stage3_start'})}\n\n"
-            stage3_result = await stage3_synthesize_final(request.content, stage1_results, stage2_results)
-            yield f"data: {json.dumps({'type': 'stage3_complete', 'data': stage3_result})}\n\n"
-
-            # Wait for title generation if it was started
-            if title_task:
-                title = await title_task
-                storage.update_conversation_title(conversation_id, title)
-                yield f"data: {json.dumps({'type': 'title_complete', 'data': {'title': title}})}\n\n"
-
-            # Save complete assistant message
-            storage.add_assistant_message(
-                conversation_id,
-                stage1_results,
-                stage2_results,
-                stage3_result
+
+async def _run_council_stream(
+    flight: singleflight.Flight,
+    prompt: str,
+    context_state: Optional[Dict[str, Any]],
+    budget_usd: Optional[float]
+) -> Dict[str, Any]:
+    """
+    Run the 3-stage council process for the streaming endpoint, publishing its events to a flight.
+
+    Args:
+        flight: The flight whose subscribers receive the stage events
+        prompt: The question as sent to the council, with its conversation context
+        context_state: The conversation's context, refreshed while the council runs
+        budget_usd: Optional cost budget in USD
+
+    Returns:
+        Dict with the stage results, label_to_model, the budget plan, the
+        selection and the refreshed context state
+    """
+    # With adaptive selection only part of the roster is queried
+    selection = select_council(prompt, budget_usd)
+    council_models = selection["council_models"] if selection else None
+    plan = plan_budget(prompt, budget_usd, council_models)
+    # A stale summary is refreshed while the council runs
+    context_task = asyncio.create_task(refresh_context(context_state))
+
+    # Stage 1: Collect responses
+    flight.publish({'type': 'stage1_start'})
+    stage1_results, late_tasks, quorum_decision = await _stream_stage_deltas(
+        flight, "stage1", lambda on_delta: stage1_collect_responses(prompt, on_delta, plan, council_models)
+    )
+    flight.publish({'type': 'stage1_complete', 'data': stage1_results, 'metadata': {'stage1_quorum': quorum_decision}})
+
+    # Stage 2: Collect rankings, starting as soon as the stage 1 quorum was met,
+    # unless what is left of the budget only covers the synthesis
+    plan = replan_after_stage1(prompt, plan, stage1_results)
+    flight.publish({'type': 'stage2_start'})
+    if plan and plan["skip_stage2"]:
+        stage2_results, label_to_model = [], {}
+    else:
+        stage2_results, label_to_model = await stage2_collect_rankings(prompt, stage1_results, plan, council_models)
+    on_time_count = len(stage1_results)
+    stage1_results, stage2_results, label_to_model, late_decision = await review_late_responses(
+        prompt, late_tasks, stage1_results, stage2_results, label_to_model, plan, council_models
+    )
+    quorum_decision.update(late_decision)
+    if late_decision["folded"]:
+        flight.publish({'type': 'stage1_late', 'data': stage1_results[on_time_count:]})
+    aggregate_rankings = calculate_aggregate_rankings(stage2_results, label_to_model)
+    observe_council(plan["council_models"] if plan else council_models, stage1_results, aggregate_rankings)
+    flight.publish({'type': 'stage2_complete', 'data': stage2_results, 'metadata': {'label_to_model': label_to_model, 'aggregate_rankings': aggregate_rankings, 'stage1_quorum': quorum_decision, 'budget': plan}})
+
+    # Stage 3: Synthesize final answer
+    flight.publish({'type': 'stage3_start'})
+    stage3_result = await _stream_stage_deltas(
+        flight, "stage3", lambda on_delta: stage3_synthesize_final(prompt, stage1_results, stage2_results, on_delta, plan)
+    )
+    flight.publish({'type': 'stage3_complete', 'data': stage3_result})
+
+    return {
+        "stage1": stage1_results,
+        "stage2": stage2_results,
+        "stage3": stage3_result,
+        "label_to_model": label_to_model,
+        "budget": plan,
+        "selection": selection,
+        "context": await context_task,
+    }
+
+
+# Streamed turns by conversation id, kept for STREAM_RETENTION_SECONDS after they finish
+_stream_turns: Dict[str, singleflight.Flight] = {}
+
+
+async def _run_turn_stream(
+    turn: singleflight.Flight,
+    conversation_id: str,
+    content: str,
+    is_first_message: bool,
+    context_state: Optional[Dict[str, Any]],
+    budget_usd: Optional[float],
+    user_saved: bool = False,
+    assistant_position: Optional[int] = None
+):
+    """
+    Run one streamed turn of a conversation, independently of the HTTP connection that started it.
+
+    The council run's events are republished to the turn's own flight and each
+    stage is saved as soon as it completes, so a client that reconnects loses
+    neither events nor finished stages, and nothing is run twice.
+
+    Args:
+        turn: The turn's flight, which subscribers follow
+        conversation_id: Conversation identifier
+        content: The user's message
+        is_first_message: Whether to generate a title
+        context_state: The conversation's context before this turn
+        budget_usd: Optional cost budget in USD
+        user_saved: Whether the user message is already saved (by the caller or an earlier attempt)
+        assistant_position: Position of an assistant message an earlier attempt
+            saved for this turn, which is overwritten rather than added again
+    """
+    cache_stats = start_cache_stats()
+    compaction_stats = start_compaction_stats()
+    trace = telemetry.start_trace()
+    usage = start_usage()
+    set_request_flow(conversation_id)
+    prompt = context_prompt(content, context_state)
+    flight = None
+    position = None
+    try:
+        # Add user message
+        if not user_saved:
+            await storage.add_user_message(conversation_id, content)
+
+        # Start title generation in parallel (don't await yet)
+        title_task = None
+        if is_first_message:
+            title_task = asyncio.create_task(generate_conversation_title(content))
+
+        # Identical requests in flight share one run and each receives all of its stage events
+        flight, leader = singleflight.join(
+            coalescing_key(prompt, budget_usd, stream=True),
+            lambda flight: _run_council_stream(flight, prompt, context_state, budget_usd)
+        )
+        stage1_results = []
+        async for _, event in flight.subscribe():
+            turn.publish(event, droppable=event["type"] == "delta")
+            # Save each stage as soon as it is complete
+            if event["type"] == "stage1_complete":
+                stage1_results = event["data"]
+                if assistant_position is not None:
+                    position = assistant_position
+                    await storage.update_assistant_message(conversation_id, position, {
+                        "stage1": stage1_results, "stage2": [], "stage3": None, "status": "in_progress"
+                    })
+                else:
+                    position = await storage.add_assistant_message(
+                        conversation_id, stage1_results, [], None, status="in_progress"
+                    )
+            elif event["type"] == "stage1_late":
+                stage1_results = stage1_results + event["data"]
+                await storage.update_assistant_message(conversation_id, position, {"stage1": stage1_results})
+            elif event["type"] == "stage2_complete":
+                await storage.update_assistant_message(conversation_id, position, {"stage2": event["data"]})
+            elif event["type"] == "stage3_complete":
+                await storage.update_assistant_message(conversation_id, position, {"stage3": event["data"]})
+        run = await flight.result()
+        stage2_results, stage3_result = run["stage2"], run["stage3"]
+
+        # Wait for title generation if it was started
+        if title_task:
+            title = await title_task
+            await storage.update_conversation_title(conversation_id, title)
+            turn.publish({'type': 'title_complete', 'data': {'title': title}})
+
+        # Complete the assistant message
+        await storage.update_assistant_message(conversation_id, position, {"usage": usage, "status": "complete"})
+        new_context = add_context_turn(run["context"], content, stage3_result)
+        await storage.update_conversation_context(
+            conversation_id, lambda current: merge_context(current, context_state, new_context)
+        )
+        if leader:
+            # Once per run, however many conversations it answered
+            await storage.update_leaderboard(leaderboard.turn_delta(stage2_results, run["label_to_model"]))
+
+        # Send completion event
+        complete_metadata = {
+            'cache': cache_stats,
+            'compaction': compaction_stats,
+            'context': describe_context(context_state, prompt, content),
+            'timings': telemetry.summarize(trace),
+            'usage': usage,
+            'coalesced': not leader,
+        }
+        if run["budget"]:
+            complete_metadata['budget'] = run["budget"]
+        if run["selection"]:
+            complete_metadata['selection'] = run["selection"]
+        turn.publish({'type': 'complete', 'metadata': complete_metadata})
+
+    except asyncio.CancelledError:
+        # Only jobs are cancelled (on shutdown); their rerun overwrites this message
+        if position is not None:
+            await asyncio.shield(
+                storage.update_assistant_message(conversation_id, position, {"usage": usage, "status": "failed"})
             )
+        raise
+    except Exception as e:
+        if position is not None:
+            await storage.update_assistant_message(conversation_id, position, {"usage": usage, "status": "failed"})
+        # Send error event
+        turn.publish({'type': 'error', 'message': str(e)})
+    finally:
+        if flight is not None:
+            flight.leave()
+
+
+def _retain_turn(turns: Dict[str, singleflight.Flight], key: str, turn: singleflight.Flight):
+    """Keep a turn's events in `turns` for reconnecting clients until STREAM_RETENTION_SECONDS after it ends."""
+    turns[key] = turn
 
-            # Send completion event
-            yield f"data: {json.dumps({'type': 'complete'})}\n\n"
+    def forget():
+        if turns.get(key) is turn:
+            del turns[key]
 
-        except Exception as e:
-            # Send error event
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+    turn.task.add_done_callback(lambda _: asyncio.get_running_loop().call_later(STREAM_RETENTION_SECONDS, forget))
+
+
+def _resume_after(turn: singleflight.Flight, last_event_id: Optional[str]) -> int:
+    """The sequence number to resume a turn's stream after, 0 for an id from another turn or none."""
+    turn_id, _, seq = (last_event_id or "").partition(":")
+    return int(seq) if turn_id == turn.key and seq.isdigit() else 0
+
+
+def _stream_response(turn_id: str, turn: singleflight.Flight, after: int = 0) -> StreamingResponse:
+    """Stream a turn's events after sequence number `after` as Server-Sent Events."""
+    async def event_generator():
+        # Disconnecting only ends this subscription; the turn runs on
+        async for seq, event in turn.subscribe(after):
+            yield _sse(seq, turn_id, event)
 
     return StreamingResponse(
         event_generator(),
@@ -194,6 +504,190 @@ async def send_message_stream(conversation_id: str, request: SendMessageRequest)
     )
 
 
+@app.post("/api/conversations/{conversation_id}/message/stream")
+async def send_message_stream(conversation_id: str, request: SendMessageRequest):
+    """
+    Send a message and stream the 3-stage council process.
+    Returns Server-Sent Events as each stage completes, plus per-model
+    token deltas for stage 1 and stage 3 as they are generated. Identical
+    requests in flight share one council run and all receive its events.
+
+    The turn runs on if the client disconnects, and saves each stage as it
+    completes. Every event has an id; GET on the same path with Last-Event-ID
+    resumes the stream after it.
+    """
+    # Check if conversation exists
+    conversation = await storage.get_conversation(conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    # Check if this is the first message
+    is_first_message = len(conversation["messages"]) == 0
+    # Follow-ups are sent with a summary of the conversation so far and its last few turns
+    context_state = conversation_context(conversation)
+
+    turn_id = uuid.uuid4().hex
+    turn = singleflight.Flight(turn_id).launch(
+        lambda turn: _run_turn_stream(turn, conversation_id, request.content, is_first_message, context_state, request.budget_usd)
+    )
+    _retain_turn(_stream_turns, conversation_id, turn)
+    return _stream_response(turn_id, turn)
+
+
+@app.get("/api/conversations/{conversation_id}/message/stream")
+async def resume_message_stream(
+    conversation_id: str,
+    last_event_id: Optional[str] = Header(None),
+    after: Optional[str] = Query(None)
+):
+    """
+    Resume the stream of a conversation's latest streamed turn.
+
+    Replays the events after the one identified by the Last-Event-ID header (or
+    the `after` query parameter, for clients that cannot set headers), then
+    follows the turn live. Token deltas older than the replay buffer are skipped;
+    the stage events always replay. Without an id, or with one from an earlier
+    turn, the stream starts from the turn's first event.
+    """
+    turn = _stream_turns.get(conversation_id)
+    if turn is None:
+        raise HTTPException(status_code=404, detail="No streamed turn to resume")
+    return _stream_response(turn.key, turn, _resume_after(turn, last_event_id or after))
+
+
+# Job turns by job id: those queued by this process, and those it ran until
+# STREAM_RETENTION_SECONDS after they end
+_job_turns: Dict[str, singleflight.Flight] = {}
+
+
+async def _run_job(job: Dict[str, Any], report) -> Dict[str, Any]:
+    """
+    Run a queued turn as a streamed turn, reporting each stage event as the job's progress.
+
+    The conversation is read when the job starts rather than when it was
+    queued, so a turn sees the turns queued before it in its context. The
+    user message's position is kept in the job's progress, so a rerun after
+    an interruption reuses it and the assistant message after it instead of
+    adding the turn again.
+
+    Args:
+        job: The job record; its payload has conversation_id, content and budget_usd
+        report: Coroutine function recording the job's progress
+
+    Returns:
+        The conversation id and the turn as the non-streaming endpoint returns it
+    """
+    payload = job["payload"]
+    conversation_id = payload["conversation_id"]
+    conversation = await storage.get_conversation(conversation_id)
+    if conversation is None:
+        raise ValueError("Conversation not found")
+    context_state = conversation_context(conversation)
+    messages = conversation["messages"]
+
+    user_position = (job["progress"] or {}).get("user_position")
+    assistant_position = None
+    if user_position is None:
+        user_position = await storage.add_user_message(conversation_id, payload["content"])
+        await report({"event": "user_message", "user_position": user_position})
+    elif user_position + 1 < len(messages) and messages[user_position + 1]["role"] == "assistant":
+        assistant_position = user_position + 1
+
+    # Subscribers may already follow the flight created when the job was queued
+    turn = _job_turns.get(job["id"])
+    if turn is None or turn.task is not None:
+        turn = singleflight.Flight(job["id"])
+    turn.launch(lambda turn: _run_turn_stream(
+        turn, conversation_id, payload["content"], user_position == 0, context_state, payload["budget_usd"],
+        user_saved=True, assistant_position=assistant_position
+    ))
+    _retain_turn(_job_turns, job["id"], turn)
+
+    result = {"conversation_id": conversation_id, "stage1": [], "stage2": [], "stage3": None, "metadata": {}}
+    try:
+        async for seq, event in turn.subscribe():
+            if event["type"] == "delta":
+                continue
+            await report({"event": event["type"], "seq": seq, "user_position": user_position})
+            if event["type"] == "stage1_complete":
+                result["stage1"] = event["data"]
+                result["metadata"].update(event["metadata"])
+            elif event["type"] == "stage1_late":
+                result["stage1"] = result["stage1"] + event["data"]
+            elif event["type"] == "stage2_complete":
+                result["stage2"] = event["data"]
+                result["metadata"].update(event["metadata"])
+            elif event["type"] == "stage3_complete":
+                result["stage3"] = event["data"]
+            elif event["type"] == "complete":
+                result["metadata"].update(event["metadata"])
+            elif event["type"] == "error":
+                raise RuntimeError(event["message"])
+    except asyncio.CancelledError:
+        # The worker is stopping and the job goes back to the queue, so the turn stops too
+        turn.task.cancel()
+        raise
+    return result
+
+
+job_queue = jobs.JobQueue(_run_job, jobs.JobStore(JOB_DB_PATH), JOB_WORKERS)
+
+
+@app.post("/api/conversations/{conversation_id}/message/job", status_code=202)
+async def send_message_job(conversation_id: str, request: SendJobRequest):
+    """
+    Queue a message's council run as a background job and return the job at once.
+
+    At most JOB_WORKERS jobs run at a time, highest priority first, and the
+    turns of one conversation run one after the other. The job survives a
+    server restart. Poll GET /api/jobs/{id} for its status, progress and
+    result, or follow its events with GET /api/jobs/{id}/events.
+    """
+    if await storage.get_conversation(conversation_id) is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    job = await job_queue.submit(
+        {"conversation_id": conversation_id, "content": request.content, "budget_usd": request.budget_usd},
+        request.priority,
+        group=conversation_id
+    )
+    # Clients can subscribe before a worker starts the job
+    _job_turns[job["id"]] = singleflight.Flight(job["id"])
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Get a job: its status ("queued", "running", "done" or "failed"), how many
+    jobs run before it while queued, its latest progress event, and its result
+    or error.
+    """
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    last_event_id: Optional[str] = Header(None),
+    after: Optional[str] = Query(None)
+):
+    """
+    Stream a job's turn as Server-Sent Events, like the streaming endpoint.
+
+    Waits while the job is queued; Last-Event-ID (or `after`) resumes after
+    an event. Available from the server that queued or runs the job, until
+    STREAM_RETENTION_SECONDS after it ends; poll the job otherwise.
+    """
+    turn = _job_turns.get(job_id)
+    if turn is None:
+        raise HTTPException(status_code=404, detail="No events for this job on this server")
+    return _stream_response(turn.key, turn, _resume_after(turn, last_event_id or after))
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,61 @@
+"""Copy conversations between storage backends.
+
+Usage:
+    python -m backend.migrate json sqlite    # import the JSON files in DATA_DIR into SQLite
+    python -m backend.migrate sqlite json    # export the SQLite database back to JSON files
+"""
+
+import argparse
+
+from .storage import BACKENDS, load_backend
+
+
+def migrate(source_name: str, target_name: str, overwrite: bool = False) -> int:
+    """
+    Copy every conversation, and the model leaderboard, from one backend to another.
+
+    Args:
+        source_name: Backend to read from
+        target_name: Backend to write to
+        overwrite: Replace conversations that already exist in the target
+
+    Returns:
+        Number of conversations copied
+    """
+    source = load_backend(source_name)
+    target = load_backend(target_name)
+
+    existing = {meta["id"] for meta in target.list_conversations()}
+    copied = 0
+    for meta in source.list_conversations():
+        if meta["id"] in existing and not overwrite:
+            continue
+        conversation = source.get_conversation(meta["id"])
+        if conversation is None:
+            continue
+        target.save_conversation(conversation)
+        copied += 1
+
+    # Leaderboard totals are added up, so they are copied only into a target that has none yet
+    if target.get_leaderboard()["turns"] == 0:
+        target.update_leaderboard(source.get_leaderboard())
+
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy conversations between storage backends.")
+    parser.add_argument("source", choices=sorted(BACKENDS))
+    parser.add_argument("target", choices=sorted(BACKENDS))
+    parser.add_argument("--overwrite", action="store_true", help="replace conversations that already exist in the target")
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("source and target must differ")
+
+    copied = migrate(args.source, args.target, args.overwrite)
+    print(f"Copied {copied} conversation(s) from {args.source} to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
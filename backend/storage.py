@@ -1,172 +1,135 @@
-"""JSON-based storage for conversations."""
-
-import json
-import os
-from datetime import datetime
-from typing import List, Dict, Any, Optional
-from pathlib import Path
-from .config import DATA_DIR
-
-
-def ensure_data_dir():
-    """Ensure the data directory exists."""
-    Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
-
-
-def get_conversation_path(conversation_id: str) -> str:
-    """Get the file path for a conversation."""
-    return os.path.join(DATA_DIR, f"{conversation_id}.json")
-
-
-def create_conversation(conversation_id: str) -> Dict[str, Any]:
-    """
-    Create a new conversation.
-
-    Args:
-        conversation_id: Unique identifier for the conversation
-
-    Returns:
-        New conversation dict
-    """
-    ensure_data_dir()
-
-    conversation = {
-        "id": conversation_id,
-        "created_at": datetime.utcnow().isoformat(),
-        "title": "New Conversation",
-        "messages": []
-    }
-
-    # Save to file
-    path = get_conversation_path(conversation_id)
-    with open(path, 'w') as f:
-        json.dump(conversation, f, indent=2)
-
-    return conversation
-
-
-def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
-    """
-    Load a conversation from storage.
-
-    Args:
-        conversation_id: Unique identifier for the conversation
-
-    Returns:
-        Conversation dict or None if not found
-    """
-    path = get_conversation_path(conversation_id)
-
-    if not os.path.exists(path):
-        return None
-
-    with open(path, 'r') as f:
-        return json.load(f)
-
-
-def save_conversation(conversation: Dict[str, Any]):
+"""Storage for conversations.
+
+Every backend is a module providing the same functions:
+
+- ``create_conversation(conversation_id)``
+- ``get_conversation(conversation_id)``
+- ``save_conversation(conversation)``
+- ``list_conversations()`` and ``list_conversations_page(limit, cursor)``
+- ``add_user_message(conversation_id, content)`` and
+  ``add_assistant_message(conversation_id, stage1, stage2, stage3, usage=None, status=None)``,
+  each returning the message's position, and ``update_assistant_message(conversation_id,
+  position, fields)`` for a message saved stage by stage
+- ``update_conversation_title(conversation_id, title)``
+- ``update_conversation_context(conversation_id, update)``, applying
+  ``update(context)`` to the stored context under the conversation's lock
+- ``get_leaderboard()`` and ``update_leaderboard(delta)`` for the model leaderboard
+  totals across conversations (see functions/leaderboard.py)
+
+``STORAGE_BACKEND`` in config.py selects which one is used: "json" (one set of
+files per conversation under DATA_DIR, see storage_json.py) or "sqlite" (a
+single WAL-mode database at SQLITE_PATH, see storage_sqlite.py). Use
+``python -m backend.migrate`` to move conversations between them.
+
+Backends do blocking file or database I/O, so this module exposes them as
+coroutines that run on a bounded thread pool. The event loop keeps serving
+other requests and SSE streams while a large conversation is read or written.
+
+Writes to the same conversation are serialized twice over: an asyncio lock per
+conversation queues them within this process without tying up pool threads, and
+the backends serialize across worker processes (advisory file locks for JSON,
+BEGIN IMMEDIATE transactions for SQLite). Concurrent turns from two tabs, or a
+title written while a message is being saved, therefore never lose an update.
+
+Every call is traced as a "storage.<function>" span and its latency, thread
+pool wait included, is recorded in the storage_operation_seconds histogram.
+"""
+
+import asyncio
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from functions import telemetry
+from .config import STORAGE_BACKEND, STORAGE_MAX_THREADS
+
+BACKENDS = {
+    "json": "backend.storage_json",
+    "sqlite": "backend.storage_sqlite",
+}
+
+
+def load_backend(name: str):
     """
-    Save a conversation to storage.
+    Import a storage backend module by name.
 
     Args:
-        conversation: Conversation dict to save
-    """
-    ensure_data_dir()
-
-    path = get_conversation_path(conversation['id'])
-    with open(path, 'w') as f:
-        json.dump(conversation, f, indent=2)
-
-
-def list_conversations() -> List[Dict[str, Any]]:
-    """
-    List all conversations (metadata only).
+        name: Backend name, one of BACKENDS
 
     Returns:
-        List of conversation metadata dicts
-    """
-    ensure_data_dir()
-
-    conversations = []
-    for filename in os.listdir(DATA_DIR):
-        if filename.endswith('.json'):
-            path = os.path.join(DATA_DIR, filename)
-            with open(path, 'r') as f:
-                data = json.load(f)
-                # Return metadata only
-                conversations.append({
-                    "id": data["id"],
-                    "created_at": data["created_at"],
-                    "title": data.get("title", "New Conversation"),
-                    "message_count": len(data["messages"])
-                })
-
-    # Sort by creation time, newest first
-    conversations.sort(key=lambda x: x["created_at"], reverse=True)
-
-    return conversations
-
-
-def add_user_message(conversation_id: str, content: str):
-    """
-    Add a user message to a conversation.
-
-    Args:
-        conversation_id: Conversation identifier
-        content: User message content
+        The backend module
     """
-    conversation = get_conversation(conversation_id)
-    if conversation is None:
-        raise ValueError(f"Conversation {conversation_id} not found")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return import_module(BACKENDS[name])
 
-    conversation["messages"].append({
-        "role": "user",
-        "content": content
-    })
 
-    save_conversation(conversation)
+_executor = ThreadPoolExecutor(max_workers=STORAGE_MAX_THREADS, thread_name_prefix="storage")
 
+# Locks are dropped once no coroutine holds or waits on them
+_conversation_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
 
-def add_assistant_message(
-    conversation_id: str,
-    stage1: List[Dict[str, Any]],
-    stage2: List[Dict[str, Any]],
-    stage3: Dict[str, Any]
-):
-    """
-    Add an assistant message with all 3 stages to a conversation.
-
-    Args:
-        conversation_id: Conversation identifier
-        stage1: List of individual model responses
-        stage2: List of model rankings
-        stage3: Final synthesized response
-    """
-    conversation = get_conversation(conversation_id)
-    if conversation is None:
-        raise ValueError(f"Conversation {conversation_id} not found")
-
-    conversation["messages"].append({
-        "role": "assistant",
-        "stage1": stage1,
-        "stage2": stage2,
-        "stage3": stage3
-    })
 
-    save_conversation(conversation)
+def _conversation_lock(conversation_id: str) -> asyncio.Lock:
+    """Get the in-process lock for a conversation."""
+    lock = _conversation_locks.get(conversation_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _conversation_locks[conversation_id] = lock
+    return lock
 
 
-def update_conversation_title(conversation_id: str, title: str):
+def _offload(func, conversation_id_of=None):
     """
-    Update the title of a conversation.
+    Wrap a blocking backend function as a coroutine that runs on the storage thread pool.
 
     Args:
-        conversation_id: Conversation identifier
-        title: New title for the conversation
+        func: Backend function
+        conversation_id_of: For writes, a function returning the conversation id
+            from the call's arguments; calls for the same conversation then run one at a time
     """
-    conversation = get_conversation(conversation_id)
-    if conversation is None:
-        raise ValueError(f"Conversation {conversation_id} not found")
-
-    conversation["title"] = title
-    save_conversation(conversation)
+    op = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        with telemetry.span(f"storage.{op}", op=op, backend=STORAGE_BACKEND) as storage_span:
+            if conversation_id_of is None:
+                result = await loop.run_in_executor(_executor, call)
+            else:
+                async with _conversation_lock(conversation_id_of(*args, **kwargs)):
+                    result = await loop.run_in_executor(_executor, call)
+        telemetry.STORAGE_SECONDS.observe(storage_span.duration, op=op, backend=STORAGE_BACKEND)
+        return result
+    return wrapper
+
+
+def _first_argument(conversation_id, *args, **kwargs):
+    return conversation_id
+
+
+def _conversation_argument(conversation, *args, **kwargs):
+    return conversation["id"]
+
+
+def _leaderboard_key(*args, **kwargs):
+    # Leaderboard updates from concurrent turns queue on one lock, like writes to a conversation
+    return "_leaderboard"
+
+
+_backend = load_backend(STORAGE_BACKEND)
+
+create_conversation = _offload(_backend.create_conversation, _first_argument)
+get_conversation = _offload(_backend.get_conversation)
+save_conversation = _offload(_backend.save_conversation, _conversation_argument)
+list_conversations = _offload(_backend.list_conversations)
+list_conversations_page = _offload(_backend.list_conversations_page)
+add_user_message = _offload(_backend.add_user_message, _first_argument)
+add_assistant_message = _offload(_backend.add_assistant_message, _first_argument)
+update_assistant_message = _offload(_backend.update_assistant_message, _first_argument)
+update_conversation_title = _offload(_backend.update_conversation_title, _first_argument)
+update_conversation_context = _offload(_backend.update_conversation_context, _first_argument)
+get_leaderboard = _offload(_backend.get_leaderboard)
+update_leaderboard = _offload(_backend.update_leaderboard, _leaderboard_key)
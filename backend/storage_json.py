@@ -0,0 +1,557 @@
+"""JSON-file storage backend for conversations.
+
+Each conversation is kept in up to four files inside DATA_DIR:
+
+- ``{id}.json``: a compacted snapshot of the full conversation
+- ``{id}.log``: an append-only JSON-lines log of changes made since the snapshot
+- ``{id}.meta.json``: a small metadata record (title, message count, log position)
+- ``{id}.context.json``: the rolling context (summary and recent turns), which
+  every turn reads and rewrites, so it is kept apart from the log
+
+A new message, a stage added to a message or a title only appends one line to
+the log and rewrites the small metadata record. The full document is rewritten only by compaction, which runs
+once the log has grown larger than the snapshot. That keeps the amortized cost
+of a write proportional to the size of what was written, not to the size of
+the conversation.
+
+Listing goes through a separate index of every conversation's metadata (see
+index.py), which is updated on every create, append and title change. The
+model leaderboard (see functions/leaderboard.py) is one small file of running
+totals, ``_leaderboard.json``, to which each turn's rankings are added.
+
+Every change to a conversation holds an exclusive advisory lock on it (see
+files.py), and reads hold a shared one. Concurrent turns from several threads or
+uvicorn workers are serialized, and a reader never combines a snapshot with a
+log that a concurrent compaction has already removed. Snapshots and metadata
+are replaced atomically by write-and-rename.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Callable, List, Dict, Any, Optional, Tuple
+from pathlib import Path
+from functions import leaderboard
+from .config import DATA_DIR
+from .files import file_lock, write_atomic
+from .index import ConversationIndex
+
+# The log is compacted into the snapshot once it exceeds both this size and
+# the size of the snapshot itself
+COMPACT_MIN_LOG_BYTES = 64 * 1024
+
+
+def ensure_data_dir():
+    """Ensure the data directory exists."""
+    Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
+
+
+def get_index_path() -> str:
+    """Get the file path for the conversation metadata index."""
+    return os.path.join(DATA_DIR, "_index.jsonl")
+
+
+def get_leaderboard_path() -> str:
+    """Get the file path for the model leaderboard totals."""
+    return os.path.join(DATA_DIR, "_leaderboard.json")
+
+
+def get_conversation_path(conversation_id: str) -> str:
+    """Get the file path for a conversation's snapshot."""
+    return os.path.join(DATA_DIR, f"{conversation_id}.json")
+
+
+def get_log_path(conversation_id: str) -> str:
+    """Get the file path for a conversation's append-only log."""
+    return os.path.join(DATA_DIR, f"{conversation_id}.log")
+
+
+def get_meta_path(conversation_id: str) -> str:
+    """Get the file path for a conversation's metadata record."""
+    return os.path.join(DATA_DIR, f"{conversation_id}.meta.json")
+
+
+def get_context_path(conversation_id: str) -> str:
+    """Get the file path for a conversation's rolling context."""
+    return os.path.join(DATA_DIR, f"{conversation_id}.context.json")
+
+
+def _write_json_atomic(path: str, data: Dict[str, Any]) -> int:
+    """
+    Write JSON to a temporary file and rename it over the target.
+
+    Returns:
+        Number of bytes written
+    """
+    payload = json.dumps(data).encode("utf-8")
+    write_atomic(path, payload)
+    return len(payload)
+
+
+def _conversation_lock(conversation_id: str, shared: bool = False):
+    """Advisory lock serializing changes to one conversation across threads and worker processes."""
+    return file_lock(get_conversation_path(conversation_id), shared=shared)
+
+
+def _apply_entry(conversation: Dict[str, Any], entry: Dict[str, Any]):
+    """Apply one log entry to an in-memory conversation."""
+    if entry["op"] == "message":
+        conversation["messages"].append(entry["message"])
+    elif entry["op"] == "message_update":
+        conversation["messages"][entry["position"]].update(entry["fields"])
+    elif entry["op"] == "title":
+        conversation["title"] = entry["title"]
+    elif entry["op"] == "context":
+        # Logs written before the context got its own file
+        conversation["context"] = entry["context"]
+
+
+def _replay(conversation_id: str) -> Optional[Tuple[Dict[str, Any], int, int]]:
+    """
+    Load a conversation's snapshot and replay its log on top.
+
+    Args:
+        conversation_id: Conversation identifier
+
+    Returns:
+        Tuple of (conversation, last applied sequence number, log size in bytes),
+        or None if the conversation does not exist
+    """
+    path = get_conversation_path(conversation_id)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as f:
+        conversation = json.load(f)
+    # Entries up to compacted_seq are already part of the snapshot. They can
+    # still be in the log if a compaction was interrupted before truncating it.
+    compacted_seq = conversation.pop("compacted_seq", 0)
+    last_seq = compacted_seq
+
+    log_bytes = 0
+    log_path = get_log_path(conversation_id)
+    if os.path.exists(log_path):
+        with open(log_path, 'rb') as f:
+            for line in f:
+                log_bytes += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn line from a crash mid-append; later appends start on a fresh line
+                    continue
+                if entry["seq"] <= compacted_seq:
+                    continue
+                _apply_entry(conversation, entry)
+                last_seq = max(last_seq, entry["seq"])
+
+    return conversation, last_seq, log_bytes
+
+
+def _build_meta(conversation: Dict[str, Any], last_seq: int, log_bytes: int, snapshot_bytes: int) -> Dict[str, Any]:
+    """Build the metadata record for a conversation."""
+    return {
+        "id": conversation["id"],
+        "created_at": conversation["created_at"],
+        "title": conversation.get("title", "New Conversation"),
+        "message_count": len(conversation["messages"]),
+        "last_seq": last_seq,
+        "log_bytes": log_bytes,
+        "snapshot_bytes": snapshot_bytes,
+    }
+
+
+def _read_meta(conversation_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Read a conversation's metadata record, rebuilding it from the data files if missing.
+
+    Args:
+        conversation_id: Conversation identifier
+
+    Returns:
+        Metadata dict or None if the conversation does not exist
+    """
+    meta_path = get_meta_path(conversation_id)
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+
+    # Conversations written before the log existed have no metadata record yet
+    replayed = _replay(conversation_id)
+    if replayed is None:
+        return None
+    conversation, last_seq, log_bytes = replayed
+    meta = _build_meta(conversation, last_seq, log_bytes, os.path.getsize(get_conversation_path(conversation_id)))
+    _write_json_atomic(meta_path, meta)
+    return meta
+
+
+def _write_snapshot(conversation: Dict[str, Any], last_seq: int):
+    """
+    Write a full snapshot that absorbs every log entry up to last_seq, then drop the log.
+
+    Args:
+        conversation: Full conversation dict
+        last_seq: Highest log sequence number included in the snapshot
+    """
+    conversation_id = conversation["id"]
+    snapshot_bytes = _write_json_atomic(
+        get_conversation_path(conversation_id),
+        {**conversation, "compacted_seq": last_seq}
+    )
+    meta = _build_meta(conversation, last_seq, 0, snapshot_bytes)
+    _write_json_atomic(get_meta_path(conversation_id), meta)
+    _index.upsert(meta)
+
+    log_path = get_log_path(conversation_id)
+    if os.path.exists(log_path):
+        os.remove(log_path)
+
+
+def _append_entry(conversation_id: str, op: str, **fields) -> int:
+    """
+    Append one change to a conversation's log and update its metadata record.
+
+    Args:
+        conversation_id: Conversation identifier
+        op: Entry type ("message", "message_update", "title" or "context")
+        **fields: Entry payload
+
+    Returns:
+        Number of messages in the conversation before the change
+    """
+    if not os.path.exists(get_conversation_path(conversation_id)):
+        raise ValueError(f"Conversation {conversation_id} not found")
+
+    with _conversation_lock(conversation_id):
+        return _append_entry_locked(conversation_id, op, fields)
+
+
+def _append_entry_locked(conversation_id: str, op: str, fields: Dict[str, Any]) -> int:
+    """Body of _append_entry; the caller holds the conversation's lock."""
+    meta = _read_meta(conversation_id)
+    if meta is None:
+        raise ValueError(f"Conversation {conversation_id} not found")
+    message_count = meta["message_count"]
+    if op == "message_update" and not 0 <= fields["position"] < message_count:
+        raise ValueError(f"Conversation {conversation_id} has no message {fields['position']}")
+
+    seq = meta["last_seq"] + 1
+    line = (json.dumps({"seq": seq, "op": op, **fields}) + "\n").encode("utf-8")
+
+    with open(get_log_path(conversation_id), 'a+b') as f:
+        # If a previous append was torn by a crash, start this entry on a new line
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+
+    meta["last_seq"] = seq
+    meta["log_bytes"] += len(line)
+    if op == "message":
+        meta["message_count"] += 1
+    elif op == "title":
+        meta["title"] = fields["title"]
+
+    if meta["log_bytes"] > max(COMPACT_MIN_LOG_BYTES, meta["snapshot_bytes"]):
+        _compact_locked(conversation_id)
+    else:
+        _write_json_atomic(get_meta_path(conversation_id), meta)
+        _index.upsert(meta)
+    return message_count
+
+
+def compact_conversation(conversation_id: str):
+    """
+    Fold a conversation's log into a fresh snapshot.
+
+    Args:
+        conversation_id: Conversation identifier
+    """
+    if not os.path.exists(get_conversation_path(conversation_id)):
+        raise ValueError(f"Conversation {conversation_id} not found")
+
+    with _conversation_lock(conversation_id):
+        _compact_locked(conversation_id)
+
+
+def _compact_locked(conversation_id: str):
+    """Body of compact_conversation; the caller holds the conversation's lock."""
+    replayed = _replay(conversation_id)
+    if replayed is None:
+        raise ValueError(f"Conversation {conversation_id} not found")
+    conversation, last_seq, _ = replayed
+    _write_snapshot(conversation, last_seq)
+
+
+def create_conversation(conversation_id: str) -> Dict[str, Any]:
+    """
+    Create a new conversation.
+
+    Args:
+        conversation_id: Unique identifier for the conversation
+
+    Returns:
+        New conversation dict
+    """
+    ensure_data_dir()
+
+    conversation = {
+        "id": conversation_id,
+        "created_at": datetime.utcnow().isoformat(),
+        "title": "New Conversation",
+        "messages": []
+    }
+
+    with _conversation_lock(conversation_id):
+        _write_snapshot(conversation, 0)
+
+    return conversation
+
+
+def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Load a conversation from storage.
+
+    Args:
+        conversation_id: Unique identifier for the conversation
+
+    Returns:
+        Conversation dict or None if not found
+    """
+    if not os.path.exists(get_conversation_path(conversation_id)):
+        return None
+
+    with _conversation_lock(conversation_id, shared=True):
+        replayed = _replay(conversation_id)
+        if replayed is None:
+            return None
+        conversation = replayed[0]
+        context = _read_context_file(conversation_id)
+    if context is not None:
+        conversation["context"] = context
+    return conversation
+
+
+def save_conversation(conversation: Dict[str, Any]):
+    """
+    Save a full conversation to storage, replacing its snapshot and log.
+
+    Args:
+        conversation: Conversation dict to save
+    """
+    ensure_data_dir()
+
+    with _conversation_lock(conversation['id']):
+        meta = _read_meta(conversation['id'])
+        _write_snapshot(conversation, meta["last_seq"] if meta else 0)
+        if conversation.get("context") is not None:
+            _write_json_atomic(get_context_path(conversation['id']), conversation["context"])
+        elif os.path.exists(get_context_path(conversation['id'])):
+            os.remove(get_context_path(conversation['id']))
+
+
+def _iter_all_meta():
+    """
+    Yield the metadata record of every stored conversation by scanning DATA_DIR.
+
+    Runs under the index lock, so it must not take conversation locks: writers
+    take those first and the index lock second.
+    """
+    for filename in os.listdir(DATA_DIR):
+        # Names starting with "_" (the index, the leaderboard) are not conversations
+        if (filename.endswith('.json') and not filename.endswith(('.meta.json', '.context.json'))
+                and not filename.startswith('_')):
+            meta = _read_meta(filename[:-len('.json')])
+            if meta is not None:
+                yield meta
+
+
+_index = ConversationIndex(get_index_path(), _iter_all_meta)
+
+
+def rebuild_index():
+    """Rebuild the conversation index from the data files."""
+    ensure_data_dir()
+    _index.rebuild()
+
+
+def list_conversations_page(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    List one page of conversations (metadata only), newest first.
+
+    Args:
+        limit: Maximum number of conversations to return (None for all)
+        cursor: Cursor returned with the previous page, or None for the first page
+
+    Returns:
+        Tuple of (conversation metadata dicts, cursor for the next page or None)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    ensure_data_dir()
+    return _index.page(limit, cursor)
+
+
+def list_conversations() -> List[Dict[str, Any]]:
+    """
+    List all conversations (metadata only).
+
+    Returns:
+        List of conversation metadata dicts
+    """
+    conversations, _ = list_conversations_page()
+    return conversations
+
+
+def add_user_message(conversation_id: str, content: str) -> int:
+    """
+    Add a user message to a conversation.
+
+    Args:
+        conversation_id: Conversation identifier
+        content: User message content
+
+    Returns:
+        Position of the message in the conversation
+    """
+    return _append_entry(conversation_id, "message", message={
+        "role": "user",
+        "content": content
+    })
+
+
+def add_assistant_message(
+    conversation_id: str,
+    stage1: List[Dict[str, Any]],
+    stage2: List[Dict[str, Any]],
+    stage3: Dict[str, Any],
+    usage: Optional[Dict[str, Any]] = None,
+    status: Optional[str] = None
+) -> int:
+    """
+    Add an assistant message with all 3 stages to a conversation.
+
+    Args:
+        conversation_id: Conversation identifier
+        stage1: List of individual model responses
+        stage2: List of model rankings
+        stage3: Final synthesized response
+        usage: Optional token/cost ledger of the council run
+        status: Optional progress of a message saved stage by stage (e.g. "in_progress")
+
+    Returns:
+        Position of the message in the conversation
+    """
+    message = {
+        "role": "assistant",
+        "stage1": stage1,
+        "stage2": stage2,
+        "stage3": stage3
+    }
+    if usage is not None:
+        message["usage"] = usage
+    if status is not None:
+        message["status"] = status
+    return _append_entry(conversation_id, "message", message=message)
+
+
+def update_assistant_message(conversation_id: str, position: int, fields: Dict[str, Any]):
+    """
+    Update fields (stages, usage, status) of an assistant message saved stage by stage.
+
+    Args:
+        conversation_id: Conversation identifier
+        position: Position of the message, as returned by add_assistant_message
+        fields: Fields to set on the message
+    """
+    _append_entry(conversation_id, "message_update", position=position, fields=fields)
+
+
+def update_conversation_title(conversation_id: str, title: str):
+    """
+    Update the title of a conversation.
+
+    Args:
+        conversation_id: Conversation identifier
+        title: New title for the conversation
+    """
+    _append_entry(conversation_id, "title", title=title)
+
+
+def update_conversation_context(
+    conversation_id: str,
+    update: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]]
+):
+    """
+    Update the rolling context (summary and recent turns) of a conversation.
+
+    The context is read and written under the conversation's lock, so
+    concurrent turns each apply their change to the other's result. It has a
+    file of its own, so this costs O(context size) rather than a replay of
+    the whole conversation.
+
+    Args:
+        conversation_id: Conversation identifier
+        update: Function from the stored context state (None if there is none
+            yet) to the new one (see functions/context.py)
+    """
+    if not os.path.exists(get_conversation_path(conversation_id)):
+        raise ValueError(f"Conversation {conversation_id} not found")
+
+    with _conversation_lock(conversation_id):
+        current = _read_context_file(conversation_id)
+        if current is None:
+            # No context file yet: the conversation is new, or its context is still in the log
+            replayed = _replay(conversation_id)
+            if replayed is None:
+                raise ValueError(f"Conversation {conversation_id} not found")
+            current = replayed[0].get("context")
+        _write_json_atomic(get_context_path(conversation_id), update(current))
+
+
+def _read_context_file(conversation_id: str) -> Optional[Dict[str, Any]]:
+    """Read a conversation's rolling context file, or None if it has none; the caller holds its lock."""
+    try:
+        with open(get_context_path(conversation_id), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _read_leaderboard() -> Dict[str, Any]:
+    try:
+        with open(get_leaderboard_path(), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return leaderboard.empty()
+
+
+def get_leaderboard() -> Dict[str, Any]:
+    """
+    Get the model leaderboard totals across all conversations.
+
+    Returns:
+        Leaderboard totals (see functions/leaderboard.py)
+    """
+    ensure_data_dir()
+    with file_lock(get_leaderboard_path(), shared=True):
+        return _read_leaderboard()
+
+
+def update_leaderboard(delta: Dict[str, Any]):
+    """
+    Add one turn's peer rankings to the model leaderboard.
+
+    Args:
+        delta: Leaderboard contribution of the turn (see functions/leaderboard.py)
+    """
+    if not delta["models"]:
+        return
+    ensure_data_dir()
+    with file_lock(get_leaderboard_path()):
+        _write_json_atomic(get_leaderboard_path(), leaderboard.merge(_read_leaderboard(), delta))
@@ -0,0 +1,477 @@
+"""SQLite storage backend for conversations.
+
+Conversations, messages and per-stage outputs live in separate tables, so a new
+turn is a handful of row inserts rather than a document rewrite. The database
+runs in WAL mode, which lets readers proceed while a writer commits and lets
+several uvicorn workers share one file. Each thread reuses a single connection,
+and Python's sqlite3 module keeps the prepared statements below cached on it.
+The model leaderboard (see functions/leaderboard.py) is kept as running totals
+in the leaderboard_* tables, to which each turn's rankings are added by upserts.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, List, Dict, Any, Optional, Tuple
+from functions import leaderboard
+from .config import SQLITE_PATH
+from .index import encode_cursor, decode_cursor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    title TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS conversations_by_created_at ON conversations (created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT,
+    extra TEXT,
+    PRIMARY KEY (conversation_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS stage_outputs (
+    conversation_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    model TEXT,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, position, stage, ordinal),
+    FOREIGN KEY (conversation_id, position) REFERENCES messages (conversation_id, position) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS conversation_context (
+    conversation_id TEXT PRIMARY KEY REFERENCES conversations (id) ON DELETE CASCADE,
+    payload TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS leaderboard_models (
+    model TEXT PRIMARY KEY,
+    turns INTEGER NOT NULL DEFAULT 0,
+    votes INTEGER NOT NULL DEFAULT 0,
+    points INTEGER NOT NULL DEFAULT 0,
+    score REAL NOT NULL DEFAULT 0,
+    first_places INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS leaderboard_pairs (
+    winner TEXT NOT NULL,
+    loser TEXT NOT NULL,
+    wins INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (winner, loser)
+);
+
+CREATE TABLE IF NOT EXISTS leaderboard_turns (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    turns INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+STAGES = ("stage1", "stage2", "stage3")
+
+INSERT_CONVERSATION = "INSERT INTO conversations (id, created_at, title, message_count) VALUES (?, ?, ?, ?)"
+SELECT_CONVERSATION = "SELECT id, created_at, title FROM conversations WHERE id = ?"
+SELECT_MESSAGES = "SELECT position, role, content, extra FROM messages WHERE conversation_id = ? ORDER BY position"
+SELECT_STAGE_OUTPUTS = "SELECT position, stage, payload FROM stage_outputs WHERE conversation_id = ? ORDER BY position, stage, ordinal"
+NEXT_POSITION = "SELECT message_count FROM conversations WHERE id = ?"
+INSERT_MESSAGE = "INSERT INTO messages (conversation_id, position, role, content, extra) VALUES (?, ?, ?, ?, ?)"
+INSERT_STAGE_OUTPUT = "INSERT INTO stage_outputs (conversation_id, position, stage, ordinal, model, payload) VALUES (?, ?, ?, ?, ?, ?)"
+SELECT_MESSAGE = "SELECT role, extra FROM messages WHERE conversation_id = ? AND position = ?"
+UPDATE_MESSAGE_EXTRA = "UPDATE messages SET extra = ? WHERE conversation_id = ? AND position = ?"
+DELETE_STAGE_OUTPUTS = "DELETE FROM stage_outputs WHERE conversation_id = ? AND position = ? AND stage = ?"
+INCREMENT_MESSAGE_COUNT = "UPDATE conversations SET message_count = message_count + 1 WHERE id = ?"
+UPDATE_TITLE = "UPDATE conversations SET title = ? WHERE id = ?"
+SELECT_CONTEXT = "SELECT payload FROM conversation_context WHERE conversation_id = ?"
+UPSERT_CONTEXT = (
+    "INSERT INTO conversation_context (conversation_id, payload) VALUES (?, ?) "
+    "ON CONFLICT (conversation_id) DO UPDATE SET payload = excluded.payload"
+)
+SELECT_LEADERBOARD_MODELS = "SELECT model, turns, votes, points, score, first_places FROM leaderboard_models"
+SELECT_LEADERBOARD_PAIRS = "SELECT winner, loser, wins FROM leaderboard_pairs"
+SELECT_LEADERBOARD_TURNS = "SELECT turns FROM leaderboard_turns WHERE id = 0"
+UPSERT_LEADERBOARD_MODEL = (
+    "INSERT INTO leaderboard_models (model, turns, votes, points, score, first_places) "
+    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (model) DO UPDATE SET "
+    "turns = turns + excluded.turns, votes = votes + excluded.votes, points = points + excluded.points, "
+    "score = score + excluded.score, first_places = first_places + excluded.first_places"
+)
+UPSERT_LEADERBOARD_PAIR = (
+    "INSERT INTO leaderboard_pairs (winner, loser, wins) VALUES (?, ?, ?) "
+    "ON CONFLICT (winner, loser) DO UPDATE SET wins = wins + excluded.wins"
+)
+UPSERT_LEADERBOARD_TURNS = (
+    "INSERT INTO leaderboard_turns (id, turns) VALUES (0, ?) "
+    "ON CONFLICT (id) DO UPDATE SET turns = turns + excluded.turns"
+)
+DELETE_CONVERSATION = "DELETE FROM conversations WHERE id = ?"
+LIST_FIRST_PAGE = "SELECT id, created_at, title, message_count FROM conversations ORDER BY created_at DESC, id DESC LIMIT ?"
+LIST_AFTER_CURSOR = (
+    "SELECT id, created_at, title, message_count FROM conversations "
+    "WHERE created_at < ? OR (created_at = ? AND id < ?) "
+    "ORDER BY created_at DESC, id DESC LIMIT ?"
+)
+
+_local = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Get this thread's connection, opening it (and creating the schema) on first use."""
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        directory = os.path.dirname(SQLITE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Transactions are managed explicitly with BEGIN IMMEDIATE below
+        connection = sqlite3.connect(SQLITE_PATH, timeout=30, isolation_level=None, cached_statements=256)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        connection.executescript(SCHEMA)
+        _local.connection = connection
+    return connection
+
+
+class _write_transaction:
+    """BEGIN IMMEDIATE ... COMMIT, taking the write lock up front so concurrent writers queue instead of deadlocking."""
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.connection = get_connection()
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _insert_message(connection: sqlite3.Connection, conversation_id: str, message: Dict[str, Any]) -> int:
+    """Insert a message at the end of a conversation, splitting out its stage outputs; returns its position."""
+    row = connection.execute(NEXT_POSITION, (conversation_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"Conversation {conversation_id} not found")
+    position = row[0]
+
+    extra = {k: v for k, v in message.items() if k not in ("role", "content") + STAGES}
+    connection.execute(INSERT_MESSAGE, (
+        conversation_id, position, message["role"], message.get("content"), json.dumps(extra) if extra else None
+    ))
+
+    for stage in STAGES:
+        if stage in message:
+            _insert_stage_outputs(connection, conversation_id, position, stage, message[stage])
+
+    connection.execute(INCREMENT_MESSAGE_COUNT, (conversation_id,))
+    return position
+
+
+def _insert_stage_outputs(connection: sqlite3.Connection, conversation_id: str, position: int, stage: str, outputs):
+    """Insert the outputs of one stage of a message."""
+    # stage3 is a single dict; store it as a one-row list and unwrap it on read
+    rows = outputs if isinstance(outputs, list) else [outputs]
+    for ordinal, output in enumerate(rows):
+        model = output.get("model") if isinstance(output, dict) else None
+        connection.execute(INSERT_STAGE_OUTPUT, (conversation_id, position, stage, ordinal, model, json.dumps(output)))
+
+
+def create_conversation(conversation_id: str) -> Dict[str, Any]:
+    """
+    Create a new conversation.
+
+    Args:
+        conversation_id: Unique identifier for the conversation
+
+    Returns:
+        New conversation dict
+    """
+    conversation = {
+        "id": conversation_id,
+        "created_at": datetime.utcnow().isoformat(),
+        "title": "New Conversation",
+        "messages": []
+    }
+
+    with _write_transaction() as connection:
+        connection.execute(INSERT_CONVERSATION, (conversation_id, conversation["created_at"], conversation["title"], 0))
+
+    return conversation
+
+
+def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Load a conversation from storage.
+
+    Args:
+        conversation_id: Unique identifier for the conversation
+
+    Returns:
+        Conversation dict or None if not found
+    """
+    connection = get_connection()
+    # A read transaction gives a consistent snapshot across the three queries
+    connection.execute("BEGIN")
+    try:
+        row = connection.execute(SELECT_CONVERSATION, (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        message_rows = connection.execute(SELECT_MESSAGES, (conversation_id,)).fetchall()
+        output_rows = connection.execute(SELECT_STAGE_OUTPUTS, (conversation_id,)).fetchall()
+        context_row = connection.execute(SELECT_CONTEXT, (conversation_id,)).fetchone()
+    finally:
+        connection.execute("COMMIT")
+
+    messages = {}
+    for position, role, content, extra in message_rows:
+        message = {"role": role}
+        if content is not None:
+            message["content"] = content
+        if extra:
+            message.update(json.loads(extra))
+        messages[position] = message
+
+    for position, stage, payload in output_rows:
+        output = json.loads(payload)
+        if stage == "stage3":
+            messages[position][stage] = output
+        else:
+            messages[position].setdefault(stage, []).append(output)
+    for message in messages.values():
+        if message["role"] == "assistant":
+            # Keep empty stages present, as the JSON backend does
+            message.setdefault("stage1", [])
+            message.setdefault("stage2", [])
+
+    conversation = {
+        "id": row[0],
+        "created_at": row[1],
+        "title": row[2],
+        "messages": [messages[position] for position in sorted(messages)]
+    }
+    if context_row is not None:
+        conversation["context"] = json.loads(context_row[0])
+    return conversation
+
+
+def save_conversation(conversation: Dict[str, Any]):
+    """
+    Save a full conversation to storage, replacing any existing copy.
+
+    Args:
+        conversation: Conversation dict to save
+    """
+    with _write_transaction() as connection:
+        connection.execute(DELETE_CONVERSATION, (conversation["id"],))
+        connection.execute(INSERT_CONVERSATION, (
+            conversation["id"], conversation["created_at"], conversation.get("title", "New Conversation"), 0
+        ))
+        for message in conversation["messages"]:
+            _insert_message(connection, conversation["id"], message)
+        if conversation.get("context") is not None:
+            connection.execute(UPSERT_CONTEXT, (conversation["id"], json.dumps(conversation["context"])))
+
+
+def list_conversations_page(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    List one page of conversations (metadata only), newest first.
+
+    Args:
+        limit: Maximum number of conversations to return (None for all)
+        cursor: Cursor returned with the previous page, or None for the first page
+
+    Returns:
+        Tuple of (conversation metadata dicts, cursor for the next page or None)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    connection = get_connection()
+    # Fetch one extra row to learn whether there is a next page; -1 means no limit
+    fetch = -1 if limit is None else limit + 1
+    if cursor is None:
+        rows = connection.execute(LIST_FIRST_PAGE, (fetch,)).fetchall()
+    else:
+        created_at, conversation_id = decode_cursor(cursor)
+        rows = connection.execute(LIST_AFTER_CURSOR, (created_at, created_at, conversation_id, fetch)).fetchall()
+
+    conversations = [
+        {"id": id_, "created_at": created_at, "title": title, "message_count": message_count}
+        for id_, created_at, title, message_count in rows
+    ]
+    if limit is not None and len(conversations) > limit:
+        conversations = conversations[:limit]
+        return conversations, encode_cursor(conversations[-1])
+    return conversations, None
+
+
+def list_conversations() -> List[Dict[str, Any]]:
+    """
+    List all conversations (metadata only).
+
+    Returns:
+        List of conversation metadata dicts
+    """
+    conversations, _ = list_conversations_page()
+    return conversations
+
+
+def add_user_message(conversation_id: str, content: str) -> int:
+    """
+    Add a user message to a conversation.
+
+    Args:
+        conversation_id: Conversation identifier
+        content: User message content
+
+    Returns:
+        Position of the message in the conversation
+    """
+    with _write_transaction() as connection:
+        return _insert_message(connection, conversation_id, {
+            "role": "user",
+            "content": content
+        })
+
+
+def add_assistant_message(
+    conversation_id: str,
+    stage1: List[Dict[str, Any]],
+    stage2: List[Dict[str, Any]],
+    stage3: Dict[str, Any],
+    usage: Optional[Dict[str, Any]] = None,
+    status: Optional[str] = None
+) -> int:
+    """
+    Add an assistant message with all 3 stages to a conversation.
+
+    Args:
+        conversation_id: Conversation identifier
+        stage1: List of individual model responses
+        stage2: List of model rankings
+        stage3: Final synthesized response
+        usage: Optional token/cost ledger of the council run
+        status: Optional progress of a message saved stage by stage (e.g. "in_progress")
+
+    Returns:
+        Position of the message in the conversation
+    """
+    message = {
+        "role": "assistant",
+        "stage1": stage1,
+        "stage2": stage2,
+        "stage3": stage3
+    }
+    # usage and status are kept in the message's extra column
+    if usage is not None:
+        message["usage"] = usage
+    if status is not None:
+        message["status"] = status
+    with _write_transaction() as connection:
+        return _insert_message(connection, conversation_id, message)
+
+
+def update_assistant_message(conversation_id: str, position: int, fields: Dict[str, Any]):
+    """
+    Update fields (stages, usage, status) of an assistant message saved stage by stage.
+
+    Args:
+        conversation_id: Conversation identifier
+        position: Position of the message, as returned by add_assistant_message
+        fields: Fields to set on the message
+    """
+    with _write_transaction() as connection:
+        row = connection.execute(SELECT_MESSAGE, (conversation_id, position)).fetchone()
+        if row is None:
+            raise ValueError(f"Conversation {conversation_id} has no message {position}")
+        for stage in STAGES:
+            if stage in fields:
+                connection.execute(DELETE_STAGE_OUTPUTS, (conversation_id, position, stage))
+                _insert_stage_outputs(connection, conversation_id, position, stage, fields[stage])
+        extra = {k: v for k, v in fields.items() if k not in ("role", "content") + STAGES}
+        if extra:
+            merged = {**(json.loads(row[1]) if row[1] else {}), **extra}
+            connection.execute(UPDATE_MESSAGE_EXTRA, (json.dumps(merged), conversation_id, position))
+
+
+def update_conversation_title(conversation_id: str, title: str):
+    """
+    Update the title of a conversation.
+
+    Args:
+        conversation_id: Conversation identifier
+        title: New title for the conversation
+    """
+    with _write_transaction() as connection:
+        if connection.execute(UPDATE_TITLE, (title, conversation_id)).rowcount == 0:
+            raise ValueError(f"Conversation {conversation_id} not found")
+
+
+def update_conversation_context(
+    conversation_id: str,
+    update: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]]
+):
+    """
+    Update the rolling context (summary and recent turns) of a conversation.
+
+    The context is read and written in one write transaction, so concurrent
+    turns each apply their change to the other's result.
+
+    Args:
+        conversation_id: Conversation identifier
+        update: Function from the stored context state (None if there is none
+            yet) to the new one (see functions/context.py)
+    """
+    with _write_transaction() as connection:
+        if connection.execute(NEXT_POSITION, (conversation_id,)).fetchone() is None:
+            raise ValueError(f"Conversation {conversation_id} not found")
+        row = connection.execute(SELECT_CONTEXT, (conversation_id,)).fetchone()
+        context = update(json.loads(row[0]) if row else None)
+        connection.execute(UPSERT_CONTEXT, (conversation_id, json.dumps(context)))
+
+
+def get_leaderboard() -> Dict[str, Any]:
+    """
+    Get the model leaderboard totals across all conversations.
+
+    Returns:
+        Leaderboard totals (see functions/leaderboard.py)
+    """
+    connection = get_connection()
+    board = leaderboard.empty()
+    row = connection.execute(SELECT_LEADERBOARD_TURNS).fetchone()
+    board["turns"] = row[0] if row else 0
+    for model, *totals in connection.execute(SELECT_LEADERBOARD_MODELS):
+        board["models"][model] = dict(zip(leaderboard.MODEL_FIELDS, totals))
+    for winner, loser, wins in connection.execute(SELECT_LEADERBOARD_PAIRS):
+        board["pairs"].setdefault(winner, {})[loser] = wins
+    return board
+
+
+def update_leaderboard(delta: Dict[str, Any]):
+    """
+    Add one turn's peer rankings to the model leaderboard.
+
+    Args:
+        delta: Leaderboard contribution of the turn (see functions/leaderboard.py)
+    """
+    if not delta["models"]:
+        return
+    with _write_transaction() as connection:
+        connection.execute(UPSERT_LEADERBOARD_TURNS, (delta["turns"],))
+        connection.executemany(UPSERT_LEADERBOARD_MODEL, [
+            (model, *(stats[field] for field in leaderboard.MODEL_FIELDS))
+            for model, stats in delta["models"].items()
+        ])
+        connection.executemany(UPSERT_LEADERBOARD_PAIR, [
+            (winner, loser, wins)
+            for winner, losers in delta["pairs"].items()
+            for loser, wins in losers.items()
+        ])
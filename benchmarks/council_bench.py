@@ -0,0 +1,271 @@
+"""End-to-end council benchmarks against a local fake OpenRouter server.
+
+Starts the stub from fake_openrouter.py and drives one of three targets at a
+fixed concurrency:
+
+- ``stages``: the stage functions in functions/council.py, called directly
+- ``message``: ``POST /api/conversations/{id}/message`` on backend/main.py
+- ``stream``: ``POST /api/conversations/{id}/message/stream``, timing each SSE event
+
+The report gives p50/p95/p99 per stage (or per SSE milestone), time to first
+event and first token, throughput, error counts and process memory. Every
+request asks a fresh question on a fresh conversation, and the response cache
+is off unless ``--cache`` is given, so each run does the full amount of work.
+Use ``--json`` to save the numbers and compare them across commits.
+
+Usage (from the repository root):
+    python -m benchmarks.council_bench --target stream --requests 40 --concurrency 8
+    python -m benchmarks.council_bench --target stages --profiles profiles.json --json before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# SSE events whose arrival time is reported for the stream target
+STREAM_MILESTONES = ("stage1_complete", "stage2_complete", "stage3_complete", "complete")
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def rss_mib() -> float:
+    """Current resident set size of this process in MiB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # No procfs: fall back to the peak, which is what getrusage offers
+        return peak_rss_mib()
+
+
+def peak_rss_mib() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class Recorder:
+    """Collects named timings (seconds) across runs."""
+
+    def __init__(self):
+        self.timings: Dict[str, List[float]] = {}
+        self.completed = 0
+        self.errors: List[str] = []
+
+    def record(self, marks: Dict[str, float]):
+        for name, seconds in marks.items():
+            self.timings.setdefault(name, []).append(seconds)
+        self.completed += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "count": len(values),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": max(values) * 1000,
+            }
+            for name, values in self.timings.items()
+        }
+
+
+# --- Targets ---
+
+async def run_stages(engine, models: List[str], chairman: str, question: str, api_key: str, stream: bool):
+    """One council run through the stage functions; returns per-stage durations."""
+    marks = {}
+    started = time.perf_counter()
+
+    async def on_delta(model, text):
+        marks.setdefault("first_token", time.perf_counter() - started)
+
+    stage_started = time.perf_counter()
+    stage1 = await engine.stage1_collect_responses(models, question, api_key, on_delta if stream else None)
+    marks["stage1"] = time.perf_counter() - stage_started
+    if not stage1:
+        raise RuntimeError("all council models failed in stage 1")
+
+    stage_started = time.perf_counter()
+    stage2, _, _ = await engine.stage2_collect_rankings(stage1, question, api_key, models)
+    marks["stage2"] = time.perf_counter() - stage_started
+
+    stage_started = time.perf_counter()
+    await engine.stage3_synthesize_final(stage1, stage2, question, api_key, chairman, on_delta if stream else None)
+    marks["stage3"] = time.perf_counter() - stage_started
+
+    marks["total"] = time.perf_counter() - started
+    return marks
+
+
+async def run_message(client, base_url: str, question: str):
+    """One non-streaming turn on a new conversation; returns its latency."""
+    response = await client.post(f"{base_url}/api/conversations", json={})
+    response.raise_for_status()
+    conversation_id = response.json()["id"]
+
+    started = time.perf_counter()
+    response = await client.post(f"{base_url}/api/conversations/{conversation_id}/message", json={"content": question})
+    response.raise_for_status()
+    return {"total": time.perf_counter() - started}
+
+
+async def run_stream(client, base_url: str, question: str):
+    """One streaming turn on a new conversation; returns the arrival time of each milestone event."""
+    response = await client.post(f"{base_url}/api/conversations", json={})
+    response.raise_for_status()
+    conversation_id = response.json()["id"]
+
+    marks = {}
+    started = time.perf_counter()
+    async with client.stream(
+        "POST", f"{base_url}/api/conversations/{conversation_id}/message/stream", json={"content": question}
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            elapsed = time.perf_counter() - started
+            marks.setdefault("first_event", elapsed)
+            if event["type"] == "delta":
+                marks.setdefault("first_token", elapsed)
+            elif event["type"] in STREAM_MILESTONES:
+                marks[event["type"]] = elapsed
+            elif event["type"] == "error":
+                raise RuntimeError(event["message"])
+    if "complete" not in marks:
+        raise RuntimeError("stream ended before the complete event")
+    marks["total"] = time.perf_counter() - started
+    return marks
+
+
+async def drive(run_once, requests: int, concurrency: int, warmup: int, recorder: Recorder) -> float:
+    """Run `run_once(i)` `requests` times at the given concurrency; returns the wall time of the measured runs."""
+    for i in range(warmup):
+        await run_once(-1 - i)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            try:
+                recorder.record(await run_once(i))
+            except Exception as e:
+                recorder.errors.append(f"{type(e).__name__}: {e}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return time.perf_counter() - started
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\ntarget={result['target']} requests={result['requests']} concurrency={result['concurrency']} "
+          f"models={len(result['models'])}")
+    print(f"{'metric':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, row in result["timings"].items():
+        print(f"{name:<18}{row['count']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+    print(f"throughput: {result['throughput_per_second']:.2f} runs/s over {result['wall_seconds']:.2f}s, "
+          f"errors: {result['errors']}")
+    print(f"upstream: {result['upstream']}")
+    print(f"memory: rss {result['rss_start_mib']:.1f} -> {result['rss_end_mib']:.1f} MiB, peak {result['peak_rss_mib']:.1f} MiB")
+    for error in result["error_samples"]:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=["stages", "message", "stream"], default="stream")
+    parser.add_argument("--requests", type=int, default=20, help="measured council runs")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured runs first (connection setup, imports)")
+    parser.add_argument("--models", type=int, help="council size (default: backend config)")
+    parser.add_argument("--profiles", help="JSON file of per-model latency profiles, see fake_openrouter.py")
+    parser.add_argument("--stream-stages", action="store_true", help="stream stage 1 and 3 tokens in the stages target")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    # The stub must be up, and its URL in the environment, before the client modules are imported
+    sys.path.insert(0, REPO_ROOT)
+    from benchmarks.fake_openrouter import ModelProfiles, ServerThread, create_app, load_profiles
+
+    stub_app = create_app(ModelProfiles(load_profiles(args.profiles), seed=args.seed))
+    with ServerThread(stub_app) as stub:
+        os.environ["OPENROUTER_API_URL"] = f"{stub.url}/api/v1/chat/completions"
+        os.environ["OPENROUTER_API_KEY"] = "benchmark"
+        # Storage paths in backend/config.py are relative, so run inside a scratch directory
+        os.chdir(tempfile.mkdtemp(prefix="council-bench-"))
+
+        import httpx
+        from backend import config as backend_config
+        from backend import council as backend_council
+        from functions import cache
+        from functions import council as engine
+
+        models = list(backend_config.COUNCIL_MODELS)
+        if args.models:
+            models = [f"bench/model-{i}" for i in range(args.models)]
+            backend_council.COUNCIL_MODELS = models
+        if not args.cache:
+            cache.set_cache(None)
+
+        rss_start = rss_mib()
+        recorder = Recorder()
+
+        if args.target == "stages":
+            async def bench():
+                async def run_once(i):
+                    return await run_stages(engine, models, backend_config.CHAIRMAN_MODEL,
+                                            f"Benchmark question {i}?", "benchmark", args.stream_stages)
+                return await drive(run_once, args.requests, args.concurrency, args.warmup, recorder)
+            wall = asyncio.run(bench())
+        else:
+            from backend.main import app
+            run = run_stream if args.target == "stream" else run_message
+            with ServerThread(app) as backend_server:
+                async def bench():
+                    limits = httpx.Limits(max_connections=args.concurrency * 2)
+                    async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+                        async def run_once(i):
+                            return await run(client, backend_server.url, f"Benchmark question {i}?")
+                        return await drive(run_once, args.requests, args.concurrency, args.warmup, recorder)
+                wall = asyncio.run(bench())
+
+        result = {
+            "target": args.target,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "models": models,
+            "timings": recorder.summary(),
+            "wall_seconds": wall,
+            "throughput_per_second": recorder.completed / wall if wall else 0.0,
+            "errors": len(recorder.errors),
+            "error_samples": recorder.errors[:5],
+            "upstream": dict(stub_app.state.stats),
+            "rss_start_mib": rss_start,
+            "rss_end_mib": rss_mib(),
+            "peak_rss_mib": peak_rss_mib(),
+        }
+
+    print_report(result)
+    if args.json:
+        with open(os.path.join(REPO_ROOT, args.json) if not os.path.isabs(args.json) else args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
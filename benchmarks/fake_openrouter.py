@@ -0,0 +1,199 @@
+"""A local OpenRouter-compatible chat completions server for benchmarks.
+
+Answers ``POST /api/v1/chat/completions`` in the same shape as OpenRouter,
+streaming (SSE) or not, without calling any real model. Each model gets a
+latency profile, so the council's scheduling, retries and streaming can be
+measured for free and reproducibly:
+
+- ``latency_ms``/``sigma``: time to first token, log-normally distributed
+  around the median ``latency_ms``
+- ``tokens``/``tokens_per_second``: length of the answer and how fast it streams
+- ``error_rate``: fraction of requests answered with a 500 or a 429
+
+Ranking prompts (those asking for a FINAL RANKING) are answered with a valid
+ranking of the labels found in the prompt, so stage 2 parses as usual.
+
+Run it on its own and point the backend at it:
+
+    python -m benchmarks.fake_openrouter --port 8999
+    OPENROUTER_API_URL=http://127.0.0.1:8999/api/v1/chat/completions uvicorn backend.main:app
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+DEFAULT_PROFILE = {
+    "latency_ms": 300.0,
+    "sigma": 0.4,
+    "tokens": 300,
+    "tokens_per_second": 400.0,
+    "error_rate": 0.0,
+}
+# Tokens sent per SSE chunk
+CHUNK_TOKENS = 4
+WORDS = ("the council weighs each answer carefully and explains why one response "
+         "is more accurate complete and useful than another").split()
+
+
+class ModelProfiles:
+    """Per-model latency/size/error profiles, with "*" as the fallback for unlisted models."""
+
+    def __init__(self, profiles: Optional[Dict[str, Dict[str, Any]]] = None, seed: Optional[int] = None):
+        profiles = profiles or {}
+        self.default = {**DEFAULT_PROFILE, **profiles.get("*", {})}
+        self.profiles = {model: {**self.default, **profile} for model, profile in profiles.items() if model != "*"}
+        self.random = random.Random(seed)
+
+    def get(self, model: str) -> Dict[str, Any]:
+        return self.profiles.get(model, self.default)
+
+    def first_token_delay(self, profile: Dict[str, Any]) -> float:
+        """Seconds before the first token, log-normal around the profile's median."""
+        return profile["latency_ms"] / 1000 * math.exp(self.random.gauss(0, profile["sigma"]))
+
+
+def _answer_text(prompt: str, tokens: int, rng: random.Random) -> str:
+    """Filler text of about `tokens` words, ending in a parseable ranking for ranking prompts."""
+    body = " ".join(rng.choice(WORDS) for _ in range(tokens))
+    if "FINAL RANKING" not in prompt:
+        return body
+    labels = sorted(set(re.findall(r"Response [A-Z]+\b", prompt)))
+    rng.shuffle(labels)
+    ranking = "\n".join(f"{i}. {label}" for i, label in enumerate(labels, start=1))
+    return f"{body}\n\nFINAL RANKING:\n{ranking}"
+
+
+def _split_tokens(text: str):
+    """Split text into chunks of CHUNK_TOKENS words, keeping the separators."""
+    words = re.findall(r"\S+\s*", text)
+    for i in range(0, len(words), CHUNK_TOKENS):
+        yield "".join(words[i:i + CHUNK_TOKENS])
+
+
+def create_app(profiles: ModelProfiles) -> Starlette:
+    """Build the stub's ASGI app; `app.state.stats` counts requests, errors and streams."""
+    stats = {"requests": 0, "errors": 0, "streams": 0}
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "")
+        prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+        profile = profiles.get(model)
+        stats["requests"] += 1
+
+        if profiles.random.random() < profile["error_rate"]:
+            stats["errors"] += 1
+            await asyncio.sleep(profiles.first_token_delay(profile) / 4)
+            if profiles.random.random() < 0.5:
+                return JSONResponse({"error": {"message": "rate limited", "code": 429}}, status_code=429,
+                                    headers={"Retry-After": "0"})
+            return JSONResponse({"error": {"message": "upstream error", "code": 500}}, status_code=500)
+
+        text = _answer_text(prompt, int(profile["tokens"]), profiles.random)
+        usage = {
+            "prompt_tokens": len(prompt.split()),
+            "completion_tokens": len(text.split()),
+            "total_tokens": len(prompt.split()) + len(text.split()),
+        }
+        completion_id = f"gen-{uuid.uuid4().hex[:12]}"
+        first_token = profiles.first_token_delay(profile)
+        per_chunk = CHUNK_TOKENS / profile["tokens_per_second"]
+
+        if not body.get("stream"):
+            await asyncio.sleep(first_token + len(text.split()) / profile["tokens_per_second"])
+            return JSONResponse({
+                "id": completion_id,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        stats["streams"] += 1
+
+        async def events():
+            yield ": OPENROUTER PROCESSING\n\n"
+            await asyncio.sleep(first_token)
+            for piece in _split_tokens(text):
+                chunk = {"id": completion_id, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(per_chunk)
+            final = {"id": completion_id, "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    app = Starlette(routes=[Route("/api/v1/chat/completions", chat_completions, methods=["POST"])])
+    app.state.stats = stats
+    return app
+
+
+class ServerThread:
+    """Serve an ASGI app with uvicorn on a free local port, in a background thread with its own loop."""
+
+    def __init__(self, app, host: str = "127.0.0.1", port: int = 0):
+        self.app = app
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.host, self.port = self.socket.getsockname()
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="auto"))
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [self.socket]}, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self) -> "ServerThread":
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Server failed to start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def load_profiles(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """Read {"model" or "*": {profile fields}} from a JSON file."""
+    if not path:
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--profiles", help='JSON file of {"model" or "*": {latency_ms, sigma, tokens, tokens_per_second, error_rate}}')
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    app = create_app(ModelProfiles(load_profiles(args.profiles), seed=args.seed))
+    print(f"Fake OpenRouter listening on http://{args.host}:{args.port}/api/v1/chat/completions")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
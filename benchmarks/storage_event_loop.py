@@ -0,0 +1,110 @@
+"""Event-loop latency while many conversations are written concurrently.
+
+Concurrent writers append user and assistant messages with large stage
+outputs, while a probe task measures how late the event loop wakes up from a
+short sleep. "blocking" calls the storage backend directly on the event loop
+(how the routes used to work); "async" goes through the async storage API.
+With the async API, loop lag should stay flat as writers are added.
+
+Usage (from the repository root):
+    python -m benchmarks.storage_event_loop --writers 16 --turns 10 --backend json
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+async def probe_loop_lag(lags, stop, interval=0.005):
+    """Record how many milliseconds later than requested each short sleep wakes up."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lags.append((loop.time() - started - interval) * 1000)
+
+
+async def run_mode(mode, storage, backend, args):
+    """Run all writers in one mode and return its summary row."""
+    answer = "x" * (args.answer_kb * 1024)
+    stage1 = [{"model": f"model-{i}", "content": answer} for i in range(args.council)]
+    stage2 = [{"model": f"model-{i}", "evaluation_text": answer, "parsed_ranking": []} for i in range(args.council)]
+    stage3 = {"model": "chairman", "content": answer}
+
+    conversation_ids = [f"{mode}-{i}" for i in range(args.writers)]
+    for conversation_id in conversation_ids:
+        backend.create_conversation(conversation_id)
+
+    async def writer(conversation_id):
+        for turn in range(args.turns):
+            if mode == "blocking":
+                backend.add_user_message(conversation_id, f"question {turn}")
+                backend.add_assistant_message(conversation_id, stage1, stage2, stage3)
+                await asyncio.sleep(0)
+            else:
+                await storage.add_user_message(conversation_id, f"question {turn}")
+                await storage.add_assistant_message(conversation_id, stage1, stage2, stage3)
+
+    lags = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_loop_lag(lags, stop))
+    await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(conversation_id) for conversation_id in conversation_ids))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe
+    writes = args.writers * args.turns * 2
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "writes_per_second": writes / elapsed,
+        "lag_p50_ms": statistics.median(lags),
+        "lag_p99_ms": percentile(lags, 99),
+        "lag_max_ms": max(lags),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--writers", type=int, default=16, help="concurrent conversations being written")
+    parser.add_argument("--turns", type=int, default=10, help="turns written per conversation")
+    parser.add_argument("--council", type=int, default=4, help="council size (stage outputs per message)")
+    parser.add_argument("--answer-kb", type=int, default=16, help="size of each stage output in KiB")
+    args = parser.parse_args()
+
+    # Storage paths in config.py are relative, so run inside a scratch directory
+    os.environ["STORAGE_BACKEND"] = args.backend
+    sys.path.insert(0, REPO_ROOT)
+    workdir = tempfile.mkdtemp(prefix="council-storage-bench-")
+    os.chdir(workdir)
+
+    from backend import storage
+    backend = storage.load_backend(args.backend)
+
+    print(f"backend={args.backend} writers={args.writers} turns={args.turns} "
+          f"council={args.council} answer={args.answer_kb}KiB dir={workdir}")
+    print(f"{'mode':<10}{'seconds':>10}{'writes/s':>12}{'lag p50':>10}{'lag p99':>10}{'lag max':>10}")
+    for mode in ("blocking", "async"):
+        row = asyncio.run(run_mode(mode, storage, backend, args))
+        print(f"{row['mode']:<10}{row['seconds']:>10.2f}{row['writes_per_second']:>12.1f}"
+              f"{row['lag_p50_ms']:>9.1f}ms{row['lag_p99_ms']:>8.1f}ms{row['lag_max_ms']:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import contextvars
+import json
+import os
+import re
+import threading
+
+from . import review
+from . import telemetry
+
+# --- Token and Cost Accounting ---
+# Every successful model call reports OpenRouter's `usage` block (prompt and
+# completion tokens, and the cost in USD when OpenRouter includes it). Calls
+# are recorded into the ledger of the current council run (per call, per stage,
+# per model), into process-wide totals, and into Prometheus counters.
+#
+# --- Budget Mode ---
+# With a per-request budget, `plan_budget` projects the run's cost before it
+# starts and degrades it until the projection fits, in this order:
+#   1. cap max_tokens for every stage (BUDGET_MAX_TOKENS)
+#   2. drop the most expensive council members, down to BUDGET_MIN_COUNCIL
+#   3. skip stage 2, whose input grows with the council size times the reviews
+#      per answer (see review.py) times answer length
+#   4. drop further members, down to one
+# After stage 1, `replan_after_stage1` re-projects stages 2 and 3 from the
+# tokens actually produced and skips stage 2 if it no longer fits.
+
+# USD per million (prompt, completion) tokens, used only for projections and
+# when OpenRouter does not report a cost. Override with COUNCIL_MODEL_PRICES,
+# a JSON object of {"model": [prompt_price, completion_price]}.
+MODEL_PRICES = {
+    "openai/gpt-5.1": (1.25, 10.0),
+    "google/gemini-3-pro-preview": (2.0, 12.0),
+    "anthropic/claude-sonnet-4.5": (3.0, 15.0),
+    "x-ai/grok-4": (3.0, 15.0),
+    "google/gemini-2.5-flash": (0.3, 2.5),
+    "anthropic/claude-3.5-sonnet": (3.0, 15.0),
+    "google/gemini-pro-1.5": (1.25, 5.0),
+    "openai/gpt-4o": (2.5, 10.0),
+    "google/gemini-1.5-flash": (0.075, 0.3),
+}
+MODEL_PRICES.update({k: tuple(v) for k, v in json.loads(os.environ.get("COUNCIL_MODEL_PRICES", "{}")).items()})
+# Deliberately on the expensive side, so unknown models are not under-budgeted
+DEFAULT_PRICE = (3.0, 15.0)
+
+# Expected completion length per stage when no max_tokens cap applies
+EXPECTED_OUTPUT_TOKENS = {"stage1": 800, "stage2": 600, "stage3": 1000}
+BUDGET_MAX_TOKENS = {
+    "stage1": int(os.environ.get("COUNCIL_BUDGET_STAGE1_MAX_TOKENS", "1024")),
+    "stage2": int(os.environ.get("COUNCIL_BUDGET_STAGE2_MAX_TOKENS", "768")),
+    "stage3": int(os.environ.get("COUNCIL_BUDGET_STAGE3_MAX_TOKENS", "1536")),
+}
+BUDGET_MIN_COUNCIL = int(os.environ.get("COUNCIL_BUDGET_MIN_COUNCIL", "2"))
+
+# Fixed instructions wrapped around the question in the stage 2 and 3 prompts
+PROMPT_OVERHEAD_TOKENS = 250
+
+_WORDS = re.compile(r"\w+|[^\w\s]")
+
+TOKEN_COUNTER = telemetry.register(telemetry.Counter("council_tokens_total", "Tokens used by model calls.", ("model", "stage", "kind")))
+COST_COUNTER = telemetry.register(telemetry.Counter("council_cost_usd_total", "Cost of model calls in USD.", ("model", "stage")))
+
+
+def estimate_tokens(text: str) -> int:
+    """Local token count: about four characters per token, or a token per word or symbol if that is more.
+
+    The second bound keeps code, numbers and non-English text from being underestimated.
+    """
+    return max(len(text) // 4, len(_WORDS.findall(text))) + 1
+
+
+def price_for(model: str):
+    return MODEL_PRICES.get(model, DEFAULT_PRICE)
+
+
+def cost_of(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = price_for(model)
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def normalize_usage(model: str, usage: dict) -> dict:
+    """OpenRouter's usage block reduced to tokens and cost, estimating the cost if it was not reported."""
+    usage = usage or {}
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    cost = usage.get("cost")
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cost": round(float(cost) if cost is not None else cost_of(model, prompt_tokens, completion_tokens), 8),
+        "cost_estimated": cost is None,
+    }
+
+
+# --- Ledgers ---
+
+def _empty_totals() -> dict:
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost": 0.0, "calls": 0}
+
+
+def _add(totals: dict, usage: dict):
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        totals[key] += usage[key]
+    totals["cost"] = round(totals["cost"] + usage["cost"], 8)
+    totals["calls"] += 1
+
+
+_ledger = contextvars.ContextVar("council_ledger", default=None)
+_global_totals = _empty_totals()
+_global_lock = threading.Lock()
+
+
+def start_ledger() -> dict:
+    """Starts accounting for the current council run and returns its ledger."""
+    ledger = {"total": _empty_totals(), "by_stage": {}, "by_model": {}}
+    _ledger.set(ledger)
+    return ledger
+
+
+def current_ledger():
+    return _ledger.get()
+
+
+def record(model: str, usage: dict, stage: str = None):
+    """Adds one call's normalized usage to the run's ledger, the global totals and the metrics."""
+    stage = stage or "unknown"
+    ledger = _ledger.get()
+    if ledger is not None:
+        _add(ledger["total"], usage)
+        _add(ledger["by_stage"].setdefault(stage, _empty_totals()), usage)
+        _add(ledger["by_model"].setdefault(model, _empty_totals()), usage)
+    with _global_lock:
+        _add(_global_totals, usage)
+    TOKEN_COUNTER.inc(usage["prompt_tokens"], model=model, stage=stage, kind="prompt")
+    TOKEN_COUNTER.inc(usage["completion_tokens"], model=model, stage=stage, kind="completion")
+    COST_COUNTER.inc(usage["cost"], model=model, stage=stage)
+
+
+def global_totals() -> dict:
+    """Tokens and cost of every call this process has made."""
+    with _global_lock:
+        return dict(_global_totals)
+
+
+def sum_usage(usages) -> dict:
+    """Adds up ledger totals (e.g. the per-message usage of a conversation)."""
+    totals = _empty_totals()
+    for usage in usages:
+        if not usage:
+            continue
+        for key in totals:
+            totals[key] += usage.get(key, 0)
+    totals["cost"] = round(totals["cost"], 8)
+    return totals
+
+
+# --- Budget Planning ---
+
+def project_cost(council_models: list, chairman_model: str, question: str, max_tokens: dict = None,
+                 skip_stage2: bool = False, stage1_tokens: list = None) -> dict:
+    """Projected USD cost per stage. `stage1_tokens` replaces the stage 1 estimate with actual answer lengths."""
+    max_tokens = max_tokens or {}
+    out = {stage: max_tokens.get(stage) or EXPECTED_OUTPUT_TOKENS[stage] for stage in EXPECTED_OUTPUT_TOKENS}
+    question_tokens = estimate_tokens(question)
+    size = len(council_models)
+    answers = sum(stage1_tokens) if stage1_tokens is not None else size * out["stage1"]
+
+    projection = {"stage1": sum(cost_of(m, question_tokens, out["stage1"]) for m in council_models)}
+    if skip_stage2:
+        projection["stage2"] = 0.0
+        reviews = 0
+    else:
+        # A sparse review (see review.py) queries some of the members, each with some of the answers
+        answered = len(stage1_tokens) if stage1_tokens is not None else size
+        queried = review.reviewer_count(answered, size)
+        review_prompt = PROMPT_OVERHEAD_TOKENS + question_tokens + answers * review.shown_fraction(answered, size)
+        projection["stage2"] = sum(cost_of(m, review_prompt, out["stage2"]) for m in council_models) * queried / max(size, 1)
+        reviews = queried * out["stage2"]
+    projection["stage3"] = cost_of(chairman_model, PROMPT_OVERHEAD_TOKENS + question_tokens + answers + reviews, out["stage3"])
+    projection["total"] = sum(projection.values())
+    return {stage: round(cost, 6) for stage, cost in projection.items()}
+
+
+def plan_budget(budget_usd: float, council_models: list, chairman_model: str, question: str) -> dict:
+    """Degrades a council run until its projected cost fits `budget_usd` (see the order above)."""
+    plan = {
+        "budget_usd": budget_usd,
+        "council_models": list(council_models),
+        "dropped": [],
+        "max_tokens": {},
+        "skip_stage2": False,
+        "actions": [],
+    }
+
+    def projected():
+        return project_cost(plan["council_models"], chairman_model, question, plan["max_tokens"], plan["skip_stage2"])["total"]
+
+    def drop_until(min_size):
+        # Most expensive first, by completion price since answers dominate the cost
+        while projected() > budget_usd and len(plan["council_models"]) > min_size:
+            priciest = max(plan["council_models"], key=lambda m: price_for(m)[::-1])
+            plan["council_models"].remove(priciest)
+            plan["dropped"].append(priciest)
+            plan["actions"].append(f"drop:{priciest}")
+
+    if projected() > budget_usd:
+        plan["max_tokens"] = dict(BUDGET_MAX_TOKENS)
+        plan["actions"].append("cap_max_tokens")
+    drop_until(BUDGET_MIN_COUNCIL)
+    if projected() > budget_usd:
+        plan["skip_stage2"] = True
+        plan["actions"].append("skip_stage2")
+    drop_until(1)
+
+    plan["projected_usd"] = projected()
+    plan["within_budget"] = plan["projected_usd"] <= budget_usd
+    return plan
+
+
+def replan_after_stage1(plan: dict, stage1_responses: list, chairman_model: str, question: str, spent_usd: float) -> dict:
+    """Skips stage 2 if what is left of the budget no longer covers it, given the actual stage 1 answers."""
+    if plan is None or plan["skip_stage2"]:
+        return plan
+    stage1_tokens = [
+        (resp.get("usage") or {}).get("completion_tokens") or estimate_tokens(resp.get("content") or "")
+        for resp in stage1_responses
+    ]
+    remaining = project_cost(plan["council_models"], chairman_model, question, plan["max_tokens"],
+                             stage1_tokens=stage1_tokens)
+    if spent_usd + remaining["stage2"] + remaining["stage3"] > plan["budget_usd"]:
+        plan["skip_stage2"] = True
+        plan["actions"].append("skip_stage2_after_stage1")
+    plan["spent_after_stage1_usd"] = round(spent_usd, 6)
+    return plan
@@ -0,0 +1,222 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import telemetry
+
+# --- Content-Addressed Response Cache ---
+# Model responses are cached under a hash of (model, full prompt, generation
+# params), so an identical council run is answered without paid calls. Stage 2
+# prompts are built deterministically from stage 1 outputs, so once stage 1 hits
+# the cache the ranking and synthesis prompts repeat exactly and hit too.
+#
+# The default cache is an in-memory LRU tier. An on-disk tier can be added with
+# `configure(disk_dir=...)`, and any object with get(key)/set(key, value)
+# methods can be plugged in with `set_cache`.
+
+CACHE_ENABLED = os.environ.get("COUNCIL_CACHE_ENABLED", "1") != "0"
+MEMORY_MAX_ENTRIES = int(os.environ.get("COUNCIL_CACHE_MAX_ENTRIES", "1024"))
+MEMORY_TTL = float(os.environ.get("COUNCIL_CACHE_TTL", "3600"))
+DISK_DIR = os.environ.get("COUNCIL_CACHE_DIR")
+DISK_MAX_BYTES = int(os.environ.get("COUNCIL_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+DISK_TTL = float(os.environ.get("COUNCIL_CACHE_DISK_TTL", "86400"))
+
+
+def cache_key(model: str, prompt: str, params: dict = None) -> str:
+    """Hashes everything that determines a model's response."""
+    material = json.dumps({"model": model, "prompt": prompt, "params": params or {}}, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    """LRU cache with a per-entry TTL and a maximum number of entries."""
+
+    def __init__(self, max_entries: int = MEMORY_MAX_ENTRIES, ttl: float = MEMORY_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskCache:
+    """One JSON file per entry. TTL is checked against mtime, which is refreshed on every hit,
+    so evicting the oldest mtimes first gives LRU eviction once `max_bytes` is exceeded."""
+
+    def __init__(self, directory: str, max_bytes: int = DISK_MAX_BYTES, ttl: float = DISK_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                self._remove(path)
+                return None
+            with open(path, "r") as f:
+                value = json.load(f)
+            os.utime(path)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, value: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        size = os.path.getsize(tmp_path)
+
+        with self._lock:
+            # Overwriting an entry (e.g. two concurrent misses for the same call) only adds the difference
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += size - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        """Yields (path, size, mtime) for every cached entry."""
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if filename.endswith(".json"):
+                    path = os.path.join(root, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """Removes expired entries, then least recently used ones until under 90% of max_bytes."""
+        now = time.time()
+        entries = sorted(self._scan(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, mtime in entries:
+            if self._size <= self.max_bytes * 0.9 and mtime + self.ttl >= now:
+                break
+            self._remove(path)
+            self._size -= size
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class TieredCache:
+    """Checks tiers in order and back-fills the faster tiers on a hit."""
+
+    def __init__(self, *tiers):
+        self.tiers = list(tiers)
+
+    def get(self, key: str):
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for faster_tier in self.tiers[:i]:
+                    faster_tier.set(key, value)
+                return value
+        return None
+
+    def set(self, key: str, value: dict):
+        for tier in self.tiers:
+            tier.set(key, value)
+
+
+_cache = None
+_stats = contextvars.ContextVar("council_cache_stats", default=None)
+
+
+def configure(enabled: bool = CACHE_ENABLED, max_entries: int = MEMORY_MAX_ENTRIES, ttl: float = MEMORY_TTL,
+              disk_dir: str = DISK_DIR, disk_max_bytes: int = DISK_MAX_BYTES, disk_ttl: float = DISK_TTL):
+    """(Re)builds the process-wide cache from the given settings."""
+    if not enabled:
+        set_cache(None)
+        return
+    tiers = [MemoryCache(max_entries, ttl)]
+    if disk_dir:
+        tiers.append(DiskCache(disk_dir, disk_max_bytes, disk_ttl))
+    set_cache(TieredCache(*tiers))
+
+
+def set_cache(cache):
+    """Plugs in any object with get(key) and set(key, value) methods, or None to disable caching."""
+    global _cache
+    _cache = cache
+
+
+def start_stats() -> dict:
+    """Starts counting hits and misses for the current council run and returns the counters."""
+    stats = {"hits": 0, "misses": 0}
+    _stats.set(stats)
+    return stats
+
+
+def _count(outcome: str):
+    stats = _stats.get()
+    if stats is not None:
+        stats[outcome] += 1
+
+
+async def lookup(model: str, prompt: str, params: dict = None):
+    """Returns a copy of the cached response, or None on a miss."""
+    if _cache is None:
+        return None
+    # Disk tiers block, so keep them off the event loop
+    value = await asyncio.to_thread(_cache.get, cache_key(model, prompt, params))
+    _count("misses" if value is None else "hits")
+    telemetry.CACHE_LOOKUPS.inc(result="miss" if value is None else "hit")
+    return None if value is None else dict(value)
+
+
+async def store(model: str, prompt: str, response: dict, params: dict = None):
+    """Caches a successful response, minus the per-call attempt history."""
+    if _cache is None:
+        return
+    value = {k: v for k, v in response.items() if k != "attempts"}
+    try:
+        await asyncio.to_thread(_cache.set, cache_key(model, prompt, params), value)
+    except Exception as e:
+        # A full disk or unwritable cache dir must never fail the model call
+        print(f"Could not cache response from {model}: {e}")
+
+
+configure()
@@ -0,0 +1,268 @@
+import asyncio
+import contextvars
+import json
+import os
+import re
+
+from . import accounting
+from . import telemetry
+from .openrouter import query_model
+
+# --- Prompt Compaction ---
+# Stage 2 sends every reviewer all N answers, and stage 3 sends the chairman all
+# answers plus all critiques, so both prompts grow with council size times answer
+# length. Before those prompts are built, the texts are fitted to a token budget:
+# the smaller of the stage's configured budget and what the model's context
+# window leaves after the instructions, the question and the completion. The
+# budget is shared fairly: texts under their share are sent whole and their
+# slack goes to the longer ones, so short answers are never touched.
+#
+# COUNCIL_COMPACTION_MODE picks how an over-long text is shortened:
+#   - "extract": keep headings, the first sentence of every paragraph and list,
+#     then as much of the rest as fits, in the original order (no model call)
+#   - "truncate": keep the head and the tail
+#   - "summarize": ask COUNCIL_COMPACTION_MODEL for a summary of the target
+#     length, falling back to "extract" when that fails or overshoots
+#   - "off": send everything
+# A critique's FINAL RANKING section is always kept verbatim. What was saved is
+# recorded per stage in metadata["compaction"] and in a Prometheus counter.
+
+COMPACTION_MODE = os.environ.get("COUNCIL_COMPACTION_MODE", "extract")
+COMPACTION_MODEL = os.environ.get("COUNCIL_COMPACTION_MODEL", "google/gemini-2.5-flash")
+
+# Tokens of answers (stage 2) or answers plus critiques (stage 3) per prompt
+STAGE_INPUT_TOKENS = {
+    "stage2": int(os.environ.get("COUNCIL_STAGE2_INPUT_TOKENS", "12000")),
+    "stage3": int(os.environ.get("COUNCIL_STAGE3_INPUT_TOKENS", "24000")),
+}
+# Share of the stage 3 budget that goes to the answers; the critiques get the rest
+STAGE3_ANSWER_SHARE = 0.6
+# No text is cut below this, however many there are
+MIN_TEXT_TOKENS = 64
+# Room left for the completion when the call has no max_tokens
+RESERVED_OUTPUT_TOKENS = 4096
+
+# Context window in tokens. Override with COUNCIL_MODEL_CONTEXT_TOKENS, a JSON
+# object of {"model": tokens}.
+MODEL_CONTEXT_TOKENS = {
+    "openai/gpt-5.1": 400_000,
+    "google/gemini-3-pro-preview": 1_048_576,
+    "anthropic/claude-sonnet-4.5": 200_000,
+    "x-ai/grok-4": 256_000,
+    "google/gemini-2.5-flash": 1_048_576,
+    "anthropic/claude-3.5-sonnet": 200_000,
+    "google/gemini-pro-1.5": 2_000_000,
+    "openai/gpt-4o": 128_000,
+    "google/gemini-1.5-flash": 1_000_000,
+}
+MODEL_CONTEXT_TOKENS.update(json.loads(os.environ.get("COUNCIL_MODEL_CONTEXT_TOKENS", "{}")))
+# Deliberately small, so unknown models are not overflowed
+DEFAULT_CONTEXT_TOKENS = 32_000
+
+SAVED_TOKENS = telemetry.register(telemetry.Counter(
+    "council_compaction_saved_tokens_total", "Prompt tokens not sent thanks to compaction.", ("stage", "mode")))
+
+_RANKING_SECTION = re.compile(r"FINAL RANKING:", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_LIST_ITEM = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+")
+OMITTED = "[...]"
+
+
+def context_limit(model: str) -> int:
+    return MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+
+
+def input_budget(stage: str, models: list, question: str, max_tokens: int = None) -> int:
+    """Tokens of input texts that a prompt for `stage` may carry so that it fits every one of `models`."""
+    fixed = accounting.PROMPT_OVERHEAD_TOKENS + accounting.estimate_tokens(question) + (max_tokens or RESERVED_OUTPUT_TOKENS)
+    return min([STAGE_INPUT_TOKENS[stage]] + [context_limit(model) - fixed for model in models])
+
+
+def allocate(lengths: list, budget: int) -> list:
+    """Splits `budget` fairly: texts under their share keep their length and the rest share what is left."""
+    shares = [None] * len(lengths)
+    remaining = list(range(len(lengths)))
+    while remaining:
+        share = max(budget // len(remaining), MIN_TEXT_TOKENS)
+        fitting = [i for i in remaining if lengths[i] <= share]
+        if not fitting:
+            for i in remaining:
+                shares[i] = share
+            break
+        for i in fitting:
+            shares[i] = lengths[i]
+            budget -= lengths[i]
+        remaining = [i for i in remaining if lengths[i] > share]
+    return shares
+
+
+# --- Methods ---
+
+def _split_ranking(text: str):
+    """Splits a critique into its body and its FINAL RANKING section ("" if it has none)."""
+    match = _RANKING_SECTION.search(text)
+    if not match:
+        return text, ""
+    return text[:match.start()].rstrip(), text[match.start():]
+
+
+def truncate(text: str, tokens: int) -> str:
+    """Keeps the first three quarters and the last quarter of the token budget."""
+    total = accounting.estimate_tokens(text)
+    if total <= tokens:
+        return text
+    chars = len(text) * (tokens - accounting.estimate_tokens(OMITTED)) // total
+    head, tail = chars * 3 // 4, chars // 4
+    return f"{text[:head].rstrip()}\n{OMITTED}\n{text[len(text) - tail:].lstrip() if tail else ''}".rstrip()
+
+
+def extract(text: str, tokens: int) -> str:
+    """Keeps the most informative parts of a text that fit, in their original order.
+
+    Headings and the first sentence (or item) of every paragraph come first,
+    then list items, then the remaining sentences in order of appearance.
+    """
+    if accounting.estimate_tokens(text) <= tokens:
+        return text
+    # Each paragraph is a list of (priority, piece) and the separator to rejoin its pieces
+    paragraphs = []
+    for block in re.split(r"\n\s*\n", text):
+        lines = block.strip().splitlines()
+        if not lines:
+            continue
+        if lines[0].lstrip().startswith("#") or any(_LIST_ITEM.match(line) for line in lines):
+            pieces = [(1 if i == 0 or line.lstrip().startswith("#") else 2, line) for i, line in enumerate(lines)]
+            paragraphs.append((pieces, "\n"))
+        else:
+            sentences = _SENTENCE_END.split(" ".join(line.strip() for line in lines))
+            paragraphs.append(([(1 if i == 0 else 3, sentence) for i, sentence in enumerate(sentences)], " "))
+
+    budget = tokens - accounting.estimate_tokens(OMITTED)
+    chosen = {}
+    candidates = [(priority, p, i) for p, (pieces, _) in enumerate(paragraphs) for i, (priority, _) in enumerate(pieces)]
+    for priority, p, i in sorted(candidates):
+        piece = paragraphs[p][0][i][1]
+        cost = accounting.estimate_tokens(piece)
+        if cost > budget and budget >= MIN_TEXT_TOKENS:
+            # Too long to keep whole (e.g. text without sentence breaks): keep what fits of it
+            piece = truncate(piece, budget * 9 // 10)
+            cost = accounting.estimate_tokens(piece)
+        if cost <= budget:
+            chosen[(p, i)] = piece
+            budget -= cost
+
+    parts = []
+    for p, (pieces, joiner) in enumerate(paragraphs):
+        kept = [chosen[(p, i)] for i in range(len(pieces)) if (p, i) in chosen]
+        if not kept:
+            if parts and parts[-1] != OMITTED:
+                parts.append(OMITTED)
+            continue
+        parts.append(joiner.join(kept) + (f" {OMITTED}" if len(kept) < len(pieces) else ""))
+    result = "\n\n".join(parts)
+    # A single huge sentence or line can still be over budget
+    return truncate(result, tokens)
+
+
+async def summarize(text: str, tokens: int, api_key: str) -> str:
+    """Asks COMPACTION_MODEL for a summary of about `tokens` tokens; falls back to extract()."""
+    prompt = (
+        f"Condense the following text to at most {tokens * 3 // 4} words. Keep every claim, number, "
+        f"recommendation and caveat that matters; drop repetition, filler and examples. "
+        f"Reply with the condensed text only.\n\n{text}"
+    )
+    response = await query_model(COMPACTION_MODEL, prompt, api_key, max_tokens=tokens)
+    summary = (response or {}).get("content") or ""
+    if summary.strip() and accounting.estimate_tokens(summary) <= tokens:
+        return summary.strip()
+    return extract(text, tokens)
+
+
+# --- Stage Inputs ---
+
+_stats = contextvars.ContextVar("council_compaction_stats", default=None)
+
+
+def start_stats() -> dict:
+    """Starts recording what compaction saved in the current council run and returns the record."""
+    stats = {}
+    _stats.set(stats)
+    return stats
+
+
+async def compact_texts(texts: list, budget: int, api_key: str = None, mode: str = COMPACTION_MODE):
+    """Fits `texts` into `budget` tokens in total; returns (texts, original tokens, compacted tokens)."""
+    bodies, rankings = zip(*(_split_ranking(text) for text in texts)) if texts else ((), ())
+    lengths = [accounting.estimate_tokens(text) for text in texts]
+    original = sum(lengths)
+    if mode == "off" or original <= budget:
+        return list(texts), original, original
+
+    # Ranking sections are never cut, so they come off the top of the budget
+    fixed = [accounting.estimate_tokens(ranking) if ranking else 0 for ranking in rankings]
+    shares = allocate([length - f for length, f in zip(lengths, fixed)], budget - sum(fixed))
+
+    async def fit(body, share):
+        if accounting.estimate_tokens(body) <= share:
+            return body
+        if mode == "truncate":
+            return truncate(body, share)
+        if mode == "summarize" and api_key:
+            return await summarize(body, share, api_key)
+        return extract(body, share)
+
+    fitted = await asyncio.gather(*(fit(body, share) for body, share in zip(bodies, shares)))
+    compacted = [f"{body}\n\n{ranking}" if ranking else body for body, ranking in zip(fitted, rankings)]
+    return compacted, original, sum(accounting.estimate_tokens(text) for text in compacted)
+
+
+def _record(stage: str, budget: int, before: list, after: list, recipients: int = 1) -> dict:
+    """Counts what compaction saved in a prompt that is sent to `recipients` models."""
+    original = sum(accounting.estimate_tokens(text) for text in before)
+    kept = sum(accounting.estimate_tokens(text) for text in after)
+    # Every text goes to each recipient, so each of them is spared the difference
+    saved = (original - kept) * recipients
+    if saved:
+        SAVED_TOKENS.inc(saved, stage=stage, mode=COMPACTION_MODE)
+    stats = _stats.get()
+    if stats is not None:
+        entry = stats.setdefault(stage, {"mode": COMPACTION_MODE, "budget_tokens": budget, "original_tokens": 0,
+                                         "compacted_tokens": 0, "saved_tokens": 0, "compacted": 0})
+        entry["original_tokens"] += original
+        entry["compacted_tokens"] += kept
+        entry["saved_tokens"] += saved
+        entry["compacted"] += sum(1 for text, compacted in zip(before, after) if text != compacted)
+    return {"original_tokens": original, "compacted_tokens": kept, "saved_tokens": saved}
+
+
+async def compact_for_review(answers: list, question: str, reviewers: list, api_key: str, max_tokens: int = None,
+                             per_prompt: int = None, recipients: int = None) -> list:
+    """Fits the stage 1 answers shown to the reviewers in stage 2.
+
+    By default every reviewer is shown every answer. In a sparse review (see
+    review.py) a prompt carries at most `per_prompt` answers and each answer
+    goes to `recipients` reviewers, so the answers are compacted once to shares
+    that let any `per_prompt` of them fit a prompt.
+    """
+    budget = input_budget("stage2", reviewers, question, max_tokens)
+    total = budget * len(answers) // per_prompt if per_prompt else budget
+    with telemetry.span("council.compact", stage="compaction", for_stage="stage2", mode=COMPACTION_MODE,
+                        budget_tokens=budget) as compact_span:
+        compacted, _, _ = await compact_texts(answers, total, api_key)
+        compact_span.set(**_record("stage2", budget, answers, compacted, recipients=recipients or len(reviewers)))
+    return compacted
+
+
+async def compact_for_synthesis(answers: list, critiques: list, question: str, chairman_model: str, api_key: str,
+                                max_tokens: int = None):
+    """Fits the answers and critiques shown to the chairman in stage 3; returns (answers, critiques)."""
+    budget = input_budget("stage3", [chairman_model], question, max_tokens)
+    with telemetry.span("council.compact", stage="compaction", for_stage="stage3", mode=COMPACTION_MODE,
+                        budget_tokens=budget) as compact_span:
+        critique_tokens = sum(accounting.estimate_tokens(text) for text in critiques)
+        # Answers get their share, plus whatever the critiques leave unused
+        answer_budget = max(int(budget * STAGE3_ANSWER_SHARE), budget - critique_tokens)
+        compacted_answers, _, answer_tokens = await compact_texts(answers, answer_budget, api_key)
+        compacted_critiques, _, _ = await compact_texts(critiques, budget - answer_tokens, api_key)
+        compact_span.set(**_record("stage3", budget, answers + critiques, compacted_answers + compacted_critiques))
+    return compacted_answers, compacted_critiques
@@ -2,6 +2,8 @@ import os
 from firebase_admin import initialize_app, remoteconfig
 from firebase_functions import options
 
+from . import model_config
+
 # It'''s recommended to set the project ID in the environment
 # for both local development and deployed functions.
 # For local dev, use:
@@ -25,18 +27,11 @@ except ValueError:
 
 # --- Model Configuration ---
 # You can manage your model lists in Firebase Remote Config for easy updates
-# without redeploying your function.
-
-# Initialize Remote Config
-remote_config_client = remoteconfig.Client()
-
-# Get the template
-try:
-    template = remote_config_client.get_template()
-except Exception as e:
-    print(f"Could not fetch remote config template, using defaults: {e}")
-    template = remoteconfig.RemoteConfigTemplate()
-
+# without redeploying your function. They are fetched lazily and cached for
+# COUNCIL_MODELS_TTL_SECONDS (see model_config.py), so a cold start makes no
+# Remote Config round trips before it can serve. When Remote Config cannot be
+# reached, the lists come from COUNCIL_MODELS_FILE if set, else the defaults.
+# Seed the Remote Config parameters once with `python -m functions.seed_remote_config`.
 
 # Define default model lists
 DEFAULT_COUNCIL_MODELS = [
@@ -46,41 +41,69 @@ DEFAULT_COUNCIL_MODELS = [
 ]
 DEFAULT_CHAIRMAN_MODEL = "google/gemini-1.5-flash"
 
-# Set default parameters in the template if they don'''t exist
-if "council_models" not in template.parameters:
-    template.parameters["council_models"] = remoteconfig.Parameter(
-        default_value={"value": ",".join(DEFAULT_COUNCIL_MODELS)},
-        description="Comma-separated list of OpenRouter model identifiers for the council.",
-        value_type=remoteconfig.ParameterValueType.STRING
-    )
-if "chairman_model" not in template.parameters:
-    template.parameters["chairman_model"] = remoteconfig.Parameter(
-        default_value={"value": DEFAULT_CHAIRMAN_MODEL},
-        description="The model identifier for the chairman.",
-        value_type=remoteconfig.ParameterValueType.STRING
-    )
-
-# Publish the template with default values if it was modified
-# In a real-world scenario, you might do this once via a setup script
-# or through the Firebase Console. For this example, we ensure it'''s set.
-try:
-    remote_config_client.publish_template(template)
-    print("Successfully published remote config template.")
-except Exception as e:
-    print(f"Could not publish remote config template, using defaults: {e}")
+MODELS_FILE = os.environ.get("COUNCIL_MODELS_FILE")
+MODELS_TTL_SECONDS = float(os.environ.get("COUNCIL_MODELS_TTL_SECONDS", "300"))
+# How long the first request of a process waits for Remote Config before using the fallback
+MODELS_WAIT_SECONDS = float(os.environ.get("COUNCIL_MODELS_WAIT_SECONDS", "2"))
+
+_remote_config_client = None
+
+
+def _fetch_remote_models():
+    """Fetches the model lists from Remote Config, filling empty values with the defaults."""
+    global _remote_config_client
+    if _remote_config_client is None:
+        _remote_config_client = remoteconfig.Client()
+    _remote_config_client.fetch_config()
+    remote = _remote_config_client.get_config()
+
+    council_models = [m for m in remote.get("council_models").as_string().split(',') if m]
+    chairman_model = remote.get("chairman_model").as_string()
+    return council_models or DEFAULT_COUNCIL_MODELS, chairman_model or DEFAULT_CHAIRMAN_MODEL
+
+
+def _fallback_models():
+    """The local models file if configured and readable, else the defaults."""
+    if MODELS_FILE:
+        try:
+            return model_config.load_models_file(MODELS_FILE)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not read models file {MODELS_FILE}, using defaults: {e}")
+    return DEFAULT_COUNCIL_MODELS, DEFAULT_CHAIRMAN_MODEL
+
+
+models = model_config.ModelConfigProvider(
+    _fetch_remote_models, _fallback_models, ttl=MODELS_TTL_SECONDS, wait=MODELS_WAIT_SECONDS
+)
+# Start loading now, off the import path, so the first request rarely has to wait
+models.refresh_in_background()
+
+
+def get_models():
+    """Returns (council_models, chairman_model), from the in-process cache when fresh."""
+    return models.get()
 
-# Fetch the latest config
-remote_config_client.fetch_config()
+# --- Stage 1 Quorum ---
+# Stage 2 starts once COUNCIL_STAGE1_QUORUM answers are in (unset = wait for
+# every member) or once COUNCIL_STAGE1_BUDGET_SECONDS have passed. Late answers
+# are either dropped ("drop") or folded into a follow-up review ("followup").
+STAGE1_QUORUM = int(os.environ["COUNCIL_STAGE1_QUORUM"]) if os.environ.get("COUNCIL_STAGE1_QUORUM") else None
+STAGE1_BUDGET_SECONDS = float(os.environ["COUNCIL_STAGE1_BUDGET_SECONDS"]) if os.environ.get("COUNCIL_STAGE1_BUDGET_SECONDS") else None
+LATE_STAGE1_POLICY = os.environ.get("COUNCIL_LATE_POLICY", "drop")
 
-# Get council models and chairman model from Remote Config
-COUNCIL_MODELS = remote_config_client.get_config().get("council_models").as_string().split(',')
-CHAIRMAN_MODEL = remote_config_client.get_config().get("chairman_model").as_string()
+# --- Cost Budget ---
+# Default budget per council run in USD (unset = unlimited); a request can pass
+# its own "budget_usd". See accounting.py for how a run is fitted to it.
+BUDGET_USD = float(os.environ["COUNCIL_BUDGET_USD"]) if os.environ.get("COUNCIL_BUDGET_USD") else None
 
-# Fallback to defaults if the config is empty
-if not COUNCIL_MODELS or (len(COUNCIL_MODELS) == 1 and not COUNCIL_MODELS[0]):
-    COUNCIL_MODELS = DEFAULT_COUNCIL_MODELS
-if not CHAIRMAN_MODEL:
-    CHAIRMAN_MODEL = DEFAULT_CHAIRMAN_MODEL
+# --- Stage Deadlines ---
+# Upper bound in seconds for each model call in a stage, retries included, so a
+# hung provider cannot stall the council indefinitely.
+STAGE_DEADLINES = {
+    "stage1": float(os.environ.get("COUNCIL_STAGE1_DEADLINE_SECONDS", "120")),
+    "stage2": float(os.environ.get("COUNCIL_STAGE2_DEADLINE_SECONDS", "120")),
+    "stage3": float(os.environ.get("COUNCIL_STAGE3_DEADLINE_SECONDS", "180")),
+}
 
 # --- API Key Configuration ---
 # Get the OpenRouter API key from Firebase Functions secrets
@@ -91,6 +114,7 @@ OPENROUTER_API_KEY = options.SecretOption("OPENROUTER_API_KEY")
 
 print("--- Configuration Loaded ---")
 print(f"Project ID: {project_id}")
-print(f"Council Models: {COUNCIL_MODELS}")
-print(f"Chairman Model: {CHAIRMAN_MODEL}")
+print(f"Models: loaded lazily from Remote Config (TTL {MODELS_TTL_SECONDS}s, fallback: {MODELS_FILE or 'defaults'})")
+print(f"Stage Deadlines: {STAGE_DEADLINES}")
+print(f"Stage 1 Quorum: {STAGE1_QUORUM or 'all'} (budget: {STAGE1_BUDGET_SECONDS}s, late policy: {LATE_STAGE1_POLICY})")
 print("--------------------------")
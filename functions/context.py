@@ -0,0 +1,131 @@
+import os
+
+from . import accounting
+from . import compaction
+from . import telemetry
+from .openrouter import query_model
+
+# --- Conversation Context ---
+# Follow-up questions are sent to the council together with what came before,
+# but in bounded form: a rolling summary of older turns plus the most recent
+# turns verbatim. The state lives with the conversation, so a turn never reads
+# the whole history:
+#
+#   {"summary": "...", "summarized_turns": 12, "offset": 12, "pending": [],
+#    "turns": [{"user": "...", "assistant": "..."}, ...]}
+#
+# `turns` holds the turns sent verbatim, oldest first; `offset` is the number of
+# turns before them. Once there are CONTEXT_TURNS + SUMMARY_BATCH_TURNS of them
+# the state is stale: the oldest are folded into the summary with one call to
+# SUMMARY_MODEL, which sees only the previous summary and those turns. The
+# refresh runs alongside the council (the turns it folds are still in the
+# prompt verbatim), so it adds no latency. If it fails, the window is trimmed
+# anyway and the turns it should have folded wait in `pending` (at most
+# PENDING_MAX_TURNS, oldest dropped first) for a retry on the next turn.
+#
+# Turns of one conversation can run concurrently, each updating the state it
+# started from; `merge` applies such an update to the state as it is when the
+# turn is saved, so no turn's update is lost.
+
+CONTEXT_TURNS = int(os.environ.get("COUNCIL_CONTEXT_TURNS", "3"))
+SUMMARY_BATCH_TURNS = int(os.environ.get("COUNCIL_SUMMARY_BATCH_TURNS", "2"))
+SUMMARY_MODEL = os.environ.get("COUNCIL_SUMMARY_MODEL", "google/gemini-2.5-flash")
+SUMMARY_MAX_TOKENS = int(os.environ.get("COUNCIL_SUMMARY_MAX_TOKENS", "600"))
+# Stored turns are shortened to this (see compaction.extract), which bounds the state and the prompt
+TURN_MAX_TOKENS = int(os.environ.get("COUNCIL_CONTEXT_TURN_TOKENS", "800"))
+PENDING_MAX_TURNS = 4 * SUMMARY_BATCH_TURNS
+
+
+def empty_state() -> dict:
+    return {"summary": "", "summarized_turns": 0, "offset": 0, "pending": [], "turns": []}
+
+
+def _offset(state: dict) -> int:
+    # States saved before `offset` was kept never dropped a turn
+    return state.get("offset", state["summarized_turns"])
+
+
+def add_turn(state: dict, user: str, assistant: str) -> dict:
+    """Returns the state with a finished turn appended."""
+    state = state or empty_state()
+    turn = {
+        "user": compaction.extract(user, TURN_MAX_TOKENS),
+        "assistant": compaction.extract(assistant or "", TURN_MAX_TOKENS),
+    }
+    return {**state, "turns": state["turns"] + [turn]}
+
+
+def is_stale(state: dict) -> bool:
+    return bool(state) and (len(state["turns"]) >= CONTEXT_TURNS + SUMMARY_BATCH_TURNS or bool(state.get("pending")))
+
+
+def merge(current: dict, base: dict, updated: dict) -> dict:
+    """Applies what a turn changed from `base` to `updated` (a refresh, new turns) to `current`, the state as saved now."""
+    if not current or not updated:
+        return updated or current
+    base = base or empty_state()
+    added = _offset(updated) + len(updated["turns"]) - _offset(base) - len(base["turns"])
+    new_turns = updated["turns"][len(updated["turns"]) - added:] if added > 0 else []
+    state = current
+    folded = _offset(updated) - _offset(current)
+    # Unless another turn has already saved a refresh at least as recent
+    if folded > 0:
+        state = {**updated, "turns": current["turns"][folded:]}
+    return {**state, "turns": state["turns"] + new_turns}
+
+
+def prompt_for(question: str, state: dict) -> str:
+    """The question as sent to the council: unchanged on a first turn, else preceded by the conversation so far."""
+    if not state or not (state["summary"] or state["turns"]):
+        return question
+    parts = ["This question continues an ongoing conversation."]
+    if state["summary"]:
+        parts.append(f"Summary of the earlier conversation:\n{state['summary']}")
+    if state["turns"]:
+        recent = "\n\n".join(f"User: {turn['user']}\nAssistant: {turn['assistant']}" for turn in state["turns"])
+        parts.append(f"Most recent exchanges:\n{recent}")
+    parts.append(f"Current question: {question}")
+    return "\n\n".join(parts)
+
+
+async def refresh_summary(state: dict, api_key: str) -> dict:
+    """Folds all but the last CONTEXT_TURNS turns (and pending ones) into the summary.
+
+    On failure the window is trimmed all the same, and the turns to fold are kept in `pending`.
+    """
+    if not is_stale(state):
+        return state
+    folded, kept = state["turns"][:-CONTEXT_TURNS], state["turns"][-CONTEXT_TURNS:]
+    pending = state.get("pending", []) + folded
+    turns_text = "\n\n".join(f"User: {turn['user']}\nAssistant: {turn['assistant']}" for turn in pending)
+    prompt = (
+        f"You maintain a running summary of a conversation between a user and an assistant. "
+        f"Update the summary with the new exchanges below. Keep the user's goals, constraints, decisions, "
+        f"facts established so far and open questions; drop pleasantries and detail that later turns will not need. "
+        f"Write at most {SUMMARY_MAX_TOKENS * 3 // 4} words and reply with the updated summary only.\n\n"
+        f"Current summary:\n{state['summary'] or '(none yet)'}\n\n"
+        f"New exchanges:\n{turns_text}"
+    )
+    with telemetry.span("council.context", stage="summary", folded_turns=len(pending)):
+        response = await query_model(SUMMARY_MODEL, prompt, api_key, max_tokens=SUMMARY_MAX_TOKENS)
+    summary = ((response or {}).get("content") or "").strip()
+    offset = _offset(state) + len(folded)
+    if not summary:
+        return {**state, "offset": offset, "pending": pending[-PENDING_MAX_TURNS:], "turns": kept}
+    return {
+        "summary": compaction.truncate(summary, SUMMARY_MAX_TOKENS),
+        "summarized_turns": state["summarized_turns"] + len(pending),
+        "offset": offset,
+        "pending": [],
+        "turns": kept,
+    }
+
+
+def describe(state: dict, prompt: str, question: str) -> dict:
+    """What context a turn was sent with, for response metadata."""
+    state = state or empty_state()
+    return {
+        "summarized_turns": state["summarized_turns"],
+        "verbatim_turns": len(state["turns"]),
+        "context_tokens": accounting.estimate_tokens(prompt) - accounting.estimate_tokens(question) if prompt != question else 0,
+    }
@@ -1,27 +1,109 @@
 import asyncio
+import functools
+import hashlib
+import json
 import random
 import re
-from .openrouter import query_models_parallel
+import time
+from . import accounting
+from . import cache
+from . import compaction
+from . import context
+from . import governor
+from . import review
+from . import selection
+from . import telemetry
+from .openrouter import get_client, query_model, query_models_parallel
+from .scheduler import gather_quorum
+
+# All stages are coroutines so that a whole council run shares one event loop
+# and the pooled OpenRouter client in `openrouter.py`. Synchronous callers
+# (e.g. the Cloud Function) should go through `runtime.run(run_full_council(...))`.
 
 # --- Stage 1: Collect Initial Responses ---
-def stage1_collect_responses(models: list, prompt: str, api_key: str):
-    """Queries all council models in parallel for their initial responses."""
-    return asyncio.run(query_models_parallel(models, prompt, api_key))
+@telemetry.traced_stage("stage1")
+async def stage1_collect_responses(models: list, prompt: str, api_key: str, on_delta=None, deadline: float = None,
+                                   max_tokens: int = None):
+    """Queries all council models in parallel for their initial responses.
+
+    Pass `on_delta(model, text)` to stream each member's tokens as they are generated.
+    """
+    return await query_models_parallel(models, prompt, api_key, on_delta, deadline, max_tokens)
+
+@telemetry.traced_stage("stage1")
+async def stage1_collect_quorum(models: list, prompt: str, api_key: str, quorum: int = None, budget: float = None,
+                                on_delta=None, keep_late: bool = False, deadline: float = None, max_tokens: int = None):
+    """Collects initial responses until `quorum` answers are in or `budget` seconds have passed.
+
+    Returns (responses, late_tasks, decision). `late_tasks` maps the queries that
+    missed the quorum to their model. They are cancelled unless `keep_late` is set,
+    in which case they keep running so `stage2_review_late_responses` can fold
+    them into a follow-up review round.
+    """
+    started = time.monotonic()
+    client = get_client()
+    tasks = {
+        asyncio.create_task(query_model(model, prompt, api_key, client, on_delta, deadline, max_tokens)): model
+        for model in models
+    }
+    results, late_tasks, trigger = await gather_quorum(tasks, quorum, budget)
+    if not keep_late:
+        for task in late_tasks:
+            task.cancel()
+
+    # Keep the configured council order rather than arrival order
+    responses = [results[model] for model in models if model in results]
+    decision = {
+        "quorum": quorum,
+        "total": len(models),
+        "budget_seconds": budget,
+        "trigger": trigger,
+        "elapsed_seconds": round(time.monotonic() - started, 3),
+        "on_time": [resp["model"] for resp in responses],
+        "late": list(late_tasks.values()),
+    }
+    return responses, late_tasks, decision
 
 # --- Stage 2: Collect Peer Rankings ---
-def stage2_collect_rankings(stage1_responses: list, question: str, api_key: str, council_models: list):
+@telemetry.traced_stage("stage2")
+async def stage2_collect_rankings(stage1_responses: list, question: str, api_key: str, council_models: list, deadline: float = None,
+                                  max_tokens: int = None):
     """Anonymizes responses and asks each model to rank its peers."""
     if not stage1_responses:
         return [], {}, []
 
     # Anonymize the responses into a dictionary of "Response A", "Response B", etc.
     # This prevents models from being biased towards their own output.
-    shuffled_responses = random.sample(stage1_responses, len(stage1_responses))
-    label_to_model = {f"Response {chr(65 + i)}": resp["model"] for i, resp in enumerate(shuffled_responses)}
-    anonymized_responses_text = "\n\n".join([f'{label}:\n{resp["content"]}' for label, resp in zip(label_to_model.keys(), shuffled_responses)])
+    shuffled_responses = _stable_shuffle(stage1_responses, question)
+    label_to_model = {_response_label(i): resp["model"] for i, resp in enumerate(shuffled_responses)}
+    labeled_responses = list(zip(label_to_model.keys(), shuffled_responses))
+
+    parsed_rankings, ranking_responses = await _run_review_round(
+        labeled_responses, question, api_key, council_models, deadline, max_tokens
+    )
+    return parsed_rankings, label_to_model, ranking_responses
+
+def _stable_shuffle(responses: list, question: str):
+    """Shuffles responses in an order derived from their content.
 
-    # Construct the prompt for evaluation
-    ranking_prompt = (
+    Labels still don't follow council order, but identical inputs always produce
+    the identical ranking prompt, so a replayed run hits the response cache.
+    """
+    seed = hashlib.sha256(json.dumps([question] + [resp["content"] for resp in responses]).encode("utf-8")).hexdigest()
+    return random.Random(seed).sample(responses, len(responses))
+
+def _response_label(index: int) -> str:
+    """The anonymized label of the index-th answer: "Response A" to "Response Z", then "Response AA", "Response AB", ..."""
+    letters = ""
+    index += 1
+    while index:
+        index, letter = divmod(index - 1, 26)
+        letters = chr(65 + letter) + letters
+    return f"Response {letters}"
+
+def _ranking_prompt(question: str, labeled_contents: list) -> str:
+    anonymized_responses_text = "\n\n".join([f'{label}:\n{content}' for label, content in labeled_contents])
+    return (
         f"You are a member of an LLM council tasked with evaluating responses to a user'''s question. "
         f"The user'''s original question was: \"{question}\".\n\n"
         f"Here are the anonymized responses from your fellow council members:\n\n"
@@ -35,30 +117,115 @@ def stage2_collect_rankings(stage1_responses: list, question: str, api_key: str,
         f"4. Do not add any text after the final ranking list."
     )
 
-    # Query all models again for their rankings
-    # We exclude the model being asked to rank from the list of models being queried,
-    # but for simplicity in this parallel implementation, we query all.
-    # A more advanced version could have each model rank all *other* models.
-    ranking_responses = asyncio.run(query_models_parallel(council_models, ranking_prompt, api_key))
+async def _run_review_round(labeled_responses: list, question: str, api_key: str, council_models: list, deadline: float = None,
+                            max_tokens: int = None):
+    """Asks the council models to rank the given (label, response) pairs.
+
+    Large councils review sparsely: each answer goes to a few reviewers other
+    than its author and each reviewer ranks only the answers it was shown (see
+    `review.py`). Every ranking lists those answers under "reviewed_labels".
+    """
+    labels = [label for label, _ in labeled_responses]
+    authors = {label: resp["model"] for label, resp in labeled_responses}
+    seed = hashlib.sha256(json.dumps([question] + [resp["content"] for _, resp in labeled_responses]).encode("utf-8")).hexdigest()
+    assignment = review.assign(authors, council_models, seed)
 
-    # Parse the rankings from the raw text responses
+    if assignment is None:
+        contents = await compaction.compact_for_review(
+            [resp["content"] for _, resp in labeled_responses], question, council_models, api_key, max_tokens
+        )
+        # Every reviewer gets the same prompt, its own answer included
+        ranking_prompt = _ranking_prompt(question, list(zip(labels, contents)))
+        ranking_responses = await query_models_parallel(council_models, ranking_prompt, api_key, deadline=deadline, max_tokens=max_tokens)
+        shown = {resp["model"]: labels for resp in ranking_responses}
+    else:
+        reviewers = list(assignment)
+        contents = await compaction.compact_for_review(
+            [resp["content"] for _, resp in labeled_responses], question, reviewers, api_key, max_tokens,
+            per_prompt=max(len(assigned) for assigned in assignment.values()), recipients=review.REVIEWS_PER_ANSWER
+        )
+        content_for = dict(zip(labels, contents))
+        client = get_client()
+        results = await asyncio.gather(*(
+            query_model(reviewer, _ranking_prompt(question, [(label, content_for[label]) for label in assigned]), api_key,
+                        client, deadline=deadline, max_tokens=max_tokens)
+            for reviewer, assigned in assignment.items()
+        ))
+        ranking_responses = [resp for resp in results if resp is not None]
+        shown = assignment
+
+    # Parse the rankings from the raw text responses, counting only the labels each reviewer was shown
     parsed_rankings = []
     for ranking_resp in ranking_responses:
         if ranking_resp and ranking_resp['content']:
-            parsed, raw_text = parse_ranking_from_text(ranking_resp['content'], list(label_to_model.keys()))
+            reviewed = shown[ranking_resp["model"]]
+            parsed, raw_text = parse_ranking_from_text(ranking_resp['content'], reviewed)
             parsed_rankings.append({
                 "model": ranking_resp["model"],
                 "evaluation_text": raw_text,
-                "parsed_ranking": parsed
+                "parsed_ranking": parsed,
+                "reviewed_labels": reviewed,
+                "usage": ranking_resp.get("usage"),
             })
 
-    return parsed_rankings, label_to_model, ranking_responses
+    return parsed_rankings, ranking_responses
+
+@telemetry.traced_stage("stage2")
+async def stage2_review_late_responses(late_tasks: dict, stage1_responses: list, stage2_rankings: list, label_to_model: dict,
+                                       question: str, api_key: str, council_models: list, late_policy: str = "drop",
+                                       deadline: float = None, max_tokens: int = None):
+    """Drops late stage-1 answers or folds them into a follow-up review round.
+
+    With late_policy="followup", answers that arrived while stage 2 was running get
+    the next free labels and every council model re-ranks the full set. A
+    reviewer's follow-up ranking supersedes its first-round ranking. Queries
+    that are still running at this point are cancelled under either policy.
+
+    Returns (stage1_responses, stage2_rankings, label_to_model, late_decision).
+    """
+    late_responses = []
+    dropped = []
+    for task, model in late_tasks.items():
+        if late_policy == "followup" and task.done() and not task.cancelled() and task.result() is not None:
+            late_responses.append(task.result())
+        else:
+            task.cancel()
+            dropped.append(model)
+
+    late_decision = {
+        "late_policy": late_policy,
+        "folded": [resp["model"] for resp in late_responses],
+        "dropped": dropped,
+    }
+    if not late_responses:
+        return stage1_responses, stage2_rankings, label_to_model, late_decision
+
+    start = len(label_to_model)
+    shuffled_late = _stable_shuffle(late_responses, question)
+    label_to_model = {
+        **label_to_model,
+        **{_response_label(start + i): resp["model"] for i, resp in enumerate(shuffled_late)},
+    }
+    stage1_responses = stage1_responses + late_responses
+    by_model = {resp["model"]: resp for resp in stage1_responses}
+    labeled_responses = [(label, by_model[model]) for label, model in label_to_model.items()]
+
+    followup_rankings, _ = await _run_review_round(labeled_responses, question, api_key, council_models, deadline, max_tokens)
+    for ranking in followup_rankings:
+        ranking["round"] = "followup"
+
+    reviewed_again = {ranking["model"] for ranking in followup_rankings}
+    stage2_rankings = [r for r in stage2_rankings if r["model"] not in reviewed_again] + followup_rankings
+    return stage1_responses, stage2_rankings, label_to_model, late_decision
+
+_RANKING_HEADER = re.compile(r"FINAL RANKING:(.*)", re.DOTALL | re.IGNORECASE)
+
 
 def parse_ranking_from_text(text: str, labels: list):
     """Extracts the ordered list of ranked responses from the evaluation text."""
     try:
         # Find the content that comes after "FINAL RANKING:"
-        ranking_section = re.search(r"FINAL RANKING:(.*)", text, re.DOTALL | re.IGNORECASE)
+        ranking_section = _RANKING_HEADER.search(text)
         if not ranking_section:
             # Fallback: if the header is missing, try to find any ordered list of labels
             return _extract_labels_in_order(text, labels), text
@@ -74,21 +241,42 @@ def parse_ranking_from_text(text: str, labels: list):
 
 def _extract_labels_in_order(text: str, labels: list):
     """A helper to find all label occurrences in a piece of text and return them in order."""
-    # Create a regex pattern to find any of the labels
-    # e.g., (Response A|Response B|Response C)
-    pattern = "(" + "|".join(re.escape(label) for label in labels) + ")"
-    return re.findall(pattern, text)
+    if not labels:
+        return []
+    return _label_pattern(tuple(labels)).findall(text)
+
+@functools.lru_cache(maxsize=256)
+def _label_pattern(labels: tuple):
+    """A compiled regex matching any of the labels, e.g. (Response A|Response B|Response C).
+
+    In a full review every reviewer of a turn ranks the same labels, so each set is compiled once.
+    Longer labels go first and a label must end at a word boundary, so
+    "Response A" never matches the start of a longer label.
+    """
+    alternatives = sorted(labels, key=len, reverse=True)
+    return re.compile("(" + "|".join(re.escape(label) for label in alternatives) + r")\b")
 
 
 # --- Stage 3: Synthesize Final Answer ---
-def stage3_synthesize_final(stage1_responses: list, stage2_rankings: list, question: str, api_key: str, chairman_model: str):
-    """Asks a chairman model to synthesize the final answer based on all inputs."""
+@telemetry.traced_stage("stage3")
+async def stage3_synthesize_final(stage1_responses: list, stage2_rankings: list, question: str, api_key: str, chairman_model: str,
+                                  on_delta=None, deadline: float = None, max_tokens: int = None):
+    """Asks a chairman model to synthesize the final answer based on all inputs.
+
+    Pass `on_delta(model, text)` to stream the chairman's tokens as they are generated.
+    """
     if not stage1_responses:
         return {"content": "I am sorry, but I was unable to generate a response."}
 
-    # Prepare the context for the chairman model
-    s1_text = "\n\n".join([f'{resp["model"]}:\n{resp["content"]}' for resp in stage1_responses])
-    s2_text = "\n\n".join([f'Evaluator: {ranking["model"]}\nCritique: {ranking["evaluation_text"]}' for ranking in stage2_rankings])
+    # Prepare the context for the chairman model, compacted to fit its budget
+    answers, critiques = await compaction.compact_for_synthesis(
+        [resp["content"] for resp in stage1_responses], [ranking["evaluation_text"] for ranking in stage2_rankings],
+        question, chairman_model, api_key, max_tokens
+    )
+    s1_text = "\n\n".join([f'{resp["model"]}:\n{answer}' for resp, answer in zip(stage1_responses, answers)])
+    s2_text = "\n\n".join([f'Evaluator: {ranking["model"]}\nCritique: {critique}' for ranking, critique in zip(stage2_rankings, critiques)])
+    if not stage2_rankings:
+        s2_text = "(No peer evaluations were collected for this question.)"
 
     synthesis_prompt = (
         f"You are the Chairman of an LLM council. Your task is to synthesize a final, high-quality answer to a user'''s question based on the submissions and peer reviews from the council members.\n\n"
@@ -104,17 +292,157 @@ def stage3_synthesize_final(stage1_responses: list, stage2_rankings: list, quest
     )
 
     # Query the chairman model
-    final_response = asyncio.run(query_models_parallel([chairman_model], synthesis_prompt, api_key))
+    final_response = await query_models_parallel([chairman_model], synthesis_prompt, api_key, on_delta, deadline, max_tokens)
     return final_response[0] if final_response else {"content": "The chairman failed to generate a response."}
 
+# --- Full Pipeline ---
+async def run_full_council(council_models: list, chairman_model: str, question: str, api_key: str,
+                           quorum: int = None, stage1_budget: float = None, late_policy: str = "drop",
+                           stage_deadlines: dict = None, budget_usd: float = None, flow: str = None,
+                           council_size: int = None):
+    """Runs all three stages on the current event loop and returns (stage1, stage2, stage3, metadata).
+
+    Stage 2 starts once `quorum` stage-1 answers are in or `stage1_budget` seconds
+    have passed (by default it waits for every member). What happened to the late
+    answers is recorded in metadata["stage1_quorum"] and response cache hits and
+    misses in metadata["cache"]. `stage_deadlines` maps
+    "stage1"/"stage2"/"stage3" to the seconds each model call in that stage may take,
+    retries included. Per-stage and per-call timings are in metadata["timings"]; a
+    trace the caller already started (e.g. to include storage timings) is reused.
+
+    Long answers and critiques are compacted before stages 2 and 3 (see
+    `compaction.py`); what that saved is in metadata["compaction"].
+
+    Tokens and cost are in metadata["usage"]. With `budget_usd`, the run is
+    degraded to fit the budget (see `accounting.plan_budget`) and the plan is in
+    metadata["budget"].
+
+    The run's model calls are queued under `flow` (e.g. the conversation id) by
+    the request governor, which admits calls round-robin across flows (see
+    `governor.py`).
+
+    With `council_size` (by default selection.SELECTION_SIZE) smaller than the
+    roster, only that many members are queried, chosen from their recent
+    quality, failures and latency (see `selection.py`); the choice and its
+    reasons are in metadata["selection"].
+    """
+    stage_deadlines = stage_deadlines or {}
+    if flow is not None:
+        governor.set_flow(flow)
+    cache_stats = cache.start_stats()
+    compaction_stats = compaction.start_stats()
+    ledger = accounting.current_ledger() or accounting.start_ledger()
+    trace = telemetry.current_trace()
+    if trace is None:
+        trace = telemetry.start_trace()
+
+    council_size = selection.SELECTION_SIZE if council_size is None else council_size
+    choice = None
+    if 0 < council_size < len(council_models):
+        choice = selection.select(council_models, council_size, chairman_model, question, budget_usd)
+        council_models = choice["council_models"]
+
+    plan = None
+    max_tokens = {}
+    if budget_usd is not None:
+        plan = accounting.plan_budget(budget_usd, council_models, chairman_model, question)
+        council_models, max_tokens = plan["council_models"], plan["max_tokens"]
+
+    with telemetry.span("council.run", council_size=len(council_models), chairman=chairman_model):
+        stage1_responses, late_tasks, decision = await stage1_collect_quorum(
+            council_models, question, api_key, quorum, stage1_budget,
+            keep_late=late_policy == "followup", deadline=stage_deadlines.get("stage1"),
+            max_tokens=max_tokens.get("stage1")
+        )
+        plan = accounting.replan_after_stage1(plan, stage1_responses, chairman_model, question, ledger["total"]["cost"])
+        if plan and plan["skip_stage2"]:
+            stage2_rankings, label_to_model = [], {}
+            late_policy = "drop"
+        else:
+            stage2_rankings, label_to_model, _ = await stage2_collect_rankings(
+                stage1_responses, question, api_key, council_models, stage_deadlines.get("stage2"),
+                max_tokens.get("stage2")
+            )
+        stage1_responses, stage2_rankings, label_to_model, late_decision = await stage2_review_late_responses(
+            late_tasks, stage1_responses, stage2_rankings, label_to_model, question, api_key, council_models, late_policy,
+            stage_deadlines.get("stage2"), max_tokens.get("stage2")
+        )
+        stage3_response = await stage3_synthesize_final(
+            stage1_responses, stage2_rankings, question, api_key, chairman_model, deadline=stage_deadlines.get("stage3"),
+            max_tokens=max_tokens.get("stage3")
+        )
+
+    aggregate_rankings = calculate_aggregate_rankings(stage2_rankings, label_to_model)
+    selection.observe(council_models, stage1_responses, aggregate_rankings)
+    metadata = {
+        "label_to_model": label_to_model,
+        "aggregate_rankings": aggregate_rankings,
+        "stage1_quorum": {**decision, **late_decision},
+        "cache": cache_stats,
+        "compaction": compaction_stats,
+        "timings": telemetry.summarize(trace),
+        "usage": ledger,
+    }
+    if plan is not None:
+        metadata["budget"] = plan
+    if choice is not None:
+        metadata["selection"] = choice
+    return stage1_responses, stage2_rankings, stage3_response, metadata
+
+async def run_conversation_turn(council_models: list, chairman_model: str, question: str, api_key: str,
+                                context_state: dict = None, **options):
+    """Runs the council on a question in the context of its conversation (see `context.py`).
+
+    The question is sent with the rolling summary and recent turns in
+    `context_state`; a stale summary is refreshed while the council runs.
+    `options` are passed on to run_full_council. Returns (stage1, stage2,
+    stage3, metadata, context_state), where the new state includes this turn
+    and should be stored with the conversation.
+    """
+    prompt = context.prompt_for(question, context_state)
+    refresh = asyncio.create_task(context.refresh_summary(context_state, api_key)) if context.is_stale(context_state) else None
+    stage1_responses, stage2_rankings, stage3_response, metadata = await run_full_council(
+        council_models, chairman_model, prompt, api_key, **options
+    )
+    state = await refresh if refresh else context_state
+    metadata["context"] = context.describe(context_state, prompt, question)
+    return stage1_responses, stage2_rankings, stage3_response, metadata, context.add_turn(
+        state, question, stage3_response.get("content")
+    )
+
+@telemetry.traced_stage("title")
+async def generate_conversation_title(question: str, api_key: str, model: str):
+    """Asks a (fast) model for a short title summarizing the user's first question."""
+    title_prompt = (
+        f"Generate a very short title (3-5 words maximum) that summarizes the following question. "
+        f"The title should be concise and descriptive. Do not use quotes or punctuation in the title.\n\n"
+        f"Question: {question}\n\n"
+        f"Title:"
+    )
+    response = await query_model(model, title_prompt, api_key)
+    if not response or not response.get("content"):
+        return "New Conversation"
+
+    title = response["content"].strip().strip('"\'')
+    return title[:47] + "..." if len(title) > 50 else title
+
 # --- Utility Functions ---
 def calculate_aggregate_rankings(stage2_rankings: list, label_to_model: dict):
-    """Calculates the aggregate ranking for each model based on peer evaluations."""
+    """Calculates the aggregate ranking for each model based on peer evaluations.
+
+    `average_score` is the mean Borda points (a first place among n ranked
+    answers gets n points). `score` is the mean position normalized to 0..1
+    within each reviewer's list. Models are ordered by `score`, as on the
+    leaderboard, since Borda points are not comparable between reviewers that
+    ranked lists of different lengths (a sparse review, or a ranking that only
+    partly parsed). The leaderboard is updated separately from
+    leaderboard.turn_delta.
+    """
     if not stage2_rankings:
         return []
 
     # Initialize scores for each model
-    model_scores = {model: {"total_score": 0, "votes": 0} for model in label_to_model.values()}
+    model_scores = {model: {"total_score": 0, "normalized": 0.0, "votes": 0} for model in label_to_model.values()}
 
     for ranking in stage2_rankings:
         # A ranked list like ["Response C", "Response A", "Response B"]
@@ -125,6 +453,7 @@ def calculate_aggregate_rankings(stage2_rankings: list, label_to_model: dict):
             model_name = label_to_model.get(label)
             if model_name:
                 model_scores[model_name]["total_score"] += score
+                model_scores[model_name]["normalized"] += (score - 1) / (len(ranked_labels) - 1) if len(ranked_labels) > 1 else 1.0
                 model_scores[model_name]["votes"] += 1
 
     # Calculate average score and sort
@@ -135,8 +464,9 @@ def calculate_aggregate_rankings(stage2_rankings: list, label_to_model: dict):
             aggregate_rankings.append({
                 "model": model,
                 "average_score": round(average_score, 2),
+                "score": round(data["normalized"] / data["votes"], 4),
                 "votes": data["votes"]
             })
 
-    # Sort by average score, descending
-    return sorted(aggregate_rankings, key=lambda x: x["average_score"], reverse=True)
+    # Sort by normalized score, then average score, descending
+    return sorted(aggregate_rankings, key=lambda x: (x["score"], x["average_score"]), reverse=True)
@@ -0,0 +1,176 @@
+import copy
+import json
+import threading
+import uuid
+from datetime import datetime, timezone
+
+try:
+    from google.cloud.firestore import SERVER_TIMESTAMP, Increment
+except ImportError:
+    SERVER_TIMESTAMP = None
+    Increment = None
+
+try:
+    from google.api_core.exceptions import AlreadyExists
+except ImportError:
+    class AlreadyExists(Exception):
+        pass
+
+# --- In-Memory Firestore Fake ---
+# Implements the subset of the Firestore client API that persistence.py uses
+# (collection/document references, set with merge, get, stream, where("=="),
+# write batches with set and create, and Increment transforms), so persistence can be exercised
+# without a project or the emulator:
+#
+#   db = FakeFirestore()
+#   persistence.save_turn(db, "conv-1", prompt, stage1, stage2, stage3, mode="sync")
+#
+# Like Firestore it rejects documents over MAX_DOCUMENT_BYTES and batches of
+# more than MAX_BATCH_WRITES, and `fail_next_commits` makes commits raise to
+# exercise retries.
+
+MAX_DOCUMENT_BYTES = 1024 * 1024
+MAX_BATCH_WRITES = 500
+
+
+def _document_size(data: dict) -> int:
+    """Approximates Firestore's document size (bytes values count at their raw length)."""
+    size = 0
+    for key, value in data.items():
+        size += len(key) + 1
+        if isinstance(value, bytes):
+            size += len(value)
+        elif isinstance(value, dict):
+            size += _document_size(value)
+        else:
+            size += len(json.dumps(value, default=str))
+    return size
+
+
+def _merge(current: dict, data: dict, now) -> dict:
+    """Applies a set with merge=True: maps merge field by field and increments add to the current value."""
+    merged = dict(current)
+    for key, value in data.items():
+        if isinstance(value, dict):
+            merged[key] = _merge(merged[key] if isinstance(merged.get(key), dict) else {}, value, now)
+        else:
+            merged[key] = _resolve(value, merged.get(key), now)
+    return merged
+
+
+def _resolve(value, current, now):
+    if SERVER_TIMESTAMP is not None and value is SERVER_TIMESTAMP:
+        return now
+    if Increment is not None and isinstance(value, Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    return value
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self.exists else None
+
+
+class DocumentReference:
+    def __init__(self, db, path: tuple):
+        self._db = db
+        self.path = path
+        self.id = path[-1]
+
+    def collection(self, name: str) -> "CollectionReference":
+        return CollectionReference(self._db, self.path + (name,))
+
+    def set(self, data: dict, merge: bool = False):
+        batch = self._db.batch()
+        batch.set(self, data, merge=merge)
+        batch.commit()
+
+    def get(self) -> DocumentSnapshot:
+        with self._db._lock:
+            return DocumentSnapshot(self, copy.deepcopy(self._db._documents.get(self.path)))
+
+
+class CollectionReference:
+    def __init__(self, db, path: tuple, filters: tuple = ()):
+        self._db = db
+        self.path = path
+        self._filters = filters
+
+    def document(self, document_id: str = None) -> DocumentReference:
+        return DocumentReference(self._db, self.path + (document_id or uuid.uuid4().hex[:20],))
+
+    def where(self, field: str, op: str, value) -> "CollectionReference":
+        if op != "==":
+            raise NotImplementedError(f"FakeFirestore only supports '==' filters, not {op!r}")
+        return CollectionReference(self._db, self.path, self._filters + ((field, value),))
+
+    def stream(self):
+        with self._db._lock:
+            matches = [
+                (path, data) for path, data in sorted(self._db._documents.items())
+                if len(path) == len(self.path) + 1 and path[:-1] == self.path
+                and all(data.get(field) == value for field, value in self._filters)
+            ]
+        for path, data in matches:
+            yield DocumentSnapshot(DocumentReference(self._db, path), copy.deepcopy(data))
+
+
+class WriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference: DocumentReference, data: dict, merge: bool = False):
+        self._writes.append((reference.path, copy.deepcopy(data), merge, False))
+
+    def create(self, reference: DocumentReference, data: dict):
+        """Like set, but the whole batch fails with AlreadyExists if the document exists."""
+        self._writes.append((reference.path, copy.deepcopy(data), False, True))
+
+    def commit(self):
+        if len(self._writes) > MAX_BATCH_WRITES:
+            raise ValueError(f"Batch has {len(self._writes)} writes, the maximum is {MAX_BATCH_WRITES}")
+        self._db._commit(self._writes)
+        self._writes = []
+
+
+class FakeFirestore:
+    """Thread-safe in-memory stand-in for a firestore.Client."""
+
+    def __init__(self):
+        self._documents = {}
+        self._lock = threading.Lock()
+        self.fail_next_commits = 0
+        self.commits = 0
+
+    def collection(self, name: str) -> CollectionReference:
+        return CollectionReference(self, (name,))
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def _commit(self, writes):
+        with self._lock:
+            if self.fail_next_commits > 0:
+                self.fail_next_commits -= 1
+                raise ConnectionError("FakeFirestore: injected commit failure")
+            now = datetime.now(timezone.utc)
+            staged = {}
+            for path, data, merge, create in writes:
+                current = staged.get(path, self._documents.get(path))
+                if create and current is not None:
+                    raise AlreadyExists(f"Document {'/'.join(path)} already exists")
+                document = _merge(current if merge and current else {}, data, now)
+                size = _document_size(document)
+                if size > MAX_DOCUMENT_BYTES:
+                    raise ValueError(f"Document {'/'.join(path)} is {size} bytes, the maximum is {MAX_DOCUMENT_BYTES}")
+                staged[path] = document
+            # Batches are atomic: nothing is applied if any write was rejected
+            self._documents.update(staged)
+            self.commits += 1
@@ -0,0 +1,267 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+from collections import OrderedDict, deque
+
+from . import telemetry
+
+# --- Request Governor ---
+# Every OpenRouter request in a worker process passes through one governor
+# before it is sent, so concurrent council runs share the upstream limits
+# instead of each bursting into them. Each model and each API key has:
+#   - a token bucket: `rps` requests per second on average, bursts up to `burst`
+#   - a limit of `max_in_flight` requests outstanding at once
+# A request is sent once both its model's and its key's limiter admit it.
+# Until then it waits in the queue of its flow (the conversation or batch item
+# it belongs to, see `set_flow`), and waiting requests are admitted round-robin
+# across flows: a conversation with many calls queued cannot starve the others.
+#
+# A 429 pauses the model for its Retry-After (or THROTTLE_PAUSE seconds) and
+# halves its rate; each success then recovers RATE_RECOVERY of the full rate.
+# So when a provider pushes back, the burst behind the 429 waits its turn in
+# the queue rather than collecting 429s of its own and shrinking the council.
+#
+# Limits come from OPENROUTER_MODEL_RPS / _BURST / _MAX_IN_FLIGHT and the
+# OPENROUTER_KEY_* equivalents (0 = unlimited), and per model from
+# OPENROUTER_MODEL_LIMITS, a JSON object of {"model": {"rps": .., "burst": .., "max_in_flight": ..}}.
+
+MODEL_RPS = float(os.environ.get("OPENROUTER_MODEL_RPS", "10"))
+MODEL_BURST = float(os.environ.get("OPENROUTER_MODEL_BURST", "20"))
+MODEL_MAX_IN_FLIGHT = int(os.environ.get("OPENROUTER_MODEL_MAX_IN_FLIGHT", "32"))
+KEY_RPS = float(os.environ.get("OPENROUTER_KEY_RPS", "0"))
+KEY_BURST = float(os.environ.get("OPENROUTER_KEY_BURST", "50"))
+KEY_MAX_IN_FLIGHT = int(os.environ.get("OPENROUTER_KEY_MAX_IN_FLIGHT", "128"))
+MODEL_LIMITS = json.loads(os.environ.get("OPENROUTER_MODEL_LIMITS", "{}"))
+
+THROTTLE_PAUSE = float(os.environ.get("OPENROUTER_THROTTLE_PAUSE", "1"))
+# Lowest fraction of its configured rate a throttled model is slowed down to
+MIN_RATE_FACTOR = 0.1
+RATE_RECOVERY = 0.05
+
+QUEUE_DEPTH = telemetry.register(telemetry.Gauge(
+    "openrouter_governor_queue_depth", "Requests waiting for the governor to admit them.", ("model",)))
+IN_FLIGHT = telemetry.register(telemetry.Gauge(
+    "openrouter_governor_in_flight", "Requests admitted by the governor and not yet finished.", ("model",)))
+WAIT_SECONDS = telemetry.register(telemetry.Histogram(
+    "openrouter_governor_wait_seconds", "Time requests waited for the governor.", ("model",)))
+THROTTLED = telemetry.register(telemetry.Counter(
+    "openrouter_governor_throttled_total", "429 responses that slowed a model down.", ("model",)))
+
+_flow = contextvars.ContextVar("council_flow", default=None)
+
+
+def set_flow(name: str):
+    """Names the flow (e.g. the conversation id) that requests made from the current context belong to."""
+    _flow.set(name)
+
+
+class Limiter:
+    """Token bucket plus in-flight limit for one model or API key. Not thread-safe; used on one event loop."""
+
+    def __init__(self, rps: float = 0, burst: float = 1, max_in_flight: int = 0):
+        self.rps = rps
+        self.burst = max(burst, 1)
+        self.max_in_flight = max_in_flight
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.rate_factor = 1.0
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        if self.rps > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rps * self.rate_factor)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a request could be admitted: 0 if now, inf if it waits for one to finish."""
+        if self.max_in_flight > 0 and self.in_flight >= self.max_in_flight:
+            return float("inf")
+        wait = max(0.0, self.paused_until - now)
+        if self.rps > 0:
+            self._refill(now)
+            if self.tokens < 1:
+                wait = max(wait, (1 - self.tokens) / (self.rps * self.rate_factor))
+        return wait
+
+    def take(self, now: float):
+        if self.rps > 0:
+            self.tokens -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+
+    def throttled(self, now: float, retry_after: float = None):
+        self._refill(now)
+        self.rate_factor = max(MIN_RATE_FACTOR, self.rate_factor / 2)
+        self.paused_until = max(self.paused_until, now + (THROTTLE_PAUSE if retry_after is None else retry_after))
+
+    def succeeded(self):
+        self.rate_factor = min(1.0, self.rate_factor + RATE_RECOVERY)
+
+
+class Slot:
+    """An admitted request; call release() with its HTTP status once it has finished."""
+
+    def __init__(self, governor, model: str, limiters: tuple, waited: float):
+        self.governor = governor
+        self.model = model
+        self.limiters = limiters
+        self.waited = waited
+        self.released = False
+
+    def release(self, status: int = None, retry_after: float = None):
+        if not self.released:
+            self.released = True
+            self.governor._release(self, status, retry_after)
+
+
+class Governor:
+    """Admits requests per model and per API key, round-robin across flows."""
+
+    def __init__(self, model_limits: dict = None, model_rps: float = MODEL_RPS, model_burst: float = MODEL_BURST,
+                 model_max_in_flight: int = MODEL_MAX_IN_FLIGHT, key_rps: float = KEY_RPS, key_burst: float = KEY_BURST,
+                 key_max_in_flight: int = KEY_MAX_IN_FLIGHT):
+        self.model_limits = model_limits if model_limits is not None else MODEL_LIMITS
+        self.model_defaults = {"rps": model_rps, "burst": model_burst, "max_in_flight": model_max_in_flight}
+        self.key_defaults = {"rps": key_rps, "burst": key_burst, "max_in_flight": key_max_in_flight}
+        self.models = {}
+        self.keys = {}
+        # flow -> deque of waiters [future, model, limiters, enqueued_at]; ordered by whose turn is next
+        self.flows = OrderedDict()
+        self.depth = {}
+        self._timer = None
+
+    def _model_limiter(self, model: str) -> Limiter:
+        limiter = self.models.get(model)
+        if limiter is None:
+            limiter = self.models[model] = Limiter(**{**self.model_defaults, **self.model_limits.get(model, {})})
+        return limiter
+
+    def _key_limiter(self, key: str) -> Limiter:
+        limiter = self.keys.get(key)
+        if limiter is None:
+            limiter = self.keys[key] = Limiter(**self.key_defaults)
+        return limiter
+
+    async def acquire(self, model: str, key: str) -> Slot:
+        """Waits until the request may be sent and returns its slot."""
+        limiters = (self._model_limiter(model), self._key_limiter(key))
+        now = time.monotonic()
+        if not self.flows and all(limiter.wait_time(now) == 0 for limiter in limiters):
+            return self._admit(model, limiters, now, now)
+
+        future = asyncio.get_running_loop().create_future()
+        self.flows.setdefault(_flow.get(), deque()).append([future, model, limiters, now])
+        self._set_depth(model, 1)
+        self._dispatch()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as the caller gave up: hand the slot back
+                future.result().release()
+            else:
+                self._drop(future)
+            raise
+
+    def _admit(self, model: str, limiters: tuple, enqueued_at: float, now: float) -> Slot:
+        for limiter in limiters:
+            limiter.take(now)
+        IN_FLIGHT.set(limiters[0].in_flight, model=model)
+        WAIT_SECONDS.observe(now - enqueued_at, model=model)
+        return Slot(self, model, limiters, now - enqueued_at)
+
+    def _dispatch(self):
+        """Admits waiting requests, taking one per flow in turn, until none can go."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        next_wake = float("inf")
+        progress = True
+        while progress and self.flows:
+            progress = False
+            now = time.monotonic()
+            for flow in list(self.flows):
+                waiters = self.flows[flow]
+                admitted = False
+                for waiter in list(waiters):
+                    future, model, limiters, enqueued_at = waiter
+                    wait = max(limiter.wait_time(now) for limiter in limiters)
+                    if wait > 0:
+                        next_wake = min(next_wake, wait)
+                        continue
+                    waiters.remove(waiter)
+                    self._set_depth(model, -1)
+                    future.set_result(self._admit(model, limiters, enqueued_at, now))
+                    admitted = progress = True
+                    break
+                if not waiters:
+                    del self.flows[flow]
+                elif admitted:
+                    # This flow had its turn; the others go first next time
+                    self.flows.move_to_end(flow)
+        if self.flows and next_wake != float("inf"):
+            self._timer = asyncio.get_running_loop().call_later(next_wake, self._dispatch)
+
+    def _release(self, slot: Slot, status: int, retry_after: float):
+        now = time.monotonic()
+        for limiter in slot.limiters:
+            limiter.release()
+        model_limiter = slot.limiters[0]
+        if status == 429:
+            model_limiter.throttled(now, retry_after)
+            THROTTLED.inc(model=slot.model)
+        elif status == 200:
+            model_limiter.succeeded()
+        IN_FLIGHT.set(model_limiter.in_flight, model=slot.model)
+        if self.flows:
+            self._dispatch()
+
+    def _drop(self, future):
+        for flow, waiters in list(self.flows.items()):
+            for waiter in waiters:
+                if waiter[0] is future:
+                    waiters.remove(waiter)
+                    self._set_depth(waiter[1], -1)
+                    if not waiters:
+                        del self.flows[flow]
+                    return
+
+    def _set_depth(self, model: str, change: int):
+        self.depth[model] = self.depth.get(model, 0) + change
+        QUEUE_DEPTH.set(self.depth[model], model=model)
+
+    def stats(self) -> dict:
+        """Queue depth, in-flight requests and current rate factor per model."""
+        return {
+            model: {"queued": self.depth.get(model, 0), "in_flight": limiter.in_flight,
+                    "rate_factor": round(limiter.rate_factor, 3)}
+            for model, limiter in self.models.items()
+        }
+
+
+_governor = None
+_governor_loop = None
+_settings = {}
+
+
+def configure(**settings):
+    """Replaces the governor's default limits (see Governor), e.g. configure(model_max_in_flight=8)."""
+    global _governor
+    _settings.update(settings)
+    _governor = None
+
+
+def get_governor() -> Governor:
+    """Returns the process-wide governor for the running event loop."""
+    global _governor, _governor_loop
+    loop = asyncio.get_running_loop()
+    # Its futures and timers belong to one loop, like the pooled client
+    if _governor is None or _governor_loop is not loop:
+        _governor = Governor(**_settings)
+        _governor_loop = loop
+    return _governor
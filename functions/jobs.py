@@ -0,0 +1,300 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from . import telemetry
+
+# --- Background Job Queue ---
+# In job mode a request only enqueues its council run and returns the job id;
+# a fixed pool of async workers runs the jobs, so how many councils run at once
+# is set by JOB_WORKERS rather than by how many HTTP connections are open, and
+# a long council no longer runs into request or function timeouts.
+#
+# Jobs live in a local SQLite database (no broker needed) and survive a
+# restart. A claimed job is leased to the queue that claimed it for
+# JOB_LEASE_SECONDS, and the lease is renewed while the job runs; once a lease
+# has expired (its process died or hung) the job is queued again, up to
+# JOB_MAX_ATTEMPTS runs each. Several processes (uvicorn workers, or the old
+# and new servers of a rolling restart) can share one database: a job is only
+# taken over from a queue that stopped renewing it. Workers take the queued job with the highest
+# priority first, oldest first within a priority, and skip jobs whose group
+# (e.g. the conversation) already has one running, so the turns of one
+# conversation run in order. Workers are woken by jobs enqueued in this
+# process and poll every JOB_POLL_SECONDS for jobs enqueued by others.
+#
+# A job's record holds its status ("queued", "running", "done" or "failed"),
+# the latest progress its handler reported, and its result or error, so
+# clients can poll it; finished jobs are deleted after JOB_RETENTION_SECONDS.
+#
+# Job mode is served by the FastAPI backend only. A Cloud Functions instance
+# gets no CPU once its response is sent and its /tmp is private and in memory,
+# so neither the workers nor the queue would outlive the request there.
+
+JOB_DB_PATH = os.environ.get("COUNCIL_JOB_DB_PATH", "data/jobs.db")
+JOB_WORKERS = int(os.environ.get("COUNCIL_JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = float(os.environ.get("COUNCIL_JOB_POLL_SECONDS", "2"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("COUNCIL_JOB_MAX_ATTEMPTS", "2"))
+JOB_LEASE_SECONDS = float(os.environ.get("COUNCIL_JOB_LEASE_SECONDS", "60"))
+JOB_RETENTION_SECONDS = float(os.environ.get("COUNCIL_JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    priority INTEGER NOT NULL DEFAULT 0,
+    job_group TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    payload TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_priority ON jobs (status, priority DESC, seq);
+"""
+
+INSERT_JOB = "INSERT INTO jobs (id, priority, job_group, status, payload, created_at) VALUES (?, ?, ?, 'queued', ?, ?)"
+SELECT_JOB = ("SELECT id, priority, job_group, status, attempts, payload, progress, result, error, created_at, started_at, "
+              "finished_at FROM jobs WHERE id = ?")
+# The next job: highest priority, then oldest, among the oldest queued job of
+# each group with nothing running (a group's jobs run in the order they came)
+SELECT_NEXT = (
+    "SELECT id FROM jobs AS job WHERE status = 'queued' AND (job_group IS NULL OR ("
+    "job_group NOT IN (SELECT job_group FROM jobs WHERE status = 'running' AND job_group IS NOT NULL) AND "
+    "seq = (SELECT MIN(seq) FROM jobs WHERE job_group = job.job_group AND status = 'queued'))) "
+    "ORDER BY priority DESC, seq LIMIT 1"
+)
+START_JOB = ("UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?, started_at = ? "
+             "WHERE id = ?")
+# Updates by a worker whose lease was taken over change nothing
+RENEW_LEASE = "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'"
+UPDATE_PROGRESS = "UPDATE jobs SET progress = ? WHERE id = ? AND worker = ? AND status = 'running'"
+FINISH_JOB = ("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, worker = NULL, lease_until = NULL "
+              "WHERE id = ? AND worker = ? AND status = 'running'")
+REQUEUE_JOB = ("UPDATE jobs SET status = 'queued', started_at = NULL, worker = NULL, lease_until = NULL "
+               "WHERE id = ? AND worker = ? AND status = 'running'")
+REQUEUE_EXPIRED = ("UPDATE jobs SET status = 'queued', started_at = NULL, worker = NULL, lease_until = NULL "
+                   "WHERE status = 'running' AND lease_until < ? AND attempts < ?")
+FAIL_EXPIRED = ("UPDATE jobs SET status = 'failed', error = 'interrupted too many times', finished_at = ?, "
+                "worker = NULL, lease_until = NULL WHERE status = 'running' AND lease_until < ?")
+COUNT_AHEAD = ("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+               "(priority > ? OR (priority = ? AND seq < (SELECT seq FROM jobs WHERE id = ?)))")
+COUNT_BY_STATUS = "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+DELETE_FINISHED = "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?"
+
+JOBS = telemetry.register(telemetry.Counter("council_jobs_total", "Council jobs by how they ended.", ("status",)))
+QUEUE_SECONDS = telemetry.register(telemetry.Histogram(
+    "council_job_queue_seconds", "Time jobs waited in the queue before a worker started them."))
+RUNNING = telemetry.register(telemetry.Gauge("council_jobs_running", "Council jobs being run by this process."))
+
+
+class JobStore:
+    """The durable job table. Thread-safe: each thread uses its own connection.
+
+    Jobs are claimed and updated on behalf of `worker`, an id unique to this
+    store, and leased to it for `lease` seconds at a time.
+    """
+
+    def __init__(self, path: str = JOB_DB_PATH, lease: float = JOB_LEASE_SECONDS):
+        self.path = path
+        self.lease = lease
+        self.worker = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _write(self, *statements) -> list:
+        """Runs (sql, params) statements in one BEGIN IMMEDIATE transaction; returns their row counts."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            counts = [connection.execute(sql, params).rowcount for sql, params in statements]
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return counts
+
+    def enqueue(self, payload: dict, priority: int = 0, group: str = None) -> dict:
+        job_id = uuid.uuid4().hex
+        self._write((INSERT_JOB, (job_id, priority, group, json.dumps(payload), time.time())))
+        return self.get(job_id)
+
+    def claim(self):
+        """Marks the next runnable job as running and returns it, or None if there is none."""
+        connection = self._connection()
+        # Taking the write lock first keeps two workers from claiming the same job
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(SELECT_NEXT).fetchone()
+            if row is not None:
+                now = time.time()
+                connection.execute(START_JOB, (self.worker, now + self.lease, now, row[0]))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return self.get(row[0]) if row is not None else None
+
+    def renew(self, job_id: str) -> bool:
+        """Extends this worker's lease on a running job; False if the job is no longer its own."""
+        return self._write((RENEW_LEASE, (time.time() + self.lease, job_id, self.worker)))[0] > 0
+
+    def set_progress(self, job_id: str, progress: dict):
+        self._write((UPDATE_PROGRESS, (json.dumps(progress), job_id, self.worker)))
+
+    def finish(self, job_id: str, result: dict = None, error: str = None):
+        status = "failed" if error is not None else "done"
+        result = json.dumps(result) if result is not None else None
+        self._write((FINISH_JOB, (status, result, error, time.time(), job_id, self.worker)))
+
+    def requeue(self, job_id: str):
+        """Puts a job that was interrupted (e.g. by a shutdown) back in the queue."""
+        self._write((REQUEUE_JOB, (job_id, self.worker)))
+
+    def recover(self, max_attempts: int = JOB_MAX_ATTEMPTS, retention: float = JOB_RETENTION_SECONDS) -> int:
+        """Requeues running jobs whose lease has expired and deletes old finished ones; returns the requeued count."""
+        now = time.time()
+        requeued, _, _ = self._write(
+            (REQUEUE_EXPIRED, (now, max_attempts)),
+            (FAIL_EXPIRED, (now, now)),
+            (DELETE_FINISHED, (now - retention,)),
+        )
+        return requeued
+
+    def get(self, job_id: str):
+        """The job as a dict, with `ahead` (jobs to run before it) while it is queued, or None."""
+        connection = self._connection()
+        row = connection.execute(SELECT_JOB, (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "priority", "group", "status", "attempts", "payload", "progress", "result", "error",
+                        "created_at", "started_at", "finished_at"), row))
+        for field in ("payload", "progress", "result"):
+            job[field] = json.loads(job[field]) if job[field] is not None else None
+        if job["status"] == "queued":
+            job["ahead"] = connection.execute(COUNT_AHEAD, (job["priority"], job["priority"], job_id)).fetchone()[0]
+        return job
+
+    def counts(self) -> dict:
+        """Number of jobs per status."""
+        return dict(self._connection().execute(COUNT_BY_STATUS).fetchall())
+
+
+class JobQueue:
+    """Runs queued jobs with `handler(job, report)` on a pool of `workers` coroutines.
+
+    `report(progress)` records the job's progress (a JSON-serializable dict);
+    what the handler returns becomes the job's result, and an exception its error.
+    """
+
+    def __init__(self, handler, store: JobStore = None, workers: int = JOB_WORKERS, poll: float = JOB_POLL_SECONDS):
+        self.handler = handler
+        self.store = store or JobStore()
+        self.workers = workers
+        self.poll = poll
+        self._tasks = []
+        self._wake = None
+        self._running = 0
+
+    async def start(self):
+        """Recovers jobs whose lease expired and starts the workers on the running event loop."""
+        if self._tasks:
+            return
+        await asyncio.to_thread(self.store.recover)
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stops the workers; jobs they were running go back to the queue."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, payload: dict, priority: int = 0, group: str = None) -> dict:
+        """Enqueues a job and returns its record."""
+        job = await asyncio.to_thread(self.store.enqueue, payload, priority, group)
+        if self._wake is not None:
+            self._wake.set()
+        return job
+
+    async def get(self, job_id: str):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _work(self):
+        while True:
+            # Cleared before looking, so a job submitted meanwhile still wakes this worker
+            self._wake.clear()
+            job = await asyncio.to_thread(self.store.claim)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll)
+                except asyncio.TimeoutError:
+                    # Idle: take over the jobs of queues that stopped renewing their leases
+                    await asyncio.to_thread(self.store.recover)
+                continue
+            await self._run(job)
+            # A finished job may unblock the next one of its group
+            self._wake.set()
+
+    async def _run(self, job: dict):
+        QUEUE_SECONDS.observe(job["started_at"] - job["created_at"])
+        self._running += 1
+        RUNNING.set(self._running)
+
+        async def report(progress: dict):
+            await asyncio.to_thread(self.store.set_progress, job["id"], progress)
+
+        handling = asyncio.ensure_future(self.handler(job, report))
+        lost = False
+
+        async def keep_lease():
+            nonlocal lost
+            while True:
+                await asyncio.sleep(self.store.lease / 3)
+                if not await asyncio.to_thread(self.store.renew, job["id"]):
+                    # Our lease expired (e.g. the loop was blocked) and another queue took the job over
+                    lost = True
+                    handling.cancel()
+                    return
+
+        heartbeat = asyncio.create_task(keep_lease())
+        try:
+            result = await handling
+        except asyncio.CancelledError:
+            if not lost:
+                await asyncio.shield(asyncio.to_thread(self.store.requeue, job["id"]))
+                raise
+            print(f"Council job {job['id']} was taken over by another worker")
+            JOBS.inc(status="lost")
+        except Exception as e:
+            print(f"Council job {job['id']} failed: {e}")
+            await asyncio.to_thread(self.store.finish, job["id"], None, str(e) or type(e).__name__)
+            JOBS.inc(status="failed")
+        else:
+            await asyncio.to_thread(self.store.finish, job["id"], result)
+            JOBS.inc(status="done")
+        finally:
+            heartbeat.cancel()
+            self._running -= 1
+            RUNNING.set(self._running)
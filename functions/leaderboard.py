@@ -0,0 +1,128 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# --- Model Leaderboard ---
+# Peer rankings from every stage 2 are folded into running totals, so the
+# leaderboard across all conversations is never recomputed from stored turns.
+# A turn contributes a delta of the same shape as the leaderboard itself, and
+# storage adds deltas up (SQL upserts, Firestore increments):
+#
+#   {"turns": 1,
+#    "models": {"model": {"turns": 1, "votes": 3, "points": 7, "score": 1.5, "first_places": 1}},
+#    "pairs": {"winner": {"loser": 2}}}
+#
+# Per model, `points` sums the per-turn Borda points (a first place among n
+# answers gets n points, as in calculate_aggregate_rankings) and `score` sums
+# the same rank normalized to 0..1, which stays comparable across council sizes.
+# `pairs` counts how often one model was ranked above another. From those
+# counts `standings` fits Bradley-Terry strengths, reported on an Elo-like
+# scale, when NumPy is installed; everything else is O(models). The fit runs
+# only when a leaderboard endpoint is read, never per turn.
+
+MODEL_FIELDS = ("turns", "votes", "points", "score", "first_places")
+RATING_BASE = 1500
+RATING_SCALE = 400
+# Virtual draw added between every pair, so an unbeaten model gets a finite rating
+RATING_PRIOR = 0.5
+RATING_ITERATIONS = 200
+RATING_TOLERANCE = 1e-6
+
+
+def empty() -> dict:
+    return {"turns": 0, "models": {}, "pairs": {}}
+
+
+def turn_delta(stage2_rankings: list, label_to_model: dict) -> dict:
+    """The leaderboard contribution of one turn's peer rankings."""
+    delta = empty()
+    for ranking in stage2_rankings:
+        ranked = []
+        for label in ranking.get("parsed_ranking") or []:
+            model = label_to_model.get(label)
+            # A label repeated in the ranking counts once, at its best position
+            if model and model not in ranked:
+                ranked.append(model)
+        size = len(ranked)
+        for position, model in enumerate(ranked):
+            stats = delta["models"].setdefault(model, dict.fromkeys(MODEL_FIELDS, 0))
+            stats["votes"] += 1
+            stats["points"] += size - position
+            stats["score"] += (size - 1 - position) / (size - 1) if size > 1 else 1.0
+            stats["first_places"] += 1 if position == 0 else 0
+            for loser in ranked[position + 1:]:
+                losers = delta["pairs"].setdefault(model, {})
+                losers[loser] = losers.get(loser, 0) + 1
+    if delta["models"]:
+        delta["turns"] = 1
+        for stats in delta["models"].values():
+            stats["turns"] = 1
+    return delta
+
+
+def merge(board: dict, delta: dict) -> dict:
+    """Adds a delta to a leaderboard in place and returns it."""
+    board["turns"] += delta["turns"]
+    for model, stats in delta["models"].items():
+        totals = board["models"].setdefault(model, dict.fromkeys(MODEL_FIELDS, 0))
+        for field in MODEL_FIELDS:
+            totals[field] += stats.get(field, 0)
+    for winner, losers in delta["pairs"].items():
+        totals = board["pairs"].setdefault(winner, {})
+        for loser, count in losers.items():
+            totals[loser] = totals.get(loser, 0) + count
+    return board
+
+
+def fit_ratings(pairs: dict, models: list):
+    """Bradley-Terry strengths from pairwise win counts on an Elo-like scale, or None without NumPy.
+
+    Uses the MM iteration (Hunter, 2004) on the win matrix, vectorized over all models.
+    """
+    if np is None or len(models) < 2:
+        return None
+    index = {model: i for i, model in enumerate(models)}
+    wins = np.full((len(models), len(models)), RATING_PRIOR)
+    np.fill_diagonal(wins, 0.0)
+    for winner, losers in pairs.items():
+        for loser, count in losers.items():
+            if winner in index and loser in index:
+                wins[index[winner], index[loser]] += count
+    games = wins + wins.T
+    won = wins.sum(axis=1)
+    strength = np.ones(len(models))
+    for _ in range(RATING_ITERATIONS):
+        updated = won / (games / (strength[:, None] + strength[None, :])).sum(axis=1)
+        updated /= np.exp(np.log(updated).mean())
+        converged = np.abs(updated - strength).max() < RATING_TOLERANCE
+        strength = updated
+        if converged:
+            break
+    ratings = RATING_BASE + RATING_SCALE * np.log10(strength)
+    return {model: round(float(ratings[i]), 1) for model, i in index.items()}
+
+
+def standings(board: dict) -> list:
+    """The leaderboard as rows sorted by mean normalized rank score, best first."""
+    ratings = fit_ratings(board["pairs"], sorted(board["models"]))
+    rows = []
+    for model, stats in board["models"].items():
+        votes = stats["votes"] or 1
+        row = {
+            "model": model,
+            "turns": stats["turns"],
+            "votes": stats["votes"],
+            "average_score": round(stats["points"] / votes, 2),
+            "score": round(stats["score"] / votes, 4),
+            "first_places": stats["first_places"],
+        }
+        if ratings is not None:
+            row["rating"] = ratings[model]
+        rows.append(row)
+    return sorted(rows, key=lambda row: (row["score"], row["votes"]), reverse=True)
+
+
+def describe(board: dict) -> dict:
+    """Response body for a leaderboard endpoint."""
+    return {"turns": board["turns"], "rated": np is not None, "models": standings(board)}
@@ -4,12 +4,22 @@ from firebase_admin import firestore
 from firebase_functions import https_fn
 
 # Import the configuration and core logic
+from . import accounting
 from . import config
+from . import context
 from . import council
+from . import leaderboard
+from . import persistence
+from . import runtime
+from . import singleflight
 
 # Get a reference to the Firestore database
 db = firestore.client()
 
+# Commit any turns this instance spooled before a restart but did not get to persist
+if persistence.PERSIST_MODE == "background":
+    persistence.get_queue(db)
+
 @https_fn.on_request(secrets=[config.OPENROUTER_API_KEY])
 def on_message(req: https_fn.Request) -> https_fn.Response:
     """Firebase Function to handle a new message in a conversation."""
@@ -43,68 +53,50 @@ def on_message(req: https_fn.Request) -> https_fn.Response:
         api_key = config.OPENROUTER_API_KEY.value
 
         # --- Execute the 3-Stage Council Process ---
-        print(f"Executing Stage 1 for conversation {conversation_id}...")
-        stage1_responses = council.stage1_collect_responses(config.COUNCIL_MODELS, user_prompt, api_key)
-
-        print("Executing Stage 2...")
-        stage2_rankings, label_to_model, _ = council.stage2_collect_rankings(
-            stage1_responses, user_prompt, api_key, config.COUNCIL_MODELS
-        )
-
-        print("Executing Stage 3...")
-        stage3_response = council.stage3_synthesize_final(
-            stage1_responses, stage2_rankings, user_prompt, api_key, config.CHAIRMAN_MODEL
+        # All three stages run on the worker's shared event loop so they reuse
+        # the pooled OpenRouter connections from previous requests. Follow-ups
+        # are sent with the conversation's rolling summary and last few turns.
+        # An identical run already in flight on this worker is joined instead
+        # of repeated (see singleflight.py).
+        print(f"Executing council for conversation {conversation_id}...")
+        council_models, chairman_model = config.get_models()
+        context_state = persistence.load_context(db, conversation_id)
+        options = {
+            "quorum": config.STAGE1_QUORUM,
+            "stage1_budget": config.STAGE1_BUDGET_SECONDS,
+            "late_policy": config.LATE_STAGE1_POLICY,
+            "stage_deadlines": config.STAGE_DEADLINES,
+            "budget_usd": data.get("budget_usd", config.BUDGET_USD),
+        }
+        key = singleflight.key_for(context.prompt_for(user_prompt, context_state), council_models, chairman_model, **options)
+        (stage1_responses, stage2_rankings, stage3_response, metadata, context_state), leader = runtime.run(
+            singleflight.do(key, lambda flight: council.run_conversation_turn(
+                council_models, chairman_model, user_prompt, api_key, context_state, flow=conversation_id, **options
+            ))
         )
-
-        # --- Calculate Aggregate Rankings for Metadata ---
-        aggregate_rankings = council.calculate_aggregate_rankings(stage2_rankings, label_to_model)
+        if not leader:
+            # The run's calls are counted with the request that started it
+            metadata["usage"] = accounting.start_ledger()
+        metadata["coalesced"] = not leader
 
         # --- Persist to Firestore ---
-        print("Persisting results to Firestore...")
-        conversation_ref = db.collection("conversations").document(conversation_id)
-        
-        # Create a new message document in the 'messages' subcollection
-        assistant_message_ref = conversation_ref.collection("messages").document()
-        user_message_ref = conversation_ref.collection("messages").document()
-
-        # Use a transaction or batch write for atomicity
-        batch = db.batch()
-
-        # Set conversation creation timestamp if it'''s a new conversation
-        batch.set(conversation_ref, {"createdAt": firestore.SERVER_TIMESTAMP}, merge=True)
-
-        # Save the user'''s message
-        batch.set(user_message_ref, {
-            "role": "user",
-            "content": user_prompt,
-            "createdAt": firestore.SERVER_TIMESTAMP
-        })
-
-        # Save the assistant'''s multi-stage response
-        batch.set(assistant_message_ref, {
-            "role": "assistant",
-            "createdAt": firestore.SERVER_TIMESTAMP,
-            "stage1": stage1_responses,
-            "stage2": stage2_rankings,
-            "stage3": stage3_response,
-            # Metadata is not persisted to save space and cost, as per original design.
-            # It'''s generated on the fly and returned to the client.
-        })
-
-        batch.commit()
-        print("Successfully saved to Firestore.")
+        # Stage outputs go to their own documents, and in background mode the
+        # commit happens after this response is sent (see persistence.py).
+        assistant_message_id = persistence.save_turn(
+            db, conversation_id, user_prompt, stage1_responses, stage2_rankings, stage3_response,
+            usage=metadata["usage"], context=context_state,
+            # Once per run, however many conversations it answered
+            leaderboard_delta=leaderboard.turn_delta(stage2_rankings, metadata["label_to_model"]) if leader else None
+        )
 
         # --- Prepare the API Response ---
         response_data = {
-            "id": assistant_message_ref.id,
+            "id": assistant_message_id,
             "role": "assistant",
             "stage1": stage1_responses,
             "stage2": stage2_rankings,
             "stage3": stage3_response,
-            "metadata": {
-                "label_to_model": label_to_model,
-                "aggregate_rankings": aggregate_rankings
-            }
+            "metadata": metadata
         }
 
         return https_fn.Response(json.dumps(response_data, default=str), status=200, headers=headers, mimetype="application/json")
@@ -114,3 +106,23 @@ def on_message(req: https_fn.Request) -> https_fn.Response:
         import traceback
         traceback.print_exc()
         return https_fn.Response(f"Internal Server Error: {e}", status=500, headers=headers)
+
+
+@https_fn.on_request()
+def get_leaderboard(req: https_fn.Request) -> https_fn.Response:
+    """Firebase Function returning the models ranked by their peer reviews across all conversations."""
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "GET, OPTIONS",
+        "Access-Control-Allow-Headers": "Content-Type, Authorization",
+    }
+
+    if req.method == "OPTIONS":
+        return https_fn.Response("", headers=headers)
+
+    if req.method != "GET":
+        return https_fn.Response("Method Not Allowed", status=405, headers=headers)
+
+    # One document read: the totals are kept up to date by every saved turn
+    body = leaderboard.describe(persistence.load_leaderboard(db))
+    return https_fn.Response(json.dumps(body), status=200, headers=headers, mimetype="application/json")
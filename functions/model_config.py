@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+import time
+
+# --- Lazily Loaded Model Configuration ---
+# The council and chairman model lists come from Firebase Remote Config, which
+# costs network round trips. Instead of fetching on import (and so on every
+# cold start), a provider caches the lists in-process for `ttl` seconds and
+# refreshes them on a background thread; requests keep using the cached lists
+# meanwhile. Only the very first request of a process waits for the load, and
+# for at most `wait` seconds before falling back to a local file or defaults.
+
+
+def load_models_file(path: str):
+    """Reads {"council_models": [...], "chairman_model": "..."} from a local JSON file."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    return list(data["council_models"]), data["chairman_model"]
+
+
+class ModelConfigProvider:
+    """TTL-cached (council_models, chairman_model), refreshed in the background."""
+
+    def __init__(self, fetch, fallback, ttl: float = 300, wait: float = 2, failure_retry: float = 30):
+        """`fetch` loads the lists from the config service and may raise; `fallback` must not."""
+        self.fetch = fetch
+        self.fallback = fallback
+        self.ttl = ttl
+        self.wait = wait
+        self.failure_retry = min(failure_retry, ttl)
+        self.source = None
+        self._value = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._loaded = threading.Event()
+
+    def get(self):
+        """Returns (council_models, chairman_model) without blocking, except on a process's first call."""
+        if self._value is None:
+            self.refresh_in_background()
+            self._loaded.wait(self.wait)
+            if self._value is None:
+                # The service is slow; serve the fallback and let the refresh finish
+                return self.fallback()
+        elif time.monotonic() >= self._expires_at:
+            self.refresh_in_background()
+        return self._value
+
+    def refresh_in_background(self):
+        """Starts a refresh unless one is already running."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="model-config-refresh", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            value, source, ttl = self.fetch(), "remote_config", self.ttl
+        except Exception as e:
+            print(f"Could not fetch model configuration, using {'cached' if self._value else 'fallback'} models: {e}")
+            value = self._value or self.fallback()
+            source = self.source if self._value else "fallback"
+            ttl = self.failure_retry
+        with self._lock:
+            if value != self._value:
+                print(f"Model configuration loaded from {source}: council={value[0]} chairman={value[1]}")
+            self._value, self.source = value, source
+            self._expires_at = time.monotonic() + ttl
+            self._refreshing = False
+        self._loaded.set()
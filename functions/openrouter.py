@@ -1,45 +1,391 @@
-import aiohttp
 import asyncio
-import os
 import json
+import os
+import time
+
+import httpx
+
+from . import accounting
+from . import cache
+from . import governor
+from . import resilience
+from . import telemetry
 
 # The API key is now passed as an argument to the functions
 # that need it, making the functions more pure and testable.
 
-async def query_model(session, model: str, prompt: str, api_key: str):
-    """Queries a single model on OpenRouter and returns the response."""
-    url = "https://openrouter.ai/api/v1/chat/completions"
+# Overridable so the client can be pointed at a local stub (see benchmarks/fake_openrouter.py)
+OPENROUTER_API_URL = os.environ.get("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# --- Connection Pool Configuration ---
+# A single client is shared by every stage of every council run in this worker
+# process, so the TCP/TLS handshake to OpenRouter is paid once and the
+# keep-alive connections are reused afterwards. The limits can be tuned per
+# deployment through environment variables.
+MAX_CONNECTIONS = int(os.environ.get("OPENROUTER_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENROUTER_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.environ.get("OPENROUTER_KEEPALIVE_EXPIRY", "90"))
+CONNECT_TIMEOUT = float(os.environ.get("OPENROUTER_CONNECT_TIMEOUT", "10"))
+REQUEST_TIMEOUT = float(os.environ.get("OPENROUTER_REQUEST_TIMEOUT", "300"))
+HTTP2_ENABLED = os.environ.get("OPENROUTER_HTTP2", "1") != "0"
+
+_client = None
+_client_loop = None
+
+
+def _http2_available():
+    """HTTP/2 needs the optional `h2` package (installed by `httpx[http2]`)."""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the process-wide OpenRouter client, creating it on first use."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    # An httpx client is bound to the event loop it was first used on. If the
+    # loop has changed (e.g. a script calling asyncio.run twice) we start a new
+    # pool rather than reuse connections owned by a dead loop.
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED and _http2_available(),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close_client():
+    """Closes the shared client. Call this when the worker shuts down."""
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+class _AttemptFailed(Exception):
+    """A single attempt that did not produce a usable completion."""
+
+    def __init__(self, outcome: str, status: int = None, retry_after: float = None, retryable: bool = True, detail: str = ""):
+        super().__init__(f"{outcome} {detail}".strip())
+        self.outcome = outcome
+        self.status = status
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+async def query_model(model: str, prompt: str, api_key: str, client: httpx.AsyncClient = None, on_delta=None, deadline: float = None,
+                      max_tokens: int = None):
+    """Queries a single model on OpenRouter and returns the response.
+
+    If `on_delta` is given, the completion is streamed and `await on_delta(model, text)`
+    is called for every content token as soon as it arrives.
+
+    Transient failures (timeouts, 429, 5xx) are retried with jittered exponential
+    backoff that honors Retry-After, for at most `deadline` seconds in total. A slow
+    non-streaming attempt can be hedged with a duplicate request (see
+    `resilience.HEDGE_PERCENTILE`), and a model whose circuit breaker is open is
+    skipped. The result's "attempts" list records every attempt's outcome and
+    latency. Successful responses are cached (see `cache.py`); a cache hit is
+    marked "cached" and makes no request. Returns None if the model could not
+    produce a response.
+
+    Every call is traced as an "openrouter.chat" span with its queue time, time
+    to first byte, response bytes and retry count (see `telemetry.py`). The
+    result's "usage" holds its tokens and cost, which are also recorded in the
+    run's ledger (see `accounting.py`). `max_tokens` caps the completion length.
+    """
+    with telemetry.span("openrouter.chat", model=model, stage=telemetry.current_attribute("stage")) as call:
+        result = await _query_model(model, prompt, api_key, client, on_delta, deadline, max_tokens, call)
+    telemetry.record_model_call(call)
+    return result
+
+
+async def _query_model(model: str, prompt: str, api_key: str, client: httpx.AsyncClient, on_delta, deadline: float,
+                       max_tokens: int, call: telemetry.Span):
+    """Body of query_model; records its outcome on the `call` span."""
+    started = time.perf_counter()
+    client = client or get_client()
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
     data = {
         "model": model,
-        "messages": [{"role": "user", "content": prompt}]
+        "messages": [{"role": "user", "content": prompt}],
+        # Ask OpenRouter to include the call's cost in the usage block
+        "usage": {"include": True},
     }
+    if max_tokens is not None:
+        data["max_tokens"] = max_tokens
+
+    params = {k: v for k, v in data.items() if k not in ("model", "messages")}
+    cached = await cache.lookup(model, prompt, params)
+    if cached is not None:
+        call.set(outcome="cached")
+        if on_delta is not None:
+            await on_delta(model, cached["content"])
+        # A cache hit uses no tokens, so it costs nothing and is not added to the ledger
+        usage = {**cached["usage"], "cost": 0.0, "cost_estimated": False} if cached.get("usage") else None
+        return {**cached, "usage": usage, "cached": True, "attempts": []}
+
+    breaker = resilience.breaker_for(model)
+    if not breaker.allow_request():
+        print(f"Skipping {model}: circuit breaker is open")
+        call.set(outcome="breaker_open")
+        return None
+
+    tokens_forwarded = False
+    if on_delta is not None:
+        forward = on_delta
+
+        async def on_delta(delta_model, text):
+            nonlocal tokens_forwarded
+            tokens_forwarded = True
+            await forward(delta_model, text)
+
+    loop = asyncio.get_running_loop()
+    expires_at = None if deadline is None else loop.time() + deadline
+    attempts = []
+
+    call.set(queue_ms=round((time.perf_counter() - started) * 1000, 1))
+    # We are the half-open probe if the flag is set now: a closed breaker never sets it
+    probing = breaker.probe_in_flight
+    try:
+        for retry in range(resilience.MAX_RETRIES + 1):
+            remaining = None if expires_at is None else expires_at - loop.time()
+            try:
+                if remaining is not None and remaining <= 0:
+                    raise _AttemptFailed("deadline", retryable=False)
+                result = await _attempt_hedged(client, model, headers, data, on_delta, remaining, attempts)
+            except _AttemptFailed as failure:
+                # Retrying a stream that already reached the client would replay its tokens
+                give_up = not failure.retryable or tokens_forwarded or retry == resilience.MAX_RETRIES
+                if not give_up:
+                    delay = resilience.backoff_delay(retry + 1, failure.retry_after)
+                    give_up = expires_at is not None and loop.time() + delay >= expires_at
+                if give_up:
+                    breaker.record_failure()
+                    print(f"Error querying {model}: {failure} (attempts: {attempts})")
+                    _record_attempts(call, attempts, failure.outcome)
+                    return None
+                await asyncio.sleep(delay)
+                continue
+
+            breaker.record_success()
+            result["usage"] = accounting.normalize_usage(model, result.get("usage"))
+            accounting.record(model, result["usage"], telemetry.current_attribute("stage"))
+            call.set(prompt_tokens=result["usage"]["prompt_tokens"], completion_tokens=result["usage"]["completion_tokens"],
+                     cost_usd=result["usage"]["cost"])
+            await cache.store(model, prompt, result, params)
+            result["attempts"] = attempts
+            _record_attempts(call, attempts, "ok")
+            return result
+    except BaseException:
+        # Cancelled (a quorum or a departing caller stops the call) or broken before an outcome was recorded
+        if probing:
+            breaker.release_probe()
+        raise
+
+
+def _record_attempts(call: telemetry.Span, attempts: list, outcome: str):
+    """Summarizes a call's attempts on its span."""
+    ttfb = next((a.get("ttfb") for a in attempts if a.get("outcome") == "ok"), None)
+    call.set(
+        outcome=outcome,
+        ttfb_ms=None if ttfb is None else round(ttfb * 1000, 1),
+        governor_wait_ms=round(sum(a.get("wait", 0) for a in attempts) * 1000, 1),
+        bytes=sum(a.get("bytes", 0) for a in attempts),
+        retries=max(0, len(attempts) - 1),
+    )
 
+
+async def _attempt_hedged(client: httpx.AsyncClient, model: str, headers: dict, data: dict, on_delta, timeout: float, attempts: list):
+    """Runs one attempt, sending a duplicate if it is slower than the model's hedge threshold.
+
+    Streams are never hedged, since two streams would interleave their tokens.
+    """
+    threshold = None if on_delta is not None else resilience.hedge_threshold(model)
+    primary = asyncio.create_task(_timed_attempt(client, model, headers, data, on_delta, timeout, attempts))
+    pending = {primary}
     try:
-        async with session.post(url, headers=headers, json=data) as response:
-            if response.status == 200:
-                response_data = await response.json()
-                content = response_data['choices'][0]['message']['content']
-                # The structure might include reasoning details, so we return a dictionary.
-                return {
-                    "model": model,
-                    "content": content,
-                    "reasoning_details": response_data.get('reasoning') # Example of extracting more data
-                }
-            else:
-                print(f"Error querying {model}: {response.status} {await response.text()}")
-                return None
+        if threshold is None or (timeout is not None and threshold >= timeout):
+            return await primary
+
+        done, pending = await asyncio.wait(pending, timeout=threshold)
+        if not done:
+            hedge_timeout = None if timeout is None else timeout - threshold
+            pending.add(asyncio.create_task(
+                _timed_attempt(client, model, headers, data, None, hedge_timeout, attempts, hedge=True)
+            ))
+
+        failure = None
+        while done or pending:
+            for task in done:
+                try:
+                    return task.result()
+                except _AttemptFailed as e:
+                    failure = e
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        raise failure
+    finally:
+        for task in pending:
+            task.cancel()
+        # Let the losers record their "cancelled" outcome before the attempts are returned
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _timed_attempt(client: httpx.AsyncClient, model: str, headers: dict, data: dict, on_delta, timeout: float,
+                         attempts: list, hedge: bool = False):
+    """Makes a single request under `timeout` and appends its outcome and latency to `attempts`.
+
+    The request first waits for the governor to admit it (see `governor.py`); that
+    wait counts against `timeout` and is recorded as "wait", not as latency.
+    """
+    record = {"attempt": len(attempts) + 1, "hedge": hedge}
+    attempts.append(record)
+    started = time.monotonic()
+    slot = None
+    status = retry_after = None
+    try:
+        try:
+            slot = await asyncio.wait_for(governor.get_governor().acquire(model, headers["Authorization"]), timeout)
+        except asyncio.TimeoutError:
+            raise _AttemptFailed("queue_timeout", detail=f"not admitted within {timeout:.1f}s")
+        record["wait"] = round(slot.waited, 3)
+        started = time.monotonic()
+        if timeout is not None:
+            timeout = max(0.0, timeout - slot.waited)
+        if on_delta is not None:
+            request = _query_model_streaming(client, model, headers, data, on_delta, record, started)
+        else:
+            request = _query_model_once(client, model, headers, data, record, started)
+        result = await asyncio.wait_for(request, timeout)
+    except _AttemptFailed as failure:
+        record.update(outcome=failure.outcome, status=failure.status)
+        status, retry_after = failure.status, failure.retry_after
+        raise
+    except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+        record["outcome"] = "timeout"
+        raise _AttemptFailed("timeout", detail=str(e)) from e
+    except asyncio.CancelledError:
+        record["outcome"] = "cancelled"
+        raise
     except Exception as e:
-        print(f"Exception while querying {model}: {e}")
-        return None
+        record["outcome"] = "error"
+        raise _AttemptFailed("error", detail=repr(e)) from e
+    finally:
+        record["latency"] = round(time.monotonic() - started, 3)
+        if slot is not None:
+            # A 429 makes the governor slow the model down for everyone
+            slot.release(200 if record.get("outcome") is None else status, retry_after)
+
+    record.update(outcome="ok", status=200)
+    resilience.latency_for(model).record(record["latency"])
+    return result
+
+
+async def _query_model_once(client: httpx.AsyncClient, model: str, headers: dict, data: dict, record: dict, started: float):
+    """Sends a non-streaming chat completion request, noting time to first byte and size in `record`."""
+    async with client.stream("POST", OPENROUTER_API_URL, headers=headers, json=data) as response:
+        record["ttfb"] = round(time.monotonic() - started, 3)
+        await response.aread()
+        record["bytes"] = response.num_bytes_downloaded
+    if response.status_code != 200:
+        raise _AttemptFailed(
+            f"http_{response.status_code}",
+            status=response.status_code,
+            retry_after=resilience.parse_retry_after(response.headers.get("Retry-After")),
+            retryable=response.status_code in resilience.RETRYABLE_STATUSES,
+            detail=response.text[:500],
+        )
+
+    response_data = response.json()
+    content = response_data['choices'][0]['message']['content']
+    # The structure might include reasoning details, so we return a dictionary.
+    return {
+        "model": model,
+        "content": content,
+        "reasoning_details": response_data.get('reasoning'), # Example of extracting more data
+        "usage": response_data.get("usage"),
+    }
+
+
+async def _query_model_streaming(client: httpx.AsyncClient, model: str, headers: dict, data: dict, on_delta,
+                                 record: dict, started: float):
+    """Streams a chat completion, parsing the SSE chunks incrementally. Notes time to first byte and size in `record`."""
+    async with client.stream("POST", OPENROUTER_API_URL, headers=headers, json={**data, "stream": True}) as response:
+        record["ttfb"] = round(time.monotonic() - started, 3)
+        try:
+            return await _read_stream(response, model, on_delta)
+        finally:
+            record["bytes"] = response.num_bytes_downloaded
+
+
+async def _read_stream(response: httpx.Response, model: str, on_delta):
+    """Parses an SSE completion stream, forwarding each content token to `on_delta`."""
+    if response.status_code != 200:
+        body = await response.aread()
+        raise _AttemptFailed(
+            f"http_{response.status_code}",
+            status=response.status_code,
+            retry_after=resilience.parse_retry_after(response.headers.get("Retry-After")),
+            retryable=response.status_code in resilience.RETRYABLE_STATUSES,
+            detail=body.decode(errors="replace")[:500],
+        )
+
+    content_parts = []
+    reasoning_parts = []
+    usage = None
+    async for line in response.aiter_lines():
+        # Blank lines separate events and lines starting with ':' are
+        # keep-alive comments (e.g. ": OPENROUTER PROCESSING").
+        if not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            break
+
+        chunk = json.loads(payload)
+        if "error" in chunk:
+            raise _AttemptFailed("stream_error", detail=str(chunk["error"]))
+        if chunk.get("usage"):
+            # Sent with the last chunk, which may have no choices
+            usage = chunk["usage"]
+        if not chunk.get("choices"):
+            continue
+
+        delta = chunk["choices"][0].get("delta") or {}
+        if delta.get("reasoning"):
+            reasoning_parts.append(delta["reasoning"])
+        if delta.get("content"):
+            content_parts.append(delta["content"])
+            await on_delta(model, delta["content"])
+
+    return {
+        "model": model,
+        "content": "".join(content_parts),
+        "reasoning_details": "".join(reasoning_parts) or None,
+        "usage": usage,
+    }
+
 
-async def query_models_parallel(models: list, prompt: str, api_key: str):
+async def query_models_parallel(models: list, prompt: str, api_key: str, on_delta=None, deadline: float = None,
+                                max_tokens: int = None):
     """Queries multiple models in parallel and returns a list of their responses."""
-    async with aiohttp.ClientSession() as session:
-        tasks = [query_model(session, model, prompt, api_key) for model in models]
-        results = await asyncio.gather(*tasks)
-        # Filter out None results from failed requests
-        return [res for res in results if res is not None]
+    client = get_client()
+    tasks = [query_model(model, prompt, api_key, client, on_delta, deadline, max_tokens) for model in models]
+    results = await asyncio.gather(*tasks)
+    # Filter out None results from failed requests
+    return [res for res in results if res is not None]
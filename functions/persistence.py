@@ -0,0 +1,364 @@
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+
+from . import leaderboard
+
+# --- Firestore Persistence ---
+# A turn is stored as two message documents (user and assistant) under
+# conversations/{id}/messages. Stage 1 answers and stage 2 critiques are not
+# packed into the assistant document: each one is its own document in the
+# message's `stage_outputs` subcollection, so the message document stays small
+# whatever the council size or answer length. Outputs larger than
+# INLINE_MAX_BYTES are stored zlib-compressed, split into CHUNK_BYTES parts to
+# stay well under Firestore's 1 MiB document limit. Readers load the message
+# document alone and fetch stage outputs only when they need them.
+#
+# "sync" mode, the default, commits before returning. In "background" mode the
+# writes are committed after the response is sent: the turn is spooled to a
+# file in SPOOL_DIR, then a worker thread commits it, retrying with backoff.
+# The spool is a best-effort retry buffer local to the instance, not a durable
+# queue: only use background mode where the instance keeps its CPU and disk
+# after responding (e.g. Cloud Run with CPU always allocated). On Cloud
+# Functions an instance gets no CPU between requests and its /tmp is in memory,
+# so a spooled turn can stall, or be lost with the instance. Turns still spooled
+# when the same instance starts its worker again are committed then, and turns
+# that keep failing are moved to SPOOL_DIR/failed for inspection. Document ids
+# are chosen up front, so a retry rewrites the same documents.
+#
+# A turn's peer rankings are added to the model leaderboard (see leaderboard.py)
+# in leaderboard/global with field increments. They are committed in a batch of
+# their own that also creates a marker document for the turn under
+# leaderboard/global/turns: a retry of a batch that did commit (e.g. the process
+# died before it could drop the spool file) fails on the existing marker, so a
+# turn is never counted twice.
+
+PERSIST_MODE = os.environ.get("COUNCIL_PERSIST_MODE", "sync")
+SPOOL_DIR = os.environ.get("COUNCIL_PERSIST_SPOOL_DIR", "/tmp/council-persist")
+MAX_ATTEMPTS = int(os.environ.get("COUNCIL_PERSIST_MAX_ATTEMPTS", "8"))
+RETRY_BASE = float(os.environ.get("COUNCIL_PERSIST_RETRY_BASE", "1"))
+RETRY_MAX = float(os.environ.get("COUNCIL_PERSIST_RETRY_MAX", "60"))
+
+INLINE_MAX_BYTES = 16 * 1024
+CHUNK_BYTES = 512 * 1024
+BATCH_LIMIT = 500
+STAGES = ("stage1", "stage2", "stage3")
+LEADERBOARD_DOCUMENT = ("leaderboard", "global")
+LEADERBOARD_TURNS = "turns"
+
+
+# --- Encoding Stage Outputs ---
+
+def encode_output(stage: str, index: int, output: dict) -> list:
+    """Returns [(doc_id, data)] for one stage output: inline if small, else compressed chunks."""
+    base = {"stage": stage, "index": index, "model": output.get("model") if isinstance(output, dict) else None}
+    raw = json.dumps(output).encode("utf-8")
+    if len(raw) <= INLINE_MAX_BYTES:
+        return [(f"{stage}_{index:03d}", {**base, "output": output})]
+
+    blob = zlib.compress(raw)
+    parts = max(1, -(-len(blob) // CHUNK_BYTES))
+    return [
+        (f"{stage}_{index:03d}_{part:03d}", {
+            **base, "encoding": "zlib", "part": part, "parts": parts,
+            "data": blob[part * CHUNK_BYTES:(part + 1) * CHUNK_BYTES],
+        })
+        for part in range(parts)
+    ]
+
+
+def decode_outputs(docs) -> dict:
+    """Reassembles stage output documents into {stage: [output, ...]} in their original order."""
+    inline = {}
+    chunks = {}
+    for data in docs:
+        key = (data["stage"], data["index"])
+        if "output" in data:
+            inline[key] = data["output"]
+        else:
+            chunks.setdefault(key, {})[data["part"]] = (data["parts"], data["data"])
+
+    for key, parts in chunks.items():
+        expected = next(iter(parts.values()))[0]
+        if len(parts) != expected:
+            # Only part of the output was written; skip it rather than fail the read
+            print(f"Stage output {key} is missing parts ({len(parts)}/{expected})")
+            continue
+        inline[key] = json.loads(zlib.decompress(b"".join(parts[i][1] for i in range(expected))))
+
+    outputs = {}
+    for (stage, _), output in sorted(inline.items()):
+        outputs.setdefault(stage, []).append(output)
+    return outputs
+
+
+# --- Building and Committing Writes ---
+
+def new_turn(db, conversation_id: str, user_prompt: str, stage1: list, stage2: list, stage3: dict,
+             usage: dict = None, context: dict = None, leaderboard_delta: dict = None) -> dict:
+    """Allocates document ids for a turn (no network) and returns it as a JSON-serializable job."""
+    messages = db.collection("conversations").document(conversation_id).collection("messages")
+    return {
+        "conversation_id": conversation_id,
+        "user_message_id": messages.document().id,
+        "assistant_message_id": messages.document().id,
+        "user_prompt": user_prompt,
+        "stage1": stage1,
+        "stage2": stage2,
+        "stage3": stage3,
+        "usage": usage,
+        "context": context,
+        "leaderboard": leaderboard_delta,
+    }
+
+
+def build_writes(db, turn: dict) -> list:
+    """Returns [(doc_ref, data, merge)] for a turn, stage outputs first so readers never miss them.
+
+    The leaderboard update is not included: see leaderboard_writes.
+    """
+    conversation_ref = db.collection("conversations").document(turn["conversation_id"])
+    messages = conversation_ref.collection("messages")
+    assistant_ref = messages.document(turn["assistant_message_id"])
+    outputs = assistant_ref.collection("stage_outputs")
+
+    writes = []
+    stage_counts = {}
+    assistant = {"role": "assistant", "createdAt": firestore.SERVER_TIMESTAMP, "stagesStoredSeparately": True}
+    if turn.get("usage"):
+        assistant["usage"] = turn["usage"]
+    for stage in STAGES:
+        value = turn[stage]
+        if stage == "stage3" and len(json.dumps(value).encode("utf-8")) <= INLINE_MAX_BYTES:
+            # The final answer is what clients show first, so keep it on the message when it fits
+            assistant["stage3"] = value
+            continue
+        items = value if isinstance(value, list) else [value]
+        stage_counts[stage] = len(items)
+        for index, output in enumerate(items):
+            for doc_id, data in encode_output(stage, index, output):
+                writes.append((outputs.document(doc_id), data, False))
+    assistant["stageCounts"] = stage_counts
+
+    writes.append((messages.document(turn["user_message_id"]), {
+        "role": "user",
+        "content": turn["user_prompt"],
+        "createdAt": firestore.SERVER_TIMESTAMP
+    }, False))
+    writes.append((assistant_ref, assistant, False))
+    conversation = {"createdAt": firestore.SERVER_TIMESTAMP}
+    if turn.get("context") is not None:
+        # The rolling summary and recent turns (see context.py), read back on the next turn
+        conversation["context"] = turn["context"]
+    writes.append((conversation_ref, conversation, True))
+    return writes
+
+
+def leaderboard_writes(db, turn: dict) -> list:
+    """Returns [(doc_ref, data)] creating the turn's marker and adding its rankings, or [] if it has none."""
+    if not turn.get("leaderboard") or not turn["leaderboard"]["models"]:
+        return []
+    board_ref = _leaderboard_ref(db)
+    marker_ref = board_ref.collection(LEADERBOARD_TURNS).document(turn["assistant_message_id"])
+    return [
+        (marker_ref, {"conversationId": turn["conversation_id"], "countedAt": firestore.SERVER_TIMESTAMP}),
+        (board_ref, _increments(turn["leaderboard"])),
+    ]
+
+
+def _leaderboard_ref(db):
+    collection, document = LEADERBOARD_DOCUMENT
+    return db.collection(collection).document(document)
+
+
+def _increments(delta):
+    """A leaderboard delta with every number replaced by a Firestore increment, for a merged set."""
+    if isinstance(delta, dict):
+        return {key: _increments(value) for key, value in delta.items()}
+    return firestore.Increment(delta)
+
+
+def commit_turn(db, turn: dict):
+    """Writes a turn in batches of at most BATCH_LIMIT; safe to repeat after a partial failure."""
+    writes = build_writes(db, turn)
+    for start in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for ref, data, merge in writes[start:start + BATCH_LIMIT]:
+            batch.set(ref, data, merge=merge)
+        batch.commit()
+
+    counted = leaderboard_writes(db, turn)
+    if counted:
+        (marker_ref, marker), (board_ref, increments) = counted
+        batch = db.batch()
+        # create() fails if the marker exists, and with it the increments
+        batch.create(marker_ref, marker)
+        batch.set(board_ref, increments, merge=True)
+        try:
+            batch.commit()
+        except AlreadyExists:
+            pass  # Counted by an earlier attempt
+
+
+# --- Reading ---
+
+def load_context(db, conversation_id: str):
+    """Returns a conversation's rolling context (see context.py), or None for a new conversation.
+
+    A single document read, however long the conversation. In background mode
+    the previous turn may still be in the queue, in which case it is missing here.
+    """
+    snapshot = db.collection("conversations").document(conversation_id).get()
+    return (snapshot.to_dict() or {}).get("context") if snapshot.exists else None
+
+
+def load_leaderboard(db) -> dict:
+    """Returns the model leaderboard totals (see leaderboard.py) with a single document read."""
+    snapshot = _leaderboard_ref(db).get()
+    board = leaderboard.empty()
+    return {**board, **snapshot.to_dict()} if snapshot.exists else board
+
+
+def load_message(message_ref, include_stages: bool = False):
+    """Returns a message dict, or None. Stage outputs stored separately are fetched only if asked for."""
+    snapshot = message_ref.get()
+    if not snapshot.exists:
+        return None
+    message = snapshot.to_dict()
+    message["id"] = snapshot.id
+    if include_stages and message.pop("stagesStoredSeparately", False):
+        message.update(load_stage_outputs(message_ref))
+        for stage in message.pop("stageCounts", {}):
+            message.setdefault(stage, [])
+    return message
+
+
+def load_stage_outputs(message_ref, stage: str = None) -> dict:
+    """Returns {stage: outputs} for a message, optionally for a single stage only."""
+    collection = message_ref.collection("stage_outputs")
+    query = collection.where("stage", "==", stage) if stage else collection
+    outputs = decode_outputs(doc.to_dict() for doc in query.stream())
+    # stage3 is a single dict, the other stages are lists
+    if "stage3" in outputs:
+        outputs["stage3"] = outputs["stage3"][0]
+    return outputs
+
+
+# --- Background Commit Queue ---
+
+class PersistQueue:
+    """Commits spooled turns on a worker thread, retrying with exponential backoff."""
+
+    def __init__(self, commit, spool_dir: str = SPOOL_DIR, max_attempts: int = MAX_ATTEMPTS,
+                 retry_base: float = RETRY_BASE, retry_max: float = RETRY_MAX):
+        self.commit = commit
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, "failed")
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Starts the worker, first queueing any turns left in the spool by a previous process."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            os.makedirs(self.spool_dir, exist_ok=True)
+            for filename in sorted(os.listdir(self.spool_dir)):
+                if filename.endswith(".json"):
+                    self._queue.put(os.path.join(self.spool_dir, filename))
+            self._thread = threading.Thread(target=self._run, name="persist-queue", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, turn: dict):
+        """Spools a turn to disk, then hands it to the worker."""
+        self.start()
+        # Sortable names keep commits in arrival order after a restart
+        path = os.path.join(self.spool_dir, f"{time.time_ns():020d}-{turn['assistant_message_id']}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(turn, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._queue.put(path)
+
+    def pending(self) -> int:
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until every queued turn is committed or given up on. Returns False on timeout."""
+        end = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if end is not None and time.monotonic() >= end:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                self._process(path)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, path: str):
+        try:
+            with open(path, "r") as f:
+                turn = json.load(f)
+        except FileNotFoundError:
+            return  # Already committed (queued twice by a restart)
+        except ValueError as e:
+            print(f"Unreadable spooled turn {path}: {e}")
+            self._give_up(path)
+            return
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.commit(turn)
+                os.remove(path)
+                return
+            except Exception as e:
+                print(f"Persisting turn {turn['assistant_message_id']} failed (attempt {attempt}/{self.max_attempts}): {e}")
+                if attempt < self.max_attempts:
+                    time.sleep(min(self.retry_max, self.retry_base * 2 ** (attempt - 1)))
+        self._give_up(path)
+
+    def _give_up(self, path: str):
+        os.makedirs(self.failed_dir, exist_ok=True)
+        os.replace(path, os.path.join(self.failed_dir, os.path.basename(path)))
+
+
+_queues = {}
+
+
+def get_queue(db) -> PersistQueue:
+    """Returns the process-wide queue committing to `db`, starting it if needed."""
+    if id(db) not in _queues:
+        _queues[id(db)] = PersistQueue(lambda turn: commit_turn(db, turn))
+    persist_queue = _queues[id(db)]
+    persist_queue.start()
+    return persist_queue
+
+
+def save_turn(db, conversation_id: str, user_prompt: str, stage1: list, stage2: list, stage3: dict,
+              mode: str = PERSIST_MODE, usage: dict = None, context: dict = None, leaderboard_delta: dict = None) -> str:
+    """Persists a turn (now, or in the background) and returns the assistant message id."""
+    turn = new_turn(db, conversation_id, user_prompt, stage1, stage2, stage3, usage, context, leaderboard_delta)
+    if mode == "background":
+        try:
+            get_queue(db).enqueue(turn)
+            return turn["assistant_message_id"]
+        except OSError as e:
+            print(f"Could not spool turn, committing it now: {e}")
+    commit_turn(db, turn)
+    return turn["assistant_message_id"]
@@ -0,0 +1,134 @@
+import email.utils
+import os
+import random
+import time
+from collections import deque
+
+# --- Resilience Primitives for the OpenRouter Client ---
+# Retry backoff, Retry-After parsing, per-model latency tracking (used to
+# decide when to hedge) and per-model circuit breakers. `openrouter.py`
+# combines them; they hold no I/O themselves.
+
+MAX_RETRIES = int(os.environ.get("OPENROUTER_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.environ.get("OPENROUTER_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.environ.get("OPENROUTER_BACKOFF_MAX", "8"))
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Hedging is off unless a percentile is configured, e.g. OPENROUTER_HEDGE_PERCENTILE=95
+# sends a duplicate request once an attempt has run longer than that model's p95.
+HEDGE_PERCENTILE = float(os.environ["OPENROUTER_HEDGE_PERCENTILE"]) if os.environ.get("OPENROUTER_HEDGE_PERCENTILE") else None
+HEDGE_MIN_SAMPLES = int(os.environ.get("OPENROUTER_HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = int(os.environ.get("OPENROUTER_LATENCY_WINDOW", "200"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("OPENROUTER_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("OPENROUTER_BREAKER_COOLDOWN", "30"))
+
+
+def backoff_delay(attempt: int, retry_after: float = None) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def parse_retry_after(value: str):
+    """Parses a Retry-After header (delta-seconds or HTTP-date) into seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies for one model."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def record(self, latency: float):
+        self.samples.append(latency)
+
+    def percentile(self, p: float):
+        """Returns the p-th percentile, or None until enough samples have been seen."""
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """Stops calling a model after repeated failures, then probes it again after a cooldown."""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow_request(self) -> bool:
+        """Closed: always. Open: never. Half-open: a single probe at a time."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """Ends a probe that produced no outcome (e.g. it was cancelled), so the next call probes instead."""
+        self.probe_in_flight = False
+
+
+_breakers = {}
+_latencies = {}
+
+
+def breaker_for(model: str) -> CircuitBreaker:
+    """Returns the process-wide circuit breaker for a model."""
+    if model not in _breakers:
+        _breakers[model] = CircuitBreaker()
+    return _breakers[model]
+
+
+def latency_for(model: str) -> LatencyTracker:
+    """Returns the process-wide latency tracker for a model."""
+    if model not in _latencies:
+        _latencies[model] = LatencyTracker()
+    return _latencies[model]
+
+
+def hedge_threshold(model: str):
+    """Seconds after which a duplicate request should be sent, or None to not hedge."""
+    if HEDGE_PERCENTILE is None:
+        return None
+    return latency_for(model).percentile(HEDGE_PERCENTILE)
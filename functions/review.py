@@ -0,0 +1,69 @@
+import os
+import random
+
+# --- Peer Review Assignment ---
+# When every member reviews every answer, stage 2 sends N prompts that each
+# carry all N answers, so its input grows as N^2 x answer length. With
+# REVIEWS_PER_ANSWER = k, each answer is instead reviewed by k members other
+# than its author, and the reviews are spread evenly over the reviewers:
+# stage 2 then grows as k x N x answer length, which keeps councils of 10-30
+# members affordable.
+#
+# The design is balanced: answers are assigned in label order, each to the k
+# eligible reviewers with the fewest answers so far, so reviewer loads stay
+# nearly equal. Only as many reviewers are used as give each of them at least
+# MIN_ANSWERS_PER_REVIEWER answers to compare, and members that answered go
+# first. Ties are broken by an order seeded from the turn's content, so
+# identical inputs give identical prompts (and cache hits).
+#
+# Each reviewer ranks only the answers it was shown. Those partial orderings
+# are scored like the leaderboard scores them (see leaderboard.turn_delta): a
+# position normalized to 0..1 within the reviewer's own list.
+#
+# With k = 0, or k at least the number of other reviewers, every member reviews
+# every answer in one shared prompt, its own included, as before.
+
+REVIEWS_PER_ANSWER = int(os.environ.get("COUNCIL_REVIEWS_PER_ANSWER", "4"))
+MIN_ANSWERS_PER_REVIEWER = 2
+
+
+def is_full(reviewers: int, k: int = REVIEWS_PER_ANSWER) -> bool:
+    """Whether every reviewer is shown every answer."""
+    return k <= 0 or k >= reviewers - 1
+
+
+def reviewer_count(answers: int, reviewers: int, k: int = REVIEWS_PER_ANSWER) -> int:
+    """How many of the reviewers a sparse review of `answers` answers queries."""
+    if is_full(reviewers, k):
+        return reviewers
+    return max(k + 1, min(reviewers, k * answers // MIN_ANSWERS_PER_REVIEWER))
+
+
+def shown_fraction(answers: int, reviewers: int, k: int = REVIEWS_PER_ANSWER) -> float:
+    """Average fraction of the answers one queried reviewer is shown."""
+    if is_full(reviewers, k) or not answers:
+        return 1.0
+    return min(1.0, k / reviewer_count(answers, reviewers, k))
+
+
+def assign(authors: dict, reviewers: list, seed: str, k: int = REVIEWS_PER_ANSWER):
+    """Assigns answers to reviewers; returns {reviewer: [labels]} or None for a full review.
+
+    `authors` maps each answer's label to the model that wrote it, in label order.
+    """
+    if is_full(len(reviewers), k):
+        return None
+    rng = random.Random(seed)
+    # Members with an answer this turn are known to be up, so they review first
+    order = rng.sample(reviewers, len(reviewers))
+    authoring = set(authors.values())
+    order = [r for r in order if r in authoring] + [r for r in order if r not in authoring]
+    active = order[:reviewer_count(len(authors), len(reviewers), k)]
+    rank = {reviewer: i for i, reviewer in enumerate(active)}
+
+    assignment = {reviewer: [] for reviewer in active}
+    for label, author in authors.items():
+        eligible = sorted((r for r in active if r != author), key=lambda r: (len(assignment[r]), rank[r]))
+        for reviewer in eligible[:k]:
+            assignment[reviewer].append(label)
+    return {reviewer: labels for reviewer, labels in assignment.items() if labels}
@@ -0,0 +1,29 @@
+import asyncio
+import threading
+
+# --- Shared Event Loop ---
+# Cloud Function handlers are synchronous, but the council engine is async.
+# Calling asyncio.run() per request would build and tear down a loop (and with
+# it the pooled OpenRouter connections) every time. Instead, each worker
+# process runs one long-lived loop in a daemon thread and every request submits
+# its council run to it.
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Returns the worker's shared event loop, starting it on first use."""
+    global _loop
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="council-event-loop", daemon=True)
+            thread.start()
+    return _loop
+
+
+def run(coro, timeout: float = None):
+    """Runs a coroutine on the shared loop from synchronous code and returns its result."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    return future.result(timeout)
@@ -0,0 +1,43 @@
+import asyncio
+
+# --- Quorum / Deadline Scheduling ---
+# Waiting for every council member lets the slowest provider set the latency
+# of the whole run. `gather_quorum` releases the caller as soon as K results
+# are in or a latency budget has expired, and hands back whatever is still
+# running so the caller can decide whether to drop it or use it later.
+
+
+async def gather_quorum(tasks: dict, quorum: int = None, budget: float = None):
+    """Waits for `quorum` successful results or `budget` seconds, whichever comes first.
+
+    `tasks` maps asyncio tasks to a label (e.g. the model id). A task that returns
+    None counts as failed and does not contribute to the quorum. The budget never
+    releases the caller before at least one result has arrived.
+
+    Returns (results, late_tasks, trigger): `results` maps label -> result,
+    `late_tasks` maps the still-running tasks to their label, and `trigger` is
+    "all", "quorum" or "deadline".
+    """
+    loop = asyncio.get_running_loop()
+    quorum = len(tasks) if quorum is None else min(quorum, len(tasks))
+    deadline = None if budget is None else loop.time() + budget
+    pending = set(tasks)
+    results = {}
+    trigger = "all"
+
+    while pending and len(results) < quorum:
+        timeout = None
+        if deadline is not None and results:
+            timeout = max(0.0, deadline - loop.time())
+        done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            trigger = "deadline"
+            break
+        for task in done:
+            result = task.result()
+            if result is not None:
+                results[tasks[task]] = result
+
+    if pending and trigger == "all":
+        trigger = "quorum"
+    return results, {task: tasks[task] for task in pending}, trigger
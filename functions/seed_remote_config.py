@@ -0,0 +1,41 @@
+from firebase_admin import remoteconfig
+
+from .config import DEFAULT_CHAIRMAN_MODEL, DEFAULT_COUNCIL_MODELS
+
+# --- Remote Config Seeding ---
+# Adds the model parameters to the Remote Config template if they are missing.
+# Run once per project (or from a deploy script), not at function start-up:
+#   python -m functions.seed_remote_config
+
+
+def seed_template(client=None) -> bool:
+    """Publishes default model parameters if missing. Returns True if the template changed."""
+    client = client or remoteconfig.Client()
+    template = client.get_template()
+
+    changed = False
+    if "council_models" not in template.parameters:
+        template.parameters["council_models"] = remoteconfig.Parameter(
+            default_value={"value": ",".join(DEFAULT_COUNCIL_MODELS)},
+            description="Comma-separated list of OpenRouter model identifiers for the council.",
+            value_type=remoteconfig.ParameterValueType.STRING
+        )
+        changed = True
+    if "chairman_model" not in template.parameters:
+        template.parameters["chairman_model"] = remoteconfig.Parameter(
+            default_value={"value": DEFAULT_CHAIRMAN_MODEL},
+            description="The model identifier for the chairman.",
+            value_type=remoteconfig.ParameterValueType.STRING
+        )
+        changed = True
+
+    if changed:
+        client.publish_template(template)
+    return changed
+
+
+if __name__ == "__main__":
+    if seed_template():
+        print("Successfully published remote config template.")
+    else:
+        print("Remote config template already has the model parameters.")
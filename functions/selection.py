@@ -0,0 +1,151 @@
+import os
+import random
+import threading
+from collections import deque
+
+from . import accounting
+from . import resilience
+from . import telemetry
+
+# --- Adaptive Council Selection ---
+# With COUNCIL_SELECTION_SIZE = K (0 = off, every member is queried), each run
+# queries only K members of the configured roster, chosen from rolling
+# statistics this process keeps per model:
+#   - quality: the model's peer-ranking score in recent runs, normalized to
+#     0..1 (1 = ranked first by every reviewer, see calculate_aggregate_rankings)
+#   - failure rate: how often it was selected but produced no stage 1 answer
+#     (an error, an open circuit breaker, or too late for the quorum)
+#   - latency: a percentile of its recent successful calls (see resilience.py)
+# Both rates are smoothed towards a neutral prior, so a model with few
+# observations is neither trusted nor written off.
+#
+# Members are taken greedily by expected quality (quality x success rate),
+# skipping those whose latency percentile exceeds SELECTION_LATENCY_TARGET and
+# any whose projected cost would take the council over the run's budget. With
+# probability SELECTION_EXPLORE_RATE the weakest pick is swapped for the
+# least-observed other member, so the statistics of benched models stay fresh.
+# The decision and the numbers behind it are reported in metadata["selection"].
+
+SELECTION_SIZE = int(os.environ.get("COUNCIL_SELECTION_SIZE", "0"))
+SELECTION_LATENCY_TARGET = float(os.environ["COUNCIL_SELECTION_LATENCY_TARGET"]) if os.environ.get("COUNCIL_SELECTION_LATENCY_TARGET") else None
+SELECTION_LATENCY_PERCENTILE = float(os.environ.get("COUNCIL_SELECTION_LATENCY_PERCENTILE", "90"))
+SELECTION_EXPLORE_RATE = float(os.environ.get("COUNCIL_SELECTION_EXPLORE_RATE", "0.1"))
+SELECTION_WINDOW = int(os.environ.get("COUNCIL_SELECTION_WINDOW", "100"))
+# Latency samples needed before a model can be excluded for being slow
+SELECTION_MIN_LATENCY_SAMPLES = 5
+# Neutral prior and its weight in observations
+PRIOR_QUALITY = 0.5
+PRIOR_WEIGHT = 2
+
+SELECTIONS = telemetry.register(telemetry.Counter(
+    "council_selection_total", "Council members chosen by adaptive selection.", ("model", "reason")))
+
+
+class ModelStats:
+    """Rolling quality and failure observations for one model."""
+
+    def __init__(self, window: int = SELECTION_WINDOW):
+        self.quality = deque(maxlen=window)
+        self.failures = deque(maxlen=window)
+
+    def expected_quality(self) -> float:
+        return (sum(self.quality) + PRIOR_QUALITY * PRIOR_WEIGHT) / (len(self.quality) + PRIOR_WEIGHT)
+
+    def failure_rate(self) -> float:
+        return sum(self.failures) / (len(self.failures) + PRIOR_WEIGHT)
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def stats_for(model: str) -> ModelStats:
+    with _stats_lock:
+        if model not in _stats:
+            _stats[model] = ModelStats()
+        return _stats[model]
+
+
+def latency_percentile(model: str):
+    """The model's recent latency percentile in seconds, or None until there are enough samples."""
+    samples = sorted(resilience.latency_for(model).samples)
+    if len(samples) < SELECTION_MIN_LATENCY_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, int(round(SELECTION_LATENCY_PERCENTILE / 100 * (len(samples) - 1))))]
+
+
+def describe_model(model: str) -> dict:
+    """A model's current statistics; `utility` (expected quality x success rate) is what selection ranks by."""
+    stats = stats_for(model)
+    with _stats_lock:
+        quality, failure_rate, observations = stats.expected_quality(), stats.failure_rate(), len(stats.failures)
+    latency = latency_percentile(model)
+    return {
+        "model": model,
+        "quality": round(quality, 4),
+        "failure_rate": round(failure_rate, 4),
+        "latency": None if latency is None else round(latency, 3),
+        "observations": observations,
+        "utility": round(quality * (1 - failure_rate), 4),
+    }
+
+
+def select(roster: list, size: int, chairman_model: str, question: str, budget_usd: float = None,
+           latency_target: float = SELECTION_LATENCY_TARGET, explore_rate: float = SELECTION_EXPLORE_RATE,
+           rng: random.Random = None) -> dict:
+    """Chooses `size` members of `roster` for one run (see the rules above) and returns the decision."""
+    rng = rng or random
+    order = {model: i for i, model in enumerate(roster)}
+    # Ties go to the member listed first in the roster
+    candidates = sorted((describe_model(model) for model in roster), key=lambda c: (-c["utility"], order[c["model"]]))
+    selected = []
+    for candidate in candidates:
+        if len(selected) == size:
+            break
+        latency = candidate["latency"]
+        if latency_target is not None and latency is not None and latency > latency_target:
+            candidate["excluded"] = "latency"
+            continue
+        if budget_usd is not None and selected and accounting.project_cost(
+                selected + [candidate["model"]], chairman_model, question)["total"] > budget_usd:
+            candidate["excluded"] = "cost"
+            continue
+        selected.append(candidate["model"])
+    if not selected and candidates:
+        # No member meets the targets: the best one still answers
+        candidates[0].pop("excluded", None)
+        selected.append(candidates[0]["model"])
+
+    explored = None
+    benched = [c for c in candidates if c["model"] not in selected]
+    if selected and benched and rng.random() < explore_rate:
+        fewest = min(c["observations"] for c in benched)
+        explored = rng.choice([c["model"] for c in benched if c["observations"] == fewest])
+        selected[-1] = explored
+    for candidate in candidates:
+        candidate["selected"] = candidate["model"] in selected
+    for model in selected:
+        SELECTIONS.inc(model=model, reason="explore" if model == explored else "exploit")
+
+    return {
+        "size": size,
+        "council_models": selected,
+        "explored": explored,
+        "latency_target": latency_target,
+        "latency_percentile": SELECTION_LATENCY_PERCENTILE,
+        "budget_usd": budget_usd,
+        "candidates": candidates,
+    }
+
+
+def observe(council_models: list, stage1_responses: list, aggregate_rankings: list):
+    """Updates the statistics of the models that were queried in a finished run."""
+    answered = {resp["model"] for resp in stage1_responses}
+    # Already normalized to 0..1; a lone answer has nobody to be compared with
+    scores = {row["model"]: row["score"] for row in aggregate_rankings} if len(stage1_responses) > 1 else {}
+    for model in council_models:
+        stats = stats_for(model)
+        with _stats_lock:
+            stats.failures.append(0 if model in answered else 1)
+            if model in scores:
+                stats.quality.append(scores[model])
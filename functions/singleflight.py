@@ -0,0 +1,161 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import re
+from collections import deque
+
+from . import telemetry
+
+# --- Request Coalescing ---
+# A double-submitted message, or the same trending question asked by several
+# users at once, would otherwise launch one full council run (2N+1 model calls)
+# per request. Instead, identical requests that arrive while a run is in flight
+# attach to it: the run is keyed by its normalized prompt (whitespace
+# collapsed), the council lineup and every parameter that changes its outcome
+# (see `key_for`), and each key has at most one run in flight per worker.
+#
+# The run executes as a task of its own, in the context of the request that
+# started it (the leader), so its usage, cache and compaction statistics and
+# spans are recorded with that request. Every caller gets its own copy of the
+# result and persists it to its own conversation. A caller that goes away
+# detaches; the run is cancelled only once no caller is left.
+# COUNCIL_COALESCE_ENABLED=0 gives every request a run of its own.
+#
+# Events a run publishes (e.g. SSE stage events) are numbered from 1 and kept,
+# so a subscriber that attaches late, or reconnects after the last event it saw,
+# replays what it missed and then follows live. Events published as droppable
+# (token deltas) are kept only in a buffer of the last STREAM_BUFFER_EVENTS;
+# the others (stage results, which also carry everything the deltas did) are
+# always kept. A Flight can also run on its own, without a key (see launch).
+
+COALESCE_ENABLED = os.environ.get("COUNCIL_COALESCE_ENABLED", "1") != "0"
+STREAM_BUFFER_EVENTS = int(os.environ.get("COUNCIL_STREAM_BUFFER_EVENTS", "2000"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+COALESCED = telemetry.register(telemetry.Counter(
+    "council_coalesced_total", "Requests that joined an identical council run already in flight."))
+
+
+def normalize(prompt: str) -> str:
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def key_for(prompt: str, council_models: list, chairman_model: str, **params) -> str:
+    """The coalescing key of a council run: identical keys may share one run."""
+    payload = json.dumps([normalize(prompt), list(council_models), chairman_model, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """One in-flight run, its numbered events and the callers attached to it. Used on one event loop."""
+
+    def __init__(self, key: str = None, buffer_events: int = STREAM_BUFFER_EVENTS):
+        self.key = key
+        self.task = None
+        self.seq = 0
+        # (seq, event) pairs: every event that is never dropped, and the latest droppable ones
+        self.kept = []
+        self.recent = deque(maxlen=buffer_events)
+        self.callers = 0
+        self.done = False
+        self._waiters = []
+
+    def launch(self, start):
+        """Runs `start(flight)` as this flight's task and returns the flight."""
+        self.task = asyncio.create_task(start(self))
+        self.task.add_done_callback(self._finish)
+        return self
+
+    def publish(self, event, droppable: bool = False) -> int:
+        """Hands an event to every subscriber, present and future, and returns its sequence number."""
+        self.seq += 1
+        (self.recent if droppable else self.kept).append((self.seq, event))
+        self._wake()
+        return self.seq
+
+    def events_after(self, seq: int) -> list:
+        """The (seq, event) pairs still buffered that were published after `seq`, in order."""
+        return sorted(_newer(self.kept, seq) + _newer(self.recent, seq), key=lambda item: item[0])
+
+    async def subscribe(self, after: int = 0):
+        """Yields (seq, event) for every event published after `after` that is still buffered, until the run ends."""
+        seen = after
+        while True:
+            pending = self.events_after(seen)
+            for seq, event in pending:
+                yield seq, event
+                seen = seq
+            if pending:
+                continue
+            if self.done:
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    async def result(self):
+        """Waits for the run and returns a copy of its result; leaving does not cancel the run for the others."""
+        return copy.deepcopy(await asyncio.shield(self.task))
+
+    def leave(self):
+        """Detaches a caller; the run is cancelled when the last one leaves before it ends."""
+        self.callers -= 1
+        if self.callers <= 0 and not self.task.done():
+            self.task.cancel()
+
+    def _finish(self, _task):
+        self.done = True
+        if _flights.get(self.key) is self:
+            del _flights[self.key]
+        self._wake()
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+_flights = {}
+
+
+def _newer(events, seq: int) -> list:
+    """The trailing (seq, event) pairs of `events` published after `seq`."""
+    newer = []
+    for item in reversed(events):
+        if item[0] <= seq:
+            break
+        newer.append(item)
+    newer.reverse()
+    return newer
+
+
+def join(key: str, start):
+    """Attaches to the run in flight under `key`, or starts `start(flight)` as one; returns (flight, leader).
+
+    Every caller must call flight.leave() once it is done with the flight.
+    """
+    flight = _flights.get(key) if COALESCE_ENABLED else None
+    leader = flight is None
+    if leader:
+        flight = Flight(key)
+        if COALESCE_ENABLED:
+            _flights[key] = flight
+        flight.launch(start)
+    else:
+        COALESCED.inc()
+    flight.callers += 1
+    return flight, leader
+
+
+async def do(key: str, start):
+    """Runs `start(flight)`, or waits for the identical run in flight; returns (result, leader)."""
+    flight, leader = join(key, start)
+    try:
+        return await flight.result(), leader
+    finally:
+        flight.leave()
+
@@ -0,0 +1,390 @@
+import atexit
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+
+# --- Tracing and Metrics ---
+# Spans time each council stage, each model call and each storage operation.
+# They nest through a context variable, so a model call made inside a stage
+# span becomes its child, including calls made from tasks the stage spawned.
+# Finished spans are:
+# - collected for the current council run when `start_trace()` was called, so
+#   `summarize()` can attach timings to the response metadata
+# - exported in batches as OTLP/HTTP JSON when OTEL_EXPORTER_OTLP_ENDPOINT is
+#   set, e.g. http://localhost:4318 for a local OpenTelemetry collector
+#
+# Counters and histograms are kept in-process and rendered in the Prometheus
+# text format by `render_metrics()`, which the FastAPI app serves on /metrics.
+
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "llm-council")
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+EXPORT_INTERVAL = float(os.environ.get("COUNCIL_TRACE_EXPORT_INTERVAL", "5"))
+EXPORT_MAX_QUEUE = int(os.environ.get("COUNCIL_TRACE_EXPORT_MAX_QUEUE", "4096"))
+
+# Seconds; covers fast storage operations up to the slowest stage deadlines
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+# --- Spans ---
+
+class Span:
+    """A timed operation with attributes, identified like an OpenTelemetry span."""
+
+    def __init__(self, name: str, attributes: dict, parent=None):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else random.getrandbits(128)
+        self.span_id = random.getrandbits(64)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.duration = None
+        self.error = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self):
+        self.duration = time.perf_counter() - self._started
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+
+
+_current_span = contextvars.ContextVar("council_span", default=None)
+_trace = contextvars.ContextVar("council_trace", default=None)
+
+
+class span:
+    """Times the enclosed block as a child of the current span: `with telemetry.span("name", key=value) as s:`."""
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> Span:
+        self.span = Span(self.name, self.attributes, _current_span.get())
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Exited from another context, e.g. an async generator closed by a different task
+            pass
+        self.span.end()
+        _finish(self.span)
+
+
+def traced_stage(stage: str):
+    """Decorator that traces a coroutine function as a council stage span and records its duration."""
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(f"council.{stage}", stage=stage) as stage_span:
+                result = await func(*args, **kwargs)
+            record_stage(stage_span)
+            return result
+        return wrapper
+    return decorate
+
+
+def current_attribute(key: str, default=None):
+    """Looks up an attribute on the current span or its nearest ancestor that has it."""
+    current = _current_span.get()
+    while current is not None:
+        if key in current.attributes:
+            return current.attributes[key]
+        current = current.parent
+    return default
+
+
+def start_trace() -> list:
+    """Starts collecting the spans finished in the current council run and returns the list."""
+    spans = []
+    _trace.set(spans)
+    return spans
+
+
+def current_trace():
+    """The span list of the council run in progress, or None."""
+    return _trace.get()
+
+
+def _finish(finished: Span):
+    spans = _trace.get()
+    if spans is not None:
+        spans.append(finished)
+    if _exporter is not None:
+        _exporter.submit(finished)
+
+
+def summarize(spans: list) -> dict:
+    """Condenses a run's spans into the timings attached to response metadata (milliseconds)."""
+    stages = {}
+    calls = []
+    storage = []
+    for s in spans:
+        ms = round(s.duration * 1000, 1)
+        if s.name.startswith("council.stage"):
+            stage = s.attributes.get("stage")
+            stages[stage] = round(stages.get(stage, 0) + ms, 1)
+        elif s.name == "openrouter.chat":
+            calls.append({
+                "stage": s.attributes.get("stage"),
+                "model": s.attributes.get("model"),
+                "outcome": s.attributes.get("outcome"),
+                "queue_ms": s.attributes.get("queue_ms"),
+                "governor_wait_ms": s.attributes.get("governor_wait_ms"),
+                "ttfb_ms": s.attributes.get("ttfb_ms"),
+                "total_ms": ms,
+                "bytes": s.attributes.get("bytes", 0),
+                "retries": s.attributes.get("retries", 0),
+            })
+        elif s.name.startswith("storage."):
+            storage.append({"op": s.attributes.get("op"), "ms": ms})
+    return {"stages_ms": stages, "calls": calls, "storage": storage}
+
+
+# --- Metrics ---
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_values(names, labels: dict) -> tuple:
+    return tuple("" if labels.get(name) is None else str(labels[name]) for name in names)
+
+
+def _label_text(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_values(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = _label_values(self.labels, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_values(self.labels, labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [per-bucket counts, sum, count]
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {bucket_count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {count}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("council_stage_seconds", "Duration of each council stage.", ("stage",))
+MODEL_CALL_SECONDS = Histogram("openrouter_call_seconds", "Duration of model calls, retries included.", ("stage", "model", "outcome"))
+MODEL_QUEUE_SECONDS = Histogram("openrouter_queue_seconds", "Time from a model call starting to its first request being sent.", ("model",))
+MODEL_TTFB_SECONDS = Histogram("openrouter_ttfb_seconds", "Time to the response headers of the successful attempt.", ("model",))
+MODEL_CALLS = Counter("openrouter_calls_total", "Model calls by outcome.", ("stage", "model", "outcome"))
+MODEL_RETRIES = Counter("openrouter_retries_total", "Extra attempts (retries and hedges) made by model calls.", ("model",))
+MODEL_RESPONSE_BYTES = Counter("openrouter_response_bytes_total", "Response bytes received from OpenRouter.", ("model",))
+STORAGE_SECONDS = Histogram("storage_operation_seconds", "Duration of storage operations, thread pool wait included.", ("op", "backend"))
+CACHE_LOOKUPS = Counter("council_cache_lookups_total", "Response cache lookups by result.", ("result",))
+
+REGISTRY = [
+    STAGE_SECONDS, MODEL_CALL_SECONDS, MODEL_QUEUE_SECONDS, MODEL_TTFB_SECONDS, MODEL_CALLS,
+    MODEL_RETRIES, MODEL_RESPONSE_BYTES, STORAGE_SECONDS, CACHE_LOOKUPS,
+]
+
+
+def register(metric):
+    """Adds a Counter, Gauge or Histogram defined elsewhere to the /metrics output."""
+    REGISTRY.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def record_stage(finished: Span):
+    STAGE_SECONDS.observe(finished.duration, stage=finished.attributes.get("stage"))
+
+
+def record_model_call(finished: Span):
+    attributes = finished.attributes
+    model, stage, outcome = attributes.get("model"), attributes.get("stage") or "", attributes.get("outcome")
+    MODEL_CALL_SECONDS.observe(finished.duration, stage=stage, model=model, outcome=outcome)
+    MODEL_CALLS.inc(stage=stage, model=model, outcome=outcome)
+    if attributes.get("queue_ms") is not None:
+        MODEL_QUEUE_SECONDS.observe(attributes["queue_ms"] / 1000, model=model)
+    if attributes.get("ttfb_ms") is not None:
+        MODEL_TTFB_SECONDS.observe(attributes["ttfb_ms"] / 1000, model=model)
+    if attributes.get("retries"):
+        MODEL_RETRIES.inc(attributes["retries"], model=model)
+    if attributes.get("bytes"):
+        MODEL_RESPONSE_BYTES.inc(attributes["bytes"], model=model)
+
+
+# --- OTLP Export ---
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(s: Span) -> dict:
+    """One span in the OTLP/JSON encoding."""
+    encoded = {
+        "traceId": f"{s.trace_id:032x}",
+        "spanId": f"{s.span_id:016x}",
+        "name": s.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items() if v is not None],
+        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+    if s.parent is not None:
+        encoded["parentSpanId"] = f"{s.parent.span_id:016x}"
+    return encoded
+
+
+class OTLPExporter:
+    """Batches finished spans and POSTs them to `<endpoint>/v1/traces` from a background thread."""
+
+    def __init__(self, endpoint: str, interval: float = EXPORT_INTERVAL, max_queue: int = EXPORT_MAX_QUEUE):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.interval = interval
+        self.dropped = 0
+        self._spans = deque()
+        self._max_queue = max_queue
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, finished: Span):
+        with self._lock:
+            if len(self._spans) >= self._max_queue:
+                self.dropped += 1
+                return
+            self._spans.append(finished)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch = list(self._spans)
+            self._spans.clear()
+        if not batch:
+            return
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "llm-council"}, "spans": [to_otlp(s) for s in batch]}],
+        }]}
+        try:
+            httpx.post(self.url, json=payload, timeout=5).raise_for_status()
+        except Exception as e:
+            # Telemetry must never break a council run
+            print(f"Could not export {len(batch)} spans to {self.url}: {e}")
+
+
+_exporter = None
+
+
+def configure_exporter(endpoint: str = OTLP_ENDPOINT):
+    """Exports spans to an OTLP/HTTP collector, or stops exporting if `endpoint` is empty."""
+    global _exporter
+    _exporter = OTLPExporter(endpoint) if endpoint else None
+
+
+def flush():
+    """Sends any spans still waiting for export."""
+    if _exporter is not None:
+        _exporter.flush()
+
+
+configure_exporter()
+atexit.register(flush)
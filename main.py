@@ -1,5 +1,230 @@
+"""Run the LLM Council offline over a JSONL file of prompts.
+
+Each input line is either a JSON string or an object with a prompt (and
+optionally an id); ids default to the line number:
+
+    {"id": "q-17", "prompt": "What causes the seasons?"}
+
+Every item runs the full 3-stage council from functions/council.py, on one
+event loop and one pooled OpenRouter client. ``--concurrency`` bounds the items
+in flight and ``--model-concurrency`` the calls in flight per model; calls also
+pass the rate limits of functions/governor.py, which admits them round-robin across
+items. Results
+are appended to the output JSONL as each item completes (in completion order,
+with its id). The output doubles as the checkpoint: when the command is run
+again, items already in it are skipped, so an interrupted run picks up where it
+stopped. Failed items are retried on the next run with ``--retry-failed``.
+
+Usage:
+    uv run python main.py prompts.jsonl results.jsonl --concurrency 16 --model-concurrency 8
+    uv run python main.py prompts.jsonl results.jsonl --models openai/gpt-5.1,x-ai/grok-4 --chairman openai/gpt-5.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+# How often completed results are fsynced to disk
+SYNC_EVERY = 20
+# How often progress is reported (seconds)
+PROGRESS_INTERVAL = 10
+
+
+def read_items(path: str, prompt_field: str, id_field: str):
+    """Yield (id, prompt) for every line of the input file."""
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                yield str(line_number), item
+                continue
+            prompt = item.get(prompt_field)
+            if not isinstance(prompt, str) or not prompt.strip():
+                raise ValueError(f"{path}:{line_number}: missing '{prompt_field}'")
+            yield str(item.get(id_field, line_number)), prompt
+
+
+def read_checkpoint(path: str, retry_failed: bool) -> set:
+    """Ids already in the output file (only the successful ones with retry_failed)."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn last line from an interrupted run; that item runs again
+                continue
+            if record.get("status") == "ok" or not retry_failed:
+                done.add(record["id"])
+    return done
+
+
+class ResultWriter:
+    """Appends one JSON line per result, flushing each and fsyncing every SYNC_EVERY."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a+b")
+        # Start on a fresh line if the previous run was cut off mid-write
+        if self.file.seek(0, os.SEEK_END) > 0:
+            self.file.seek(-1, os.SEEK_END)
+            if self.file.read(1) != b"\n":
+                self.file.write(b"\n")
+        self.unsynced = 0
+
+    def write(self, record: dict):
+        self.file.write((json.dumps(record, default=str) + "\n").encode("utf-8"))
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= SYNC_EVERY:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+class Progress:
+    """Counts finished items and periodically reports throughput and cost on stderr."""
+
+    def __init__(self, total: int, skipped: int):
+        self.total = total
+        self.skipped = skipped
+        self.ok = 0
+        self.failed = 0
+        self.cost = 0.0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def record(self, record: dict):
+        if record["status"] == "ok":
+            self.ok += 1
+            self.cost += record["metadata"]["usage"]["total"]["cost"]
+        else:
+            self.failed += 1
+        if time.monotonic() - self.last_report >= PROGRESS_INTERVAL:
+            self.report()
+
+    def report(self):
+        self.last_report = time.monotonic()
+        elapsed = self.last_report - self.started
+        done = self.ok + self.failed
+        rate = done / elapsed if elapsed else 0.0
+        remaining = self.total - self.skipped - done
+        eta = f", eta {remaining / rate:.0f}s" if rate and remaining > 0 else ""
+        print(f"[batch] {done + self.skipped}/{self.total} done ({self.skipped} from checkpoint), "
+              f"{self.failed} failed, {rate:.2f} items/s, ${self.cost:.4f}{eta}", file=sys.stderr)
+
+
+async def run_item(engine, item_id: str, prompt: str, args, api_key: str) -> dict:
+    """Run the council on one prompt and return its output record."""
+    started = time.monotonic()
+    try:
+        stage1, stage2, stage3, metadata = await engine.run_full_council(
+            args.models, args.chairman, prompt, api_key,
+            quorum=args.quorum, stage_deadlines=args.stage_deadlines, budget_usd=args.budget_usd,
+            flow=item_id, council_size=args.council_size
+        )
+    except Exception as e:
+        return {"id": item_id, "status": "error", "error": f"{type(e).__name__}: {e}",
+                "seconds": round(time.monotonic() - started, 3)}
+    if not stage1:
+        return {"id": item_id, "status": "error", "error": "all council models failed in stage 1",
+                "seconds": round(time.monotonic() - started, 3)}
+    return {
+        "id": item_id,
+        "status": "ok",
+        "prompt": prompt,
+        "stage1": stage1,
+        "stage2": stage2,
+        "stage3": stage3,
+        "metadata": metadata,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+async def run_batch(items, done: set, writer: ResultWriter, progress: Progress, args, api_key: str):
+    """Run every pending item with at most args.concurrency in flight."""
+    from functions import council as engine
+    from functions import openrouter
+
+    pending = ((item_id, prompt) for item_id, prompt in items if item_id not in done)
+
+    async def worker():
+        # Workers pull from one shared generator, so the input is never loaded all at once
+        for item_id, prompt in pending:
+            record = await run_item(engine, item_id, prompt, args, api_key)
+            writer.write(record)
+            progress.record(record)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    finally:
+        await openrouter.close_client()
+
+
 def main():
-    print("Hello from llm-council!")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of prompts")
+    parser.add_argument("output", help="JSONL file results are appended to (also the checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=8, help="council runs in flight")
+    parser.add_argument("--model-concurrency", type=int, default=16, help="calls in flight per model (0 = no limit)")
+    parser.add_argument("--models", help="comma-separated council models (default: backend config)")
+    parser.add_argument("--chairman", help="chairman model (default: backend config)")
+    parser.add_argument("--quorum", type=int, help="start stage 2 once this many stage 1 answers are in")
+    parser.add_argument("--council-size", type=int,
+                        help="query only this many of the models per item, chosen adaptively (see functions/selection.py)")
+    parser.add_argument("--budget-usd", type=float, help="cost budget per item (see functions/accounting.py)")
+    parser.add_argument("--prompt-field", default="prompt")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--retry-failed", action="store_true", help="rerun items whose last result was an error")
+    parser.add_argument("--cache-dir", help="keep a disk response cache here, so reruns reuse identical calls")
+    args = parser.parse_args()
+
+    from backend import config
+    from functions import cache
+    from functions import governor
+
+    if not config.OPENROUTER_API_KEY:
+        parser.error("OPENROUTER_API_KEY is not set")
+    args.models = args.models.split(",") if args.models else list(config.COUNCIL_MODELS)
+    args.chairman = args.chairman or config.CHAIRMAN_MODEL
+    args.stage_deadlines = config.STAGE_DEADLINES
+    governor.configure(model_max_in_flight=args.model_concurrency)
+    if args.cache_dir:
+        cache.configure(disk_dir=args.cache_dir)
+
+    # Validate the whole input up front rather than fail halfway through
+    total = sum(1 for _ in read_items(args.input, args.prompt_field, args.id_field))
+    done = read_checkpoint(args.output, args.retry_failed)
+    skipped = sum(1 for item_id, _ in read_items(args.input, args.prompt_field, args.id_field) if item_id in done)
+    progress = Progress(total, skipped)
+    writer = ResultWriter(args.output)
+    exit_code = 0
+    try:
+        asyncio.run(run_batch(read_items(args.input, args.prompt_field, args.id_field), done, writer, progress,
+                              args, config.OPENROUTER_API_KEY))
+        exit_code = 1 if progress.failed else 0
+    except KeyboardInterrupt:
+        print("[batch] interrupted; rerun the same command to resume", file=sys.stderr)
+        exit_code = 130
+    finally:
+        writer.close()
+        progress.report()
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,22 @@
+import threading
+
+import pytest
+
+from backend import storage_json, storage_sqlite
+from backend.index import ConversationIndex
+
+
+@pytest.fixture
+def json_backend(tmp_path, monkeypatch):
+    """The JSON storage backend, writing under tmp_path."""
+    monkeypatch.setattr(storage_json, "DATA_DIR", str(tmp_path / "conversations"))
+    monkeypatch.setattr(storage_json, "_index", ConversationIndex(storage_json.get_index_path(), storage_json._iter_all_meta))
+    return storage_json
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path, monkeypatch):
+    """The SQLite storage backend, with a fresh database under tmp_path."""
+    monkeypatch.setattr(storage_sqlite, "SQLITE_PATH", str(tmp_path / "council.db"))
+    monkeypatch.setattr(storage_sqlite, "_local", threading.local())
+    return storage_sqlite
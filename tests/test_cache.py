@@ -0,0 +1,29 @@
+import os
+import time
+
+from functions import cache
+
+
+def test_disk_cache_overwrite_counts_the_entry_once(tmp_path):
+    disk = cache.DiskCache(str(tmp_path), max_bytes=1024 * 1024)
+    disk.set("ab" * 32, {"content": "x" * 100})
+    size = disk._size
+    for _ in range(5):
+        disk.set("ab" * 32, {"content": "x" * 100})
+    assert disk._size == size
+    disk.set("ab" * 32, {"content": "x" * 10})
+    assert disk._size == size - 90
+    assert disk.get("ab" * 32) == {"content": "x" * 10}
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    disk = cache.DiskCache(str(tmp_path), max_bytes=500)
+    for i in range(10):
+        key = f"{i:02d}" * 32
+        disk.set(key, {"content": "x" * 90})
+        # Distinct access times, oldest first, whatever the filesystem's mtime resolution
+        stamp = time.time() - 100 + i
+        os.utime(disk._path(key), (stamp, stamp))
+    assert disk._size <= 500
+    assert disk.get("09" * 32) is not None
+    assert disk.get("00" * 32) is None
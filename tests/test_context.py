@@ -0,0 +1,77 @@
+import asyncio
+
+from functions import context
+
+
+def state_with(turns: int) -> dict:
+    state = None
+    for i in range(turns):
+        state = context.add_turn(state, f"question {i}", f"answer {i}")
+    return state
+
+
+def refresh(state, monkeypatch, summary):
+    async def query_model(model, prompt, api_key, **kwargs):
+        return {"content": summary} if summary else None
+
+    monkeypatch.setattr(context, "query_model", query_model)
+    return asyncio.run(context.refresh_summary(state, "key"))
+
+
+def test_refresh_folds_all_but_the_window(monkeypatch):
+    stale = state_with(context.CONTEXT_TURNS + context.SUMMARY_BATCH_TURNS)
+    refreshed = refresh(stale, monkeypatch, "the summary")
+    assert refreshed["summary"] == "the summary"
+    assert refreshed["summarized_turns"] == context.SUMMARY_BATCH_TURNS
+    assert refreshed["offset"] == context.SUMMARY_BATCH_TURNS
+    assert refreshed["turns"] == stale["turns"][-context.CONTEXT_TURNS:]
+    assert not context.is_stale(refreshed)
+
+
+def test_failed_refresh_trims_the_window_and_retries(monkeypatch):
+    stale = state_with(context.CONTEXT_TURNS + context.SUMMARY_BATCH_TURNS)
+    failed = refresh(stale, monkeypatch, None)
+    assert failed["turns"] == stale["turns"][-context.CONTEXT_TURNS:]
+    assert failed["pending"] == stale["turns"][:context.SUMMARY_BATCH_TURNS]
+    assert failed["summarized_turns"] == 0
+    # The folded turns are retried on the next turn, with the turns that left the window since
+    retried = refresh(context.add_turn(failed, "q", "a"), monkeypatch, "caught up")
+    assert retried["summarized_turns"] == context.SUMMARY_BATCH_TURNS + 1
+    assert retried["pending"] == []
+    assert len(retried["turns"]) == context.CONTEXT_TURNS
+
+
+def test_pending_turns_are_bounded(monkeypatch):
+    state = state_with(context.CONTEXT_TURNS)
+    for i in range(3 * context.PENDING_MAX_TURNS):
+        state = refresh(context.add_turn(state, f"q{i}", f"a{i}"), monkeypatch, None)
+        assert len(state["turns"]) <= context.CONTEXT_TURNS + context.SUMMARY_BATCH_TURNS
+    assert len(state["pending"]) == context.PENDING_MAX_TURNS
+
+
+def test_merge_keeps_concurrent_turns(monkeypatch):
+    base = state_with(2)
+    first = context.add_turn(base, "first", "1")
+    second = context.add_turn(base, "second", "2")
+
+    stored = context.merge(base, base, first)
+    stored = context.merge(stored, base, second)
+    assert [turn["user"] for turn in stored["turns"]] == ["question 0", "question 1", "first", "second"]
+
+
+def test_merge_applies_a_refresh_made_before_another_turn_saved(monkeypatch):
+    base = state_with(context.CONTEXT_TURNS + context.SUMMARY_BATCH_TURNS)
+    refreshed = context.add_turn(refresh(base, monkeypatch, "summary"), "refreshing", "r")
+    other = context.add_turn(base, "other", "o")
+
+    stored = context.merge(base, base, other)
+    stored = context.merge(stored, base, refreshed)
+    assert stored["summary"] == "summary"
+    assert stored["offset"] == context.SUMMARY_BATCH_TURNS
+    assert [turn["user"] for turn in stored["turns"]][-2:] == ["other", "refreshing"]
+    assert len(stored["turns"]) == context.CONTEXT_TURNS + 2
+
+    # A refresh of the same turns that is saved later does not fold them twice
+    again = context.merge(stored, base, context.add_turn(refresh(base, monkeypatch, "other summary"), "late", "l"))
+    assert again["summary"] == "summary"
+    assert [turn["user"] for turn in again["turns"]][-1] == "late"
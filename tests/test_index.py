@@ -0,0 +1,52 @@
+import pytest
+
+from backend.index import ConversationIndex, decode_cursor
+
+
+def meta(i, title=None):
+    return {"id": f"c{i:03d}", "created_at": f"2026-01-01T00:00:{i:02d}", "title": title or f"t{i}",
+            "message_count": 0, "extra": "ignored"}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ConversationIndex(str(tmp_path / "_index.jsonl"), lambda: [])
+    for i in range(25):
+        index.upsert(meta(i))
+    return index
+
+
+def test_pages_walk_every_conversation_newest_first(index):
+    seen, cursor = [], None
+    while True:
+        records, cursor = index.page(limit=10, cursor=cursor)
+        seen.extend(record["id"] for record in records)
+        if cursor is None:
+            break
+    assert seen == [f"c{i:03d}" for i in reversed(range(25))]
+    assert "extra" not in index.page(limit=1)[0][0]
+
+
+def test_cursor_is_stable_when_conversations_are_added(index):
+    first, cursor = index.page(limit=10)
+    index.upsert(meta(40))
+    second, _ = index.page(limit=10, cursor=cursor)
+    assert second[0]["id"] == "c014"
+
+
+def test_updates_replace_records_and_other_workers_are_seen(index, tmp_path):
+    other = ConversationIndex(index.path, lambda: [])
+    other.upsert(meta(3, title="renamed"))
+    records, _ = index.page()
+    assert len(records) == 25
+    assert next(record for record in records if record["id"] == "c003")["title"] == "renamed"
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    index = ConversationIndex(str(tmp_path / "_index.jsonl"), lambda: [meta(1), meta(2)])
+    assert [record["id"] for record in index.page()[0]] == ["c002", "c001"]
+
+
+def test_invalid_cursor_raises():
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
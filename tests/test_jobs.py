@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from functions import jobs
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+def test_enqueue_and_claim_by_priority(path):
+    store = jobs.JobStore(path)
+    low = store.enqueue({"n": 1})
+    high = store.enqueue({"n": 2}, priority=5)
+    assert store.get(low["id"])["ahead"] == 1
+    assert store.get(high["id"])["ahead"] == 0
+
+    claimed = store.claim()
+    assert claimed["id"] == high["id"]
+    assert claimed["status"] == "running" and claimed["attempts"] == 1
+    assert store.claim()["id"] == low["id"]
+    assert store.claim() is None
+
+
+def test_group_jobs_run_one_at_a_time_in_order(path):
+    store = jobs.JobStore(path)
+    first = store.enqueue({}, group="conversation")
+    second = store.enqueue({}, group="conversation", priority=9)
+    other = store.enqueue({}, group="other")
+
+    # A higher priority does not overtake an earlier job of the same group
+    assert store.claim()["id"] == first["id"]
+    assert store.claim()["id"] == other["id"]
+    assert store.claim() is None
+    store.finish(first["id"], {"ok": True})
+    assert store.claim()["id"] == second["id"]
+
+
+def test_finish_records_result_or_error(path):
+    store = jobs.JobStore(path)
+    done, failed = store.enqueue({}), store.enqueue({})
+    store.claim(), store.claim()
+    store.set_progress(done["id"], {"event": "stage1_complete"})
+    store.finish(done["id"], {"answer": 42})
+    store.finish(failed["id"], error="boom")
+
+    assert store.get(done["id"])["status"] == "done"
+    assert store.get(done["id"])["result"] == {"answer": 42}
+    assert store.get(done["id"])["progress"] == {"event": "stage1_complete"}
+    assert store.get(failed["id"])["status"] == "failed"
+    assert store.get(failed["id"])["error"] == "boom"
+    assert store.counts() == {"done": 1, "failed": 1}
+
+
+def test_recover_leaves_live_leases_alone(path):
+    running = jobs.JobStore(path)
+    job = running.enqueue({})
+    running.claim()
+
+    # Another process starting up must not take over a job whose lease is current
+    assert jobs.JobStore(path).recover() == 0
+    assert running.get(job["id"])["status"] == "running"
+
+
+def test_recover_requeues_expired_leases_then_gives_up(path):
+    crashed = jobs.JobStore(path, lease=-1)
+    job = crashed.enqueue({"n": 1})
+    crashed.claim()
+
+    survivor = jobs.JobStore(path)
+    assert survivor.recover(max_attempts=2) == 1
+    assert survivor.get(job["id"])["status"] == "queued"
+
+    # The crashed worker's late updates no longer apply
+    crashed.finish(job["id"], {"late": True})
+    assert survivor.get(job["id"])["status"] == "queued"
+
+    crashed.claim()
+    assert survivor.recover(max_attempts=2) == 0
+    assert survivor.get(job["id"])["status"] == "failed"
+    assert survivor.get(job["id"])["attempts"] == 2
+
+
+def test_recover_deletes_old_finished_jobs(path):
+    store = jobs.JobStore(path)
+    job = store.enqueue({})
+    store.claim()
+    store.finish(job["id"], {})
+    store.recover(retention=-1)
+    assert store.get(job["id"]) is None
+
+
+def test_queue_caps_concurrency_and_requeues_on_stop(path):
+    running = []
+    peak = []
+
+    async def handler(job, report):
+        running.append(job["id"])
+        peak.append(len(running))
+        await report({"event": "started"})
+        try:
+            if job["payload"].get("hang"):
+                await asyncio.sleep(3600)
+            await asyncio.sleep(0.05)
+            return {"n": job["payload"]["n"]}
+        finally:
+            running.remove(job["id"])
+
+    async def main():
+        queue = jobs.JobQueue(handler, jobs.JobStore(path), workers=2, poll=0.05)
+        await queue.start()
+        submitted = [await queue.submit({"n": n}) for n in range(5)]
+        hanging = await queue.submit({"n": 5, "hang": True}, priority=-1)
+        for job in submitted + [hanging]:
+            while (await queue.get(job["id"]))["status"] not in ("done", "running"):
+                await asyncio.sleep(0.02)
+        while (await queue.get(submitted[-1]["id"]))["status"] != "done":
+            await asyncio.sleep(0.02)
+        await queue.stop()
+        return submitted, hanging, queue
+
+    submitted, hanging, queue = asyncio.run(main())
+    assert max(peak) == 2
+    assert [queue.store.get(job["id"])["result"] for job in submitted] == [{"n": n} for n in range(5)]
+    # The job interrupted by the shutdown waits for the next start
+    assert queue.store.get(hanging["id"])["status"] == "queued"
+
+
+def test_queue_stops_a_job_taken_over_by_another_worker(path):
+    async def handler(job, report):
+        await asyncio.sleep(3600)
+
+    async def main():
+        queue = jobs.JobQueue(handler, jobs.JobStore(path, lease=0.3), workers=1, poll=0.05)
+        await queue.start()
+        job = await queue.submit({})
+        while (await queue.get(job["id"]))["status"] != "running":
+            await asyncio.sleep(0.02)
+        # Another queue takes the job over, as if this one's lease had expired
+        other = jobs.JobStore(path, lease=3600)
+        other._write(("UPDATE jobs SET worker = ? WHERE id = ?", (other.worker, job["id"])))
+        other.renew(job["id"])
+        await asyncio.sleep(0.3)
+        idle = queue._running == 0
+        await queue.stop()
+        return idle, other.get(job["id"])
+
+    idle, job = asyncio.run(main())
+    assert idle
+    assert job["status"] == "running"
@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("firebase_admin")
+
+from functions import leaderboard  # noqa: E402
+from functions import persistence  # noqa: E402
+from functions.firestore_fake import FakeFirestore  # noqa: E402
+
+STAGE1 = [{"model": "a/one", "response": "first"}, {"model": "b/two", "response": "second"}]
+STAGE2 = [
+    {"model": "a/one", "ranking": "...", "parsed_ranking": ["Response B", "Response A"]},
+    {"model": "b/two", "ranking": "...", "parsed_ranking": ["Response A", "Response B"]},
+]
+STAGE3 = {"model": "c/chair", "response": "final"}
+LABELS = {"Response A": "a/one", "Response B": "b/two"}
+
+
+def save(db, mode="sync"):
+    return persistence.save_turn(
+        db, "conversation", "question?", STAGE1, STAGE2, STAGE3, mode=mode,
+        leaderboard_delta=leaderboard.turn_delta(STAGE2, LABELS)
+    )
+
+
+def test_turn_is_stored_and_counted_once():
+    db = FakeFirestore()
+    message_id = save(db)
+    messages = db.collection("conversations").document("conversation").collection("messages")
+    message = persistence.load_message(messages.document(message_id), include_stages=True)
+    assert message["stage1"] == STAGE1 and message["stage3"] == STAGE3
+    assert persistence.load_leaderboard(db)["turns"] == 1
+
+
+def test_replaying_a_committed_turn_does_not_count_it_twice():
+    db = FakeFirestore()
+    turn = persistence.new_turn(db, "conversation", "question?", STAGE1, STAGE2, STAGE3,
+                                leaderboard_delta=leaderboard.turn_delta(STAGE2, LABELS))
+    persistence.commit_turn(db, turn)
+    # As after a crash between the last commit and removing the spool file
+    persistence.commit_turn(db, turn)
+    board = persistence.load_leaderboard(db)
+    assert board["turns"] == 1
+    assert board["models"]["a/one"]["votes"] == 2
+
+
+def test_background_queue_retries_failed_commits(tmp_path, monkeypatch):
+    db = FakeFirestore()
+    queue = persistence.PersistQueue(lambda turn: persistence.commit_turn(db, turn), spool_dir=str(tmp_path),
+                                     retry_base=0.01)
+    monkeypatch.setitem(persistence._queues, id(db), queue)
+    db.fail_next_commits = 2
+    save(db, mode="background")
+    assert queue.flush(timeout=5)
+    assert persistence.load_leaderboard(db)["turns"] == 1
+    assert not list(tmp_path.glob("*.json"))
@@ -0,0 +1,58 @@
+from functions import leaderboard
+from functions.council import calculate_aggregate_rankings
+
+LABELS = {"Response A": "a/one", "Response B": "b/two", "Response C": "c/three"}
+
+
+def test_aggregate_rankings_order_by_mean_borda_points():
+    rankings = [
+        {"model": "a/one", "parsed_ranking": ["Response B", "Response A", "Response C"]},
+        {"model": "b/two", "parsed_ranking": ["Response A", "Response B", "Response C"]},
+        {"model": "c/three", "parsed_ranking": ["Response B", "Response C", "Response A"]},
+    ]
+    rows = calculate_aggregate_rankings(rankings, LABELS)
+    assert [row["model"] for row in rows] == ["b/two", "a/one", "c/three"]
+    assert rows[0] == {"model": "b/two", "average_score": 2.67, "score": 0.8333, "votes": 3}
+    assert "rating" not in rows[0]
+
+
+def test_sparse_rankings_are_normalized_per_reviewer():
+    # Each reviewer saw two of the three answers
+    rankings = [
+        {"model": "a/one", "parsed_ranking": ["Response B", "Response C"]},
+        {"model": "b/two", "parsed_ranking": ["Response C", "Response A"]},
+        {"model": "c/three", "parsed_ranking": ["Response A", "Response B"]},
+    ]
+    scores = {row["model"]: row["score"] for row in calculate_aggregate_rankings(rankings, LABELS)}
+    assert scores == {"a/one": 0.5, "b/two": 0.5, "c/three": 0.5}
+
+
+def test_turn_delta_counts_the_same_rankings_for_the_leaderboard():
+    rankings = [
+        {"model": "a/one", "parsed_ranking": ["Response B", "Response A"]},
+        {"model": "b/two", "parsed_ranking": ["Response B", "Response A"]},
+    ]
+    board = leaderboard.merge(leaderboard.empty(), leaderboard.turn_delta(rankings, LABELS))
+    assert board["turns"] == 1
+    assert board["models"]["b/two"]["first_places"] == 2
+    assert board["pairs"] == {"b/two": {"a/one": 2}}
+
+
+def test_lists_of_different_lengths_are_ordered_by_normalized_score():
+    labels = {**LABELS, "Response D": "d/four", "Response E": "e/five"}
+    # B tops the two short lists it was shown; A is second in both long lists,
+    # which is worth more Borda points but a lower position
+    rankings = [
+        {"model": "a/one", "parsed_ranking": ["Response D", "Response A", "Response C", "Response E"]},
+        {"model": "b/two", "parsed_ranking": ["Response D", "Response A", "Response C", "Response E"]},
+        {"model": "c/three", "parsed_ranking": ["Response B", "Response C"]},
+        {"model": "d/four", "parsed_ranking": ["Response B", "Response E"]},
+    ]
+    rows = calculate_aggregate_rankings(rankings, labels)
+    assert [row["model"] for row in rows] == ["d/four", "b/two", "a/one", "c/three", "e/five"]
+    assert rows[1]["average_score"] < rows[2]["average_score"]
+
+    standings = [row["model"] for row in leaderboard.standings(
+        leaderboard.merge(leaderboard.empty(), leaderboard.turn_delta(rankings, labels))
+    )]
+    assert standings.index("b/two") < standings.index("a/one")
@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+
+from functions import openrouter
+from functions import resilience
+
+
+def open_breaker(threshold=2, cooldown=30):
+    breaker = resilience.CircuitBreaker(failure_threshold=threshold, cooldown=cooldown)
+    for _ in range(threshold):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    return breaker
+
+
+def cool_down(breaker):
+    breaker.opened_at -= breaker.cooldown + 1
+
+
+def test_breaker_opens_after_threshold():
+    breaker = open_breaker()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = open_breaker()
+    cool_down(breaker)
+    assert breaker.state == "half_open"
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_probe_success_closes():
+    breaker = open_breaker()
+    cool_down(breaker)
+    breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_probe_failure_reopens():
+    breaker = open_breaker()
+    cool_down(breaker)
+    breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    cool_down(breaker)
+    assert breaker.allow_request()
+
+
+def test_cancelled_probe_releases_the_breaker(monkeypatch):
+    model = "test/hanging-model"
+    breaker = open_breaker()
+    cool_down(breaker)
+    monkeypatch.setitem(resilience._breakers, model, breaker)
+
+    async def hang(request):
+        await asyncio.sleep(3600)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(hang)) as client:
+            probe = asyncio.create_task(openrouter.query_model(model, "hi", "key", client=client))
+            await asyncio.sleep(0.05)
+            assert breaker.probe_in_flight
+            probe.cancel()
+            await asyncio.gather(probe, return_exceptions=True)
+
+    asyncio.run(main())
+    assert breaker.state == "half_open"
+    assert not breaker.probe_in_flight
+    assert breaker.allow_request()
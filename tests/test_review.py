@@ -0,0 +1,46 @@
+from collections import Counter
+
+from functions import review
+
+
+def members(n):
+    return [f"model/{i}" for i in range(n)]
+
+
+def authors_of(models):
+    return {f"Response {chr(ord('A') + i)}": model for i, model in enumerate(models)}
+
+
+def test_full_review_when_k_covers_every_reviewer():
+    models = members(5)
+    assert review.assign(authors_of(models), models, "seed", k=4) is None
+    assert review.assign(authors_of(models), models, "seed", k=0) is None
+
+
+def test_each_answer_gets_k_reviews_from_other_members():
+    models = members(12)
+    authors = authors_of(models)
+    assignment = review.assign(authors, models, "seed", k=3)
+
+    reviews = Counter(label for labels in assignment.values() for label in labels)
+    assert reviews == {label: 3 for label in authors}
+    for reviewer, labels in assignment.items():
+        assert all(authors[label] != reviewer for label in labels)
+        assert len(labels) == len(set(labels))
+
+
+def test_reviewer_loads_are_balanced():
+    models = members(20)
+    assignment = review.assign(authors_of(models), models, "seed", k=4)
+    loads = [len(labels) for labels in assignment.values()]
+    assert max(loads) - min(loads) <= 1
+    assert min(loads) >= review.MIN_ANSWERS_PER_REVIEWER
+
+
+def test_assignment_is_deterministic_and_prefers_members_that_answered():
+    models = members(10)
+    answered = models[:4]
+    authors = authors_of(answered)
+    first = review.assign(authors, models, "seed", k=2)
+    assert first == review.assign(authors, models, "seed", k=2)
+    assert set(first) <= set(answered)
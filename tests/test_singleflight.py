@@ -0,0 +1,79 @@
+import asyncio
+
+from functions import singleflight
+
+
+def test_identical_requests_share_one_run():
+    calls = []
+
+    async def start(flight):
+        calls.append(flight.key)
+        await asyncio.sleep(0.05)
+        return {"answer": 42}
+
+    async def main():
+        return await asyncio.gather(*(singleflight.do("key", start) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert calls == ["key"]
+    assert [leader for _, leader in results] == [True, False, False]
+    # Every caller gets its own copy of the result
+    assert results[0][0] == results[1][0] == {"answer": 42}
+    assert results[0][0] is not results[1][0]
+    assert singleflight._flights == {}
+
+
+def test_run_survives_until_the_last_caller_leaves():
+    async def start(flight):
+        await asyncio.sleep(3600)
+
+    async def main():
+        flight, leader = singleflight.join("key", start)
+        same, follower = singleflight.join("key", start)
+        assert same is flight and leader and not follower
+        await asyncio.sleep(0)
+
+        flight.leave()
+        await asyncio.sleep(0)
+        assert not flight.task.done()
+        flight.leave()
+        await asyncio.gather(flight.task, return_exceptions=True)
+        return flight
+
+    flight = asyncio.run(main())
+    assert flight.task.cancelled()
+    assert singleflight._flights == {}
+
+
+def test_departing_caller_does_not_cancel_the_others():
+    async def start(flight):
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        leaving = asyncio.create_task(singleflight.do("key", start))
+        staying = asyncio.create_task(singleflight.do("key", start))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        await asyncio.gather(leaving, return_exceptions=True)
+        return await staying
+
+    assert asyncio.run(main()) == ("done", False)
+
+
+def test_late_subscriber_replays_missed_events():
+    async def start(flight):
+        flight.publish("stage1")
+        for token in ("a", "b", "c"):
+            flight.publish(token, droppable=True)
+        flight.publish("stage3")
+
+    async def main():
+        flight = singleflight.Flight(buffer_events=2).launch(start)
+        await flight.task
+        return [event async for event in flight.subscribe()], [event async for event in flight.subscribe(after=3)]
+
+    everything, resumed = asyncio.run(main())
+    # The oldest droppable event fell out of the buffer; the others are kept
+    assert everything == [(1, "stage1"), (3, "b"), (4, "c"), (5, "stage3")]
+    assert resumed == [(4, "c"), (5, "stage3")]
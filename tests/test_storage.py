@@ -0,0 +1,129 @@
+import json
+import os
+
+import pytest
+
+STAGE1 = [{"model": "a/one", "response": "first"}, {"model": "b/two", "response": "second"}]
+STAGE2 = [{"model": "a/one", "ranking": "FINAL RANKING: Response B", "parsed_ranking": ["Response B"]}]
+STAGE3 = {"model": "c/chair", "response": "final"}
+DELTA = {"turns": 1, "models": {"a/one": {"turns": 1, "votes": 1, "points": 1, "score": 1.0, "first_places": 1}},
+         "pairs": {}}
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request):
+    return request.getfixturevalue(f"{request.param}_backend")
+
+
+def run_turns(backend, conversation_id="conversation"):
+    backend.create_conversation(conversation_id)
+    assert backend.add_user_message(conversation_id, "question?") == 0
+    position = backend.add_assistant_message(conversation_id, STAGE1, [], None, status="in_progress")
+    backend.update_assistant_message(conversation_id, position, {"stage2": STAGE2, "stage3": STAGE3, "status": "complete"})
+    backend.update_conversation_title(conversation_id, "A title")
+    backend.update_conversation_context(conversation_id, lambda current: {"turns": [(current or {}).get("n", 0)], "n": 1})
+    backend.update_conversation_context(conversation_id, lambda current: {**current, "n": current["n"] + 1})
+    backend.update_leaderboard(DELTA)
+    return backend.get_conversation(conversation_id)
+
+
+def test_turn_is_stored(backend):
+    stored = run_turns(backend)
+    assert stored["messages"][0] == {"role": "user", "content": "question?"}
+    assert stored["messages"][1] == {"role": "assistant", "stage1": STAGE1, "stage2": STAGE2, "stage3": STAGE3,
+                                     "status": "complete"}
+    assert stored["title"] == "A title"
+    assert backend.list_conversations()[0]["message_count"] == 2
+
+
+def test_backends_store_the_same_conversation(json_backend, sqlite_backend):
+    stored = [run_turns(backend) for backend in (json_backend, sqlite_backend)]
+    for conversation in stored:
+        conversation.pop("created_at")
+    assert stored[0] == stored[1]
+    assert stored[0]["context"] == {"turns": [0], "n": 2}
+    assert json_backend.get_leaderboard() == sqlite_backend.get_leaderboard()
+
+
+def test_listing_pages_newest_first(backend):
+    for i in range(5):
+        backend.create_conversation(f"c{i}")
+    seen, cursor = [], None
+    while True:
+        page, cursor = backend.list_conversations_page(limit=2, cursor=cursor)
+        seen.extend(record["id"] for record in page)
+        if cursor is None:
+            break
+    assert sorted(seen) == [f"c{i}" for i in range(5)]
+    assert seen == [record["id"] for record in backend.list_conversations()]
+
+
+def test_missing_conversations(backend):
+    assert backend.get_conversation("missing") is None
+    with pytest.raises(ValueError):
+        backend.add_user_message("missing", "hello")
+
+
+def test_json_log_is_replayed_over_the_snapshot(json_backend):
+    expected = run_turns(json_backend)
+    assert json_backend._read_meta("conversation")["log_bytes"] > 0
+
+    json_backend.compact_conversation("conversation")
+    assert not os.path.exists(json_backend.get_log_path("conversation"))
+    assert json_backend.get_conversation("conversation") == expected
+
+
+def test_json_compaction_interrupted_before_dropping_the_log(json_backend):
+    expected = run_turns(json_backend)
+    with open(json_backend.get_log_path("conversation"), "rb") as f:
+        log = f.read()
+    json_backend.compact_conversation("conversation")
+    # The snapshot was written but the log survived: its entries must not apply twice
+    with open(json_backend.get_log_path("conversation"), "wb") as f:
+        f.write(log)
+    assert json_backend.get_conversation("conversation") == expected
+
+
+def test_json_torn_log_line_is_skipped(json_backend):
+    json_backend.create_conversation("conversation")
+    json_backend.add_user_message("conversation", "first")
+    with open(json_backend.get_log_path("conversation"), "ab") as f:
+        f.write(b'{"seq": 2, "op": "mess')
+    json_backend.add_user_message("conversation", "second")
+    messages = json_backend.get_conversation("conversation")["messages"]
+    assert [message["content"] for message in messages] == ["first", "second"]
+
+
+def test_json_log_is_compacted_once_it_outgrows_the_snapshot(json_backend, monkeypatch):
+    monkeypatch.setattr(json_backend, "COMPACT_MIN_LOG_BYTES", 0)
+    json_backend.create_conversation("conversation")
+    for i in range(5):
+        json_backend.add_user_message("conversation", f"message {i}")
+    meta = json_backend._read_meta("conversation")
+    assert meta["log_bytes"] <= meta["snapshot_bytes"]
+    with open(json_backend.get_conversation_path("conversation")) as f:
+        assert json.load(f)["compacted_seq"] > 0
+    assert len(json_backend.get_conversation("conversation")["messages"]) == 5
+
+
+def test_json_context_update_does_not_replay_the_conversation(json_backend, monkeypatch):
+    json_backend.create_conversation("conversation")
+    json_backend.update_conversation_context("conversation", lambda current: {"n": 1})
+
+    replays = []
+    replay = json_backend._replay
+    monkeypatch.setattr(json_backend, "_replay", lambda conversation_id: replays.append(conversation_id) or replay(conversation_id))
+    json_backend.update_conversation_context("conversation", lambda current: {"n": current["n"] + 1})
+    assert replays == []
+    assert json_backend.get_conversation("conversation")["context"] == {"n": 2}
+
+
+def test_json_context_kept_in_the_log_is_carried_over(json_backend):
+    json_backend.create_conversation("conversation")
+    # As written before the context had a file of its own
+    json_backend._append_entry("conversation", "context", context={"n": 1})
+    json_backend.update_conversation_context("conversation", lambda current: {"n": current["n"] + 1})
+    json_backend.compact_conversation("conversation")
+    assert json_backend.get_conversation("conversation")["context"] == {"n": 2}
+    # The context file is not listed as a conversation
+    assert [record["id"] for record in json_backend._iter_all_meta()] == ["conversation"]
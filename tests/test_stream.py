@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from backend import main, storage
+
+STAGE1 = [{"model": "a/one", "response": "first"}]
+STAGE3 = {"model": "c/chair", "response": "final"}
+
+
+@pytest.fixture
+def app(json_backend, monkeypatch):
+    if storage._backend is not json_backend:
+        pytest.skip("the facade is configured for another storage backend")
+
+    async def run_council_stream(flight, prompt, context_state, budget_usd):
+        flight.publish({"type": "stage1_start"})
+        for token in ("fi", "rst"):
+            flight.publish({"type": "delta", "stage": "stage1", "model": "a/one", "delta": token}, droppable=True)
+        flight.publish({"type": "stage1_complete", "data": STAGE1, "metadata": {}})
+        flight.publish({"type": "stage2_complete", "data": [], "metadata": {}})
+        flight.publish({"type": "stage3_complete", "data": STAGE3})
+        return {"stage1": STAGE1, "stage2": [], "stage3": STAGE3, "label_to_model": {}, "budget": None,
+                "selection": None, "context": context_state}
+
+    async def generate_conversation_title(content):
+        return "A title"
+
+    monkeypatch.setattr(main, "_run_council_stream", run_council_stream)
+    monkeypatch.setattr(main, "generate_conversation_title", generate_conversation_title)
+    monkeypatch.setattr(main, "_stream_turns", {})
+    return main.app
+
+
+def parse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["id"], json.loads(fields["data"])))
+    return events
+
+
+def test_resume_replays_events_after_last_event_id(app):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            conversation = (await client.post("/api/conversations", json={})).json()
+            path = f"/api/conversations/{conversation['id']}/message/stream"
+            streamed = parse((await client.post(path, json={"content": "question?"})).text)
+
+            resumed = parse((await client.get(path, headers={"Last-Event-ID": streamed[2][0]})).text)
+            by_query = parse((await client.get(path, params={"after": streamed[2][0]})).text)
+            # An id from another turn replays the whole turn
+            restarted = parse((await client.get(path, headers={"Last-Event-ID": "other:3"})).text)
+            missing = await client.get("/api/conversations/missing/message/stream")
+            stored = (await client.get(f"/api/conversations/{conversation['id']}")).json()
+            return streamed, resumed, by_query, restarted, missing, stored
+
+    streamed, resumed, by_query, restarted, missing, stored = asyncio.run(run())
+    assert [event["type"] for _, event in streamed] == [
+        "stage1_start", "delta", "delta", "stage1_complete", "stage2_complete", "stage3_complete",
+        "title_complete", "complete"
+    ]
+    assert [seq for seq, _ in streamed] == [streamed[0][0].split(":")[0] + f":{n}" for n in range(1, 9)]
+    assert resumed == by_query == streamed[3:]
+    assert restarted == streamed
+    assert missing.status_code == 404
+    assert stored["title"] == "A title"
+    assert stored["messages"][1]["stage3"] == STAGE3
+    assert stored["messages"][1]["status"] == "complete"